@@ -0,0 +1,266 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, time, asyncio, threading, contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import constants
+from utils import get_system, get_png_path, create_devices_with_tries, buffer_to_ndarray, get_buffer_info
+from roi import crop_image
+from multi_capture import get_serial, configure_devices
+from encoder import create_writer, split_workers
+from catalog import create_catalog_writer
+
+"""
+asyncio frame source
+
+    async with AsyncFrameSource(device) as source:
+        async for frame in source:
+            process(frame.arr, frame.info)
+
+Every blocking SDK call of a device (start_stream, get_buffer, requeue_buffer,
+stop_stream) runs on one dedicated thread of that device, so the event loop
+never blocks and several cameras, network traffic and writers can share it.
+"""
+
+class Frame:
+    """
+    One acquired frame. arr is a zero-copy view on the buffer (the host crop
+    of the source applied) and is only
+    valid until the buffer is requeued: automatically when the next frame is
+    requested or the stream is closed, or explicitly with release().
+    Use copy() to keep the image longer.
+    """
+    def __init__(self, source, buffer, idx):
+        self.source = source
+        self.buffer = buffer
+        self.idx = idx
+        self.arr = crop_image(buffer_to_ndarray(buffer), source.crop)
+        self.info = get_buffer_info(buffer)
+
+    def copy(self):
+        return self.arr.copy()
+
+    async def release(self):
+        if self.buffer is not None:
+            buffer, self.buffer, self.arr = self.buffer, None, None
+            await self.source._call(self.source.device.requeue_buffer, buffer)
+
+class AsyncFrameSource:
+    """
+    Async context manager and async iterator over the frames of one device
+    (1) __aenter__ reads the serial and starts the stream with num_buffers
+        buffers, both on the device thread
+    (2) Every iteration requeues the previous frame's buffer and waits for the
+        next one. get_buffer is given timeout (ms) and the wait is bounded by
+        it as well, a timeout raises asyncio.TimeoutError
+    (3) When the waiting task is cancelled the buffer that still arrives is
+        requeued, so no buffer is lost
+    (4) __aexit__ requeues the last buffer and stops the stream
+    Iteration ends after max_frames frames (0 = never), crop is the host crop
+    from set_configuration().
+    """
+    def __init__(self, device, num_buffers=None, timeout=None, max_frames=0, crop=None):
+        num_buffers = constants.NUM_BUFFERS if num_buffers is None else num_buffers
+        timeout = constants.TIMEOUT if timeout is None else timeout
+        self.device = device
+        self.crop = crop
+        self.num_buffers = num_buffers
+        self.timeout = timeout
+        self.max_frames = max_frames
+        self.serial = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='arena')
+        self.stream = contextlib.ExitStack()
+        self.frame = None
+        self.count = 0
+
+    async def _call(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def _start(self):
+        self.serial = get_serial(self.device)
+        threading.current_thread().name = f'arena-{self.serial}'
+        self.stream.enter_context(self.device.start_stream(self.num_buffers))
+
+    def _stop(self):
+        self.device.stop_stream()
+        self.stream.close()
+
+    async def __aenter__(self):
+        # (1)
+        await self._call(self._start)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # (4)
+        try:
+            await self.release()
+            await self._call(self._stop)
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def release(self):
+        if self.frame is not None:
+            frame, self.frame = self.frame, None
+            await frame.release()
+
+    async def get_frame(self):
+        """
+        Next frame, the previous one is released first
+        """
+        # (2)
+        await self.release()
+        future = self.executor.submit(self.device.get_buffer, timeout=self.timeout)
+        try:
+            buffer = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout / 1000)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # (3) The SDK call can not be interrupted, requeue what it returns
+            future.add_done_callback(self._requeue_late)
+            raise
+
+        self.frame = Frame(self, buffer, self.count)
+        self.count += 1
+        return self.frame
+
+    def _requeue_late(self, future):
+        if not future.cancelled() and future.exception() is None:
+            try:
+                self.executor.submit(self.device.requeue_buffer, future.result())
+            except RuntimeError:
+                pass  # the stream was closed in the meantime
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.max_frames and self.count >= self.max_frames:
+            await self.release()
+            raise StopAsyncIteration
+        return await self.get_frame()
+
+class AsyncWriter:
+    """
+    Runs writer(arr, idx, info) on a thread pool behind a bounded asyncio
+    queue, so saving never blocks the event loop. put() waits when the
+    queue is full.
+    A failing write is stored and the queue keeps being drained, the error
+    is raised by the next put() and by __aexit__.
+    """
+    def __init__(self, writer, num_writers=None, queue_size=None):
+        num_writers = constants.NUM_WRITERS if num_writers is None else num_writers
+        queue_size = constants.QUEUE_SIZE if queue_size is None else queue_size
+        self.writer = writer
+        self.num_writers = num_writers
+        self.frames = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=num_writers, thread_name_prefix='writer')
+        self.tasks = []
+        self.written = 0
+        self.errors = []
+
+    async def _write(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.frames.get()
+            try:
+                if item is None:
+                    return
+                await loop.run_in_executor(self.executor, self.writer, *item)
+                self.written += 1
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.frames.task_done()
+
+    async def __aenter__(self):
+        self.tasks = [asyncio.create_task(self._write()) for _ in range(self.num_writers)]
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        for _ in self.tasks:
+            await self.frames.put(None)
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            self.executor.shutdown(wait=True)
+            self.writer.close()
+        if self.errors:
+            raise self.errors[0]
+
+    async def put(self, arr, idx, info):
+        if self.errors:
+            raise self.errors[0]
+        await self.frames.put((arr, idx, info))
+
+async def stream_device(device, writer, num_images, crop=None):
+    """
+    Streams one device into writer, frames are copied out of the buffer
+    before they are queued
+    """
+    async with AsyncFrameSource(device, max_frames=num_images, crop=crop) as source:
+        async for frame in source:
+            await writer.put(frame.copy(), frame.idx, frame.info)
+        return source.count
+
+async def gather_or_cancel(tasks):
+    """
+    asyncio.gather that cancels and awaits the remaining tasks as soon as
+    one of them fails, so none is left running (and blocked on a writer
+    queue) while the writers are closed
+    """
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def capture_async(num_images=None):
+    """
+    Captures from every connected device on one event loop
+    (1) Create and configure all devices
+    (2) One AsyncFrameSource per device, one AsyncWriter per device saving
+        to PNG_PATH/<serial>
+    (3) All streams run concurrently as tasks of the same event loop, when
+        one fails the others are cancelled before the writers are closed
+    """
+    num_images = constants.NUM_IMAGES if num_images is None else num_images
+    # (1)
+    loop = asyncio.get_running_loop()
+    devices = await loop.run_in_executor(None, create_devices_with_tries)
+    crops = await loop.run_in_executor(None, configure_devices, devices)
+
+    # (2), (3)
+    start = time.perf_counter()
+    async with contextlib.AsyncExitStack() as stack:
+        tasks = []
+        num_workers = split_workers(len(devices))
+        for device, crop in zip(devices, crops):
+            serial = get_serial(device)
+            png_path = os.path.join(get_png_path(), serial)
+            writer = await stack.enter_async_context(AsyncWriter(create_catalog_writer(
+                create_writer(png_path, num_workers=num_workers), png_path, device.nodemap, crop)))
+            tasks.append(asyncio.create_task(stream_device(device, writer, num_images, crop), name=serial))
+        counts = await gather_or_cancel(tasks)
+    elapsed = time.perf_counter() - start
+
+    for device, count in zip(devices, counts):
+        print('%s : %d frames in %.2f sec (%.1f fps)' % (get_serial(device), count, elapsed, count / elapsed))
+
+    get_system().destroy_device()
+    print(f'Destroyed all created devices')
+
+if __name__ == "__main__":
+
+    asyncio.run(capture_async())
@@ -0,0 +1,254 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, time, socket, struct, itertools
+
+import constants
+from utils import get_system, create_devices_with_tries, streaming_setup, buffer_to_ndarray, get_buffer_info
+from configuration import set_configuration
+from metrics import CaptureMetrics
+
+"""
+Stream autotuning
+
+Runs short calibration streams over the combinations of buffer count,
+buffer handling mode and packet size / inter-packet delay, measures each one
+and keeps the fastest configuration without lost frames. The result is
+stored per camera and host NIC (the stream destination address) in
+constants.AUTOTUNE_PATH, apply_stream_settings() uses it for every later run.
+"""
+
+# Device nodes of the GigE Vision stream channel
+PACKET_SIZE_NODE = 'DeviceStreamChannelPacketSize'
+PACKET_DELAY_NODE = 'GevSCPD'
+DESTINATION_NODE = 'GevSCDA'
+
+def get_stream_key(device):
+    """
+    '<serial>/<host NIC address>', the NIC being where the camera streams to
+    """
+    nodemap = device.nodemap
+    serial = str(nodemap.get_node('DeviceSerialNumber').value)
+    destination = nodemap.get_node(DESTINATION_NODE)
+    nic = 'unknown'
+    if destination is not None and destination.is_readable:
+        value = destination.value
+        nic = socket.inet_ntoa(struct.pack('>I', value)) if isinstance(value, int) else str(value)
+    return f'{serial}/{nic}'
+
+def load_stream_settings(device):
+    if not os.path.isfile(constants.AUTOTUNE_PATH):
+        return None
+    try:
+        with open(constants.AUTOTUNE_PATH) as f:
+            return json.load(f).get(get_stream_key(device))
+    except (OSError, ValueError):
+        return None
+
+def save_stream_settings(device, settings):
+    tuned = {}
+    if os.path.isfile(constants.AUTOTUNE_PATH):
+        try:
+            with open(constants.AUTOTUNE_PATH) as f:
+                tuned = json.load(f)
+        except (OSError, ValueError):
+            tuned = {}
+    tuned[get_stream_key(device)] = settings
+    with open(constants.AUTOTUNE_PATH, 'w') as f:
+        json.dump(tuned, f, indent=1)
+
+def set_stream_settings(device, settings):
+    """
+    Writes buffer handling mode and packet size / delay, before the stream starts
+    """
+    tl_stream_nodemap = device.tl_stream_nodemap
+    tl_stream_nodemap['StreamBufferHandlingMode'].value = settings['handling_mode']
+
+    nodes = device.nodemap.get_node([PACKET_SIZE_NODE, PACKET_DELAY_NODE])
+    if settings['packet_size'] == 'auto':
+        tl_stream_nodemap['StreamAutoNegotiatePacketSize'].value = True
+    elif nodes[PACKET_SIZE_NODE] is not None:
+        tl_stream_nodemap['StreamAutoNegotiatePacketSize'].value = False
+        node = nodes[PACKET_SIZE_NODE]
+        size = min(max(settings['packet_size'], node.min), node.max)
+        node.value = node.min + (size - node.min) // node.inc * node.inc
+    if nodes[PACKET_DELAY_NODE] is not None and nodes[PACKET_DELAY_NODE].is_writable:
+        nodes[PACKET_DELAY_NODE].value = settings['packet_delay']
+
+def apply_stream_settings(device, num_buffers=None):
+    """
+    Applies the tuned stream settings of this camera / NIC if there are any.
+    Returns the number of buffers to start the stream with (num_buffers
+    when the device was not tuned).
+    """
+    num_buffers = constants.NUM_BUFFERS if num_buffers is None else num_buffers
+    settings = load_stream_settings(device)
+    if settings is None:
+        return num_buffers
+    set_stream_settings(device, settings)
+    print('Tuned stream settings : %d buffers, %s, packet size %s, delay %s' % (
+        settings['num_buffers'], settings['handling_mode'], settings['packet_size'], settings['packet_delay']))
+    return settings['num_buffers']
+
+def get_candidates():
+    """
+    Every combination of the AUTOTUNE_* lists
+    """
+    return [{'num_buffers': num_buffers, 'handling_mode': handling_mode,
+             'packet_size': packet_size, 'packet_delay': packet_delay}
+            for num_buffers, handling_mode, (packet_size, packet_delay) in itertools.product(
+                constants.AUTOTUNE_BUFFERS, constants.AUTOTUNE_HANDLING_MODES, constants.AUTOTUNE_PACKETS)]
+
+def read_counters(tl_stream_nodemap):
+    """
+    Stream statistics counters the device has, see CaptureMetrics.read_stream_statistics
+    """
+    metrics = CaptureMetrics()
+    metrics.read_stream_statistics(tl_stream_nodemap)
+    return metrics.stream_statistics
+
+def measure_settings(device, settings, num_frames=None, warmup=None):
+    """
+    One calibration stream
+    (1) Apply the settings and start the stream
+    (2) Discard warmup frames (the stream engine fills up)
+    (3) Consume num_frames frames like the pipeline does (copy, requeue),
+        timing get_buffer and the consumer, counting frame ID gaps
+    (4) Lost, incomplete and resent frames are the stream statistics deltas
+    """
+    num_frames = constants.AUTOTUNE_FRAMES if num_frames is None else num_frames
+    warmup = constants.AUTOTUNE_WARMUP if warmup is None else warmup
+    # (1)
+    set_stream_settings(device, settings)
+    metrics = CaptureMetrics()
+    before = read_counters(device.tl_stream_nodemap)
+    errors = 0
+
+    with device.start_stream(settings['num_buffers']):
+        # (2)
+        for _ in range(warmup):
+            device.requeue_buffer(device.get_buffer(timeout=constants.TIMEOUT))
+
+        # (3)
+        for _ in range(num_frames):
+            t0 = time.perf_counter()
+            try:
+                buffer = device.get_buffer(timeout=constants.TIMEOUT)
+            except Exception:
+                errors += 1
+                continue
+            t1 = time.perf_counter()
+            buffer_to_ndarray(buffer, copy=True)
+            info = get_buffer_info(buffer)
+            device.requeue_buffer(buffer)
+            metrics.record('get_buffer', t1 - t0)
+            metrics.record('consumer', time.perf_counter() - t1)
+            metrics.frame(info)
+        device.stop_stream()
+
+    # (4)
+    after = read_counters(device.tl_stream_nodemap)
+    delta = {name: after[name] - before.get(name, 0) for name in after}
+    summary = metrics.summary()
+    stages = summary['stages']
+    return dict(settings, **{
+        'fps': summary['fps'],
+        'dropped': summary['dropped_frames'] + errors,
+        'lost': delta.get('StreamLostFrameCount', 0),
+        'incomplete': delta.get('StreamIncompleteFrameCount', 0),
+        'resends': delta.get('StreamResendRequestCount', 0),
+        'get_buffer_p99_ms': stages.get('get_buffer', {}).get('p99_ms', 0.0),
+        'consumer_p99_ms': stages.get('consumer', {}).get('p99_ms', 0.0),
+    })
+
+def is_loss_free(result):
+    return result['dropped'] == 0 and result['lost'] == 0 and result['incomplete'] == 0
+
+def choose_settings(results, tolerance=0.02):
+    """
+    Fastest loss-free result. Results within tolerance of the best frame rate
+    count as equally fast (a paced camera makes most of them equal) and are
+    ranked by resends, number of buffers (memory) and get_buffer p99.
+    Without a loss-free result the one with the fewest lost frames is taken.
+    """
+    loss_free = [result for result in results if is_loss_free(result)]
+    if not loss_free:
+        print('[WARNING] No loss-free stream configuration, taking the one with the fewest lost frames')
+        return min(results, key=lambda r: (r['dropped'] + r['lost'] + r['incomplete'], -r['fps']))
+
+    best_fps = max(result['fps'] for result in loss_free)
+    fast = [result for result in loss_free if result['fps'] >= best_fps * (1 - tolerance)]
+    return min(fast, key=lambda r: (r['resends'], r['num_buffers'], r['get_buffer_p99_ms']))
+
+def print_results(results, chosen=None):
+    print('%8s %-22s %8s %8s %8s %8s %6s %6s %8s %12s %12s' % (
+        'buffers', 'handling mode', 'packet', 'delay', 'fps', 'dropped', 'lost', 'incmp', 'resends',
+        'get p99[ms]', 'cons p99[ms]'))
+    for result in results:
+        print('%8d %-22s %8s %8s %8.1f %8d %6d %6d %8d %12.3f %12.3f %s' % (
+            result['num_buffers'], result['handling_mode'], result['packet_size'], result['packet_delay'],
+            result['fps'], result['dropped'], result['lost'], result['incomplete'], result['resends'],
+            result['get_buffer_p99_ms'], result['consumer_p99_ms'], '<-' if result is chosen else ''))
+
+def autotune_device(device, candidates=None):
+    """
+    Measures every candidate, persists and returns the chosen settings
+    """
+    candidates = candidates or get_candidates()
+    print(f'Autotuning {get_stream_key(device)}: {len(candidates)} configurations x {constants.AUTOTUNE_FRAMES} frames')
+
+    results = []
+    for settings in candidates:
+        try:
+            results.append(measure_settings(device, settings))
+        except Exception as e:
+            print(f'[WARNING] {settings} failed: {e}')
+    if not results:
+        raise Exception('No stream configuration could be measured')
+
+    chosen = choose_settings(results)
+    print_results(results, chosen)
+
+    settings = {key: chosen[key] for key in ('num_buffers', 'handling_mode', 'packet_size', 'packet_delay')}
+    settings['measured'] = {key: chosen[key] for key in chosen if key not in settings}
+    save_stream_settings(device, settings)
+    print(f'Saved stream settings of {get_stream_key(device)} to {constants.AUTOTUNE_PATH}')
+    return settings
+
+def autotune():
+    """
+    (1) Start device
+    (2) Streaming setup and set configuration, the calibration runs with the
+        capture configuration (frame size and rate decide the load)
+    (3) Measure every candidate and persist the best one
+    """
+    # (1)
+    system = get_system()
+    devices = create_devices_with_tries()
+    device = system.select_device(devices)
+    print(f'Device used in the example:\n\t{device}')
+
+    # (2)
+    streaming_setup(device.tl_stream_nodemap)
+    set_configuration(device.nodemap)
+
+    # (3)
+    autotune_device(device)
+
+    system.destroy_device()
+    print(f'Destroyed all created devices')
+
+if __name__ == "__main__":
+
+    autotune()
@@ -0,0 +1,315 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, sys, time, ctypes
+import numpy as np
+
+import constants
+
+class SyntheticBuffer:
+    """
+    Minimal stand-in for arena_api Buffer (data, pdata, width, height,
+    bits_per_pixel, has_chunkdata) so the conversion paths can be timed
+    without a camera
+    """
+    def __init__(self, width, height, bits_per_pixel=8, chunk_bytes=0):
+        self.width = width
+        self.height = height
+        self.bits_per_pixel = bits_per_pixel
+        self.has_chunkdata = chunk_bytes > 0
+
+        size = width * height * (bits_per_pixel // 8) + chunk_bytes
+        self._memory = (ctypes.c_ubyte * size)()
+        ctypes.memmove(self._memory, np.random.randint(0, 256, size, dtype=np.uint8).ctypes.data, size)
+        self.pdata = ctypes.cast(self._memory, ctypes.POINTER(ctypes.c_ubyte))
+
+    @property
+    def data(self):
+        # Like arena_api, Buffer.data builds a new list of ints on every access
+        return list(self._memory)
+
+def list_to_ndarray(image_buffer):
+    """
+    Method 1 : the Buffer.data based conversion used before buffer_to_ndarray
+    """
+    bytes_per_pixel = int(image_buffer.bits_per_pixel / 8)
+    image_size_in_bytes = image_buffer.height * image_buffer.width * bytes_per_pixel
+
+    data = image_buffer.data
+    if image_buffer.has_chunkdata:
+        data = data[:image_size_in_bytes]
+
+    nparray = np.asarray(data, dtype=np.uint8)
+    if bytes_per_pixel == 2:
+        nparray = nparray.view(np.uint16)
+    return nparray.reshape((image_buffer.height, image_buffer.width))
+
+def time_function(func, arg, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed.append(time.perf_counter() - start)
+    return np.median(elapsed)
+
+def benchmark_buffer_conversion(buffers, repeat=5):
+    """
+    Compares Buffer.data (list) with Buffer.pdata (zero-copy view) conversion
+    """
+    from utils import buffer_to_ndarray
+
+    print('%-22s %10s %12s %12s %12s %9s' % ('buffer', 'bits', 'list [ms]', 'view [ms]', 'copy [ms]', 'speedup'))
+    for image_buffer in buffers:
+        assert np.array_equal(list_to_ndarray(image_buffer), buffer_to_ndarray(image_buffer))
+
+        t_list = time_function(list_to_ndarray, image_buffer, repeat)
+        t_view = time_function(buffer_to_ndarray, image_buffer, repeat)
+        t_copy = time_function(lambda b: buffer_to_ndarray(b, copy=True), image_buffer, repeat)
+
+        name = '%dx%d%s' % (image_buffer.width, image_buffer.height, ' +chunk' if image_buffer.has_chunkdata else '')
+        print('%-22s %10d %12.3f %12.3f %12.3f %8.0fx' % (
+            name, image_buffer.bits_per_pixel, t_list * 1e3, t_view * 1e3, t_copy * 1e3, t_list / t_copy))
+
+def benchmark_encoder(width=2448, height=2048, num_frames=64, image_format='png'):
+    """
+    Encode throughput of EncoderPool for an increasing number of workers
+    """
+    import tempfile
+    from encoder import EncoderPool
+
+    frame = np.random.randint(0, 256, (height, width), dtype=np.uint8)
+    workers = sorted({1, 2, 4, os.cpu_count()})
+
+    print('%-10s %10s %12s' % ('workers', 'fps', 'MB/s'))
+    for num_workers in workers:
+        with tempfile.TemporaryDirectory() as png_path:
+            start = time.perf_counter()
+            with EncoderPool(png_path, num_workers=num_workers, image_format=image_format) as encoder:
+                for idx in range(num_frames):
+                    encoder.submit(frame, idx)
+            elapsed = time.perf_counter() - start
+        print('%-10d %10.1f %12.1f' % (num_workers, num_frames / elapsed, num_frames * frame.nbytes / elapsed / 1e6))
+
+def measure(func):
+    """
+    Runs func and returns (wall time, CPU time incl. finished child processes,
+    peak traced memory in bytes)
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    cpu_start = sum(os.times()[:4])
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    cpu = sum(os.times()[:4]) - cpu_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, cpu, peak
+
+def benchmark_capture_paths(width=2448, height=2048, pixel_format='Mono8', frame_rate=0, num_images=200):
+    """
+    Runs every capture path and save backend against the simulated SDK and
+    reports frames/sec, bytes/sec, CPU time and peak memory.
+    frame_rate = 0 lets the simulated camera deliver as fast as it is asked,
+    so the numbers show the cost of the capture path itself.
+    """
+    import io, tempfile, contextlib
+    import fake_arena
+
+    fake_arena.install(width=width, height=height, pixel_format=pixel_format, max_frame_rate=frame_rate)
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    import capture, rapid_capture
+
+    frame_bytes = width * height * fake_arena.BITS_PER_PIXEL[pixel_format] // 8
+    paths = [
+        ('loop', capture.capture_image, {}, num_images),
+        ('pipeline/thread', capture.capture_image_pipeline, {'PIPELINE': True, 'ENCODER': 'thread'}, num_images),
+        ('pipeline/process', capture.capture_image_pipeline, {'PIPELINE': True, 'ENCODER': 'process'}, num_images),
+        ('pipeline/recording', capture.capture_image_pipeline, {'PIPELINE': True, 'ENCODER': 'recording'}, num_images),
+        ('rapid', rapid_capture.capture_image, {'ENCODER': 'thread'}, constants.NUM_BUFFERS),
+        ('burst/after', rapid_capture.capture_burst, {'BURST_FLUSH': 'after', 'ENCODER': 'process'}, num_images),
+        ('burst/background', rapid_capture.capture_burst, {'BURST_FLUSH': 'background', 'ENCODER': 'process'}, num_images),
+    ]
+
+    print('%dx%d %s, %s' % (width, height, pixel_format, '%.0f fps camera' % frame_rate if frame_rate else 'unpaced camera'))
+    print('%-20s %8s %10s %10s %10s %12s' % ('path', 'frames', 'fps', 'MB/s', 'CPU [s]', 'peak [MB]'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func, overrides, num_frames in paths:
+            settings = {
+                'NUM_IMAGES': num_images,
+                'BURST_FRAMES': num_images,
+                'BURST_DURATION': 0,
+                'PNG_PATH': os.path.join(tmp, name.replace('/', '_')),
+                'CONFIG_CACHE_PATH': os.path.join(tmp, 'config_cache.json'),
+                'METRICS': False,
+                # Leaves AcquisitionFrameRate alone, the simulated camera is paced by frame_rate
+                'EXPOSURE_LONG': False,
+            }
+            settings.update(overrides)
+            saved = {key: getattr(constants, key) for key in settings}
+            for key, value in settings.items():
+                setattr(constants, key, value)
+
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed, cpu, peak = measure(func)
+            finally:
+                for key, value in saved.items():
+                    setattr(constants, key, value)
+
+            print('%-20s %8d %10.1f %10.1f %10.2f %12.1f' % (
+                name, num_frames, num_frames / elapsed, num_frames * frame_bytes / elapsed / 1e6, cpu, peak / 1e6))
+
+def decode_per_pixel(raw, pixel_format, num_pixels):
+    """
+    Reference decoder, one Python operation per pixel
+    """
+    raw = raw.tolist()
+    pixels = []
+    if pixel_format in ('Mono10', 'Mono12', 'Mono16'):
+        for i in range(num_pixels):
+            pixels.append(raw[2*i] | raw[2*i + 1] << 8)
+    elif pixel_format == 'Mono10p':
+        for i in range(num_pixels):
+            bit = 10 * i
+            value = raw[bit // 8] | raw[bit // 8 + 1] << 8
+            pixels.append(value >> (bit % 8) & 0x3FF)
+    elif pixel_format == 'Mono12p':
+        for i in range(num_pixels):
+            bit = 12 * i
+            value = raw[bit // 8] | raw[bit // 8 + 1] << 8
+            pixels.append(value >> (bit % 8) & 0xFFF)
+    elif pixel_format == 'Mono12Packed':
+        for i in range(0, num_pixels, 2):
+            b0, b1, b2 = raw[3*i//2:3*i//2 + 3]
+            pixels += [b0 << 4 | b1 & 0x0F, b2 << 4 | b1 >> 4]
+    else:
+        pixels = raw[:num_pixels]
+    return np.array(pixels, dtype=np.uint16)
+
+def benchmark_pixel_formats(width=2448, height=2048, repeat=10):
+    """
+    Throughput of the vectorized pixel format decoders (preallocated output),
+    checked against the per-pixel reference on a 64x64 frame
+    """
+    from pixel_formats import CODECS, PixelDecoder
+
+    print('%-14s %12s %12s %12s %12s' % ('format', 'decode [ms]', 'Mpixel/s', 'MB/s in', 'per-pixel'))
+    for pixel_format in CODECS:
+        small = PixelDecoder(pixel_format, 64, 64)
+        raw = np.random.randint(0, 256, small.num_bytes, dtype=np.uint8)
+        start = time.perf_counter()
+        reference = decode_per_pixel(raw, pixel_format, 64 * 64)
+        per_pixel = (time.perf_counter() - start) / (64 * 64)
+        assert np.array_equal(small.decode(raw).reshape(-1), reference), pixel_format
+
+        decoder = PixelDecoder(pixel_format, width, height)
+        raw = np.random.randint(0, 256, decoder.num_bytes, dtype=np.uint8)
+        elapsed = time_function(decoder.decode, raw, repeat)
+        print('%-14s %12.3f %12.1f %12.1f %10.0f ms' % (
+            pixel_format, elapsed * 1e3, width * height / elapsed / 1e6, decoder.num_bytes / elapsed / 1e6,
+            per_pixel * width * height * 1e3))
+
+IMPORT_MODULES = ['cli', 'utils', 'pipeline', 'encoder', 'capture', 'rapid_capture']
+
+def time_import(module, simulated=False):
+    """
+    Import time of module in a fresh interpreter, in seconds. With simulated
+    the SDK is replaced by fake_arena first (not timed)
+    """
+    import subprocess
+
+    code = ('import sys, time\n'
+            + ('import fake_arena; fake_arena.install()\n' if simulated else '')
+            + 'start = time.perf_counter()\n'
+            + f'import {module}\n'
+            + 'print(time.perf_counter() - start)\n')
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f'import {module} failed: {result.stderr.strip().splitlines()[-1]}')
+    return float(result.stdout.strip().splitlines()[-1])
+
+def benchmark_imports(modules=IMPORT_MODULES, repeat=3):
+    """
+    Startup cost of every entry point: median import time over repeat fresh
+    interpreters, and the heavy libraries each one loaded (a module should
+    not pull in OpenCV, matplotlib or Pillow before it needs them)
+    """
+    import subprocess
+
+    try:
+        import arena_api
+        simulated = False
+    except ImportError:
+        simulated = True
+
+    heavy = ['arena_api', 'cv2', 'matplotlib', 'PIL']
+    print('%-16s %12s   %s' % ('module', 'import [ms]', 'heavy imports' + (' (simulated SDK)' if simulated else '')))
+    for module in modules:
+        elapsed = np.median([time_import(module, simulated) for _ in range(repeat)])
+
+        code = ('import sys\n' + ('import fake_arena; fake_arena.install()\n' if simulated else '')
+                + f'before = set(sys.modules)\nimport {module}\n'
+                + f'print(" ".join(name for name in {heavy!r} if name in sys.modules and name not in before))\n')
+        loaded = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+        print('%-16s %12.1f   %s' % (module, elapsed * 1e3, loaded or '-'))
+
+def run_synthetic():
+    buffers = [
+        SyntheticBuffer(640, 480, 8),
+        SyntheticBuffer(2448, 2048, 8),
+        SyntheticBuffer(2448, 2048, 8, chunk_bytes=64),
+        SyntheticBuffer(2448, 2048, 16),
+    ]
+    benchmark_buffer_conversion(buffers)
+    benchmark_pixel_formats()
+    benchmark_encoder()
+    benchmark_imports()
+
+def run_device():
+    from arena_api.system import system
+    from utils import create_devices_with_tries, streaming_setup
+    from configuration import set_configuration
+
+    devices = create_devices_with_tries()
+    device = system.select_device(devices)
+    streaming_setup(device.tl_stream_nodemap)
+    set_configuration(device.nodemap)
+
+    with device.start_stream(constants.NUM_BUFFERS):
+        buffers = device.get_buffer(constants.NUM_BUFFERS)
+        benchmark_buffer_conversion(buffers[:3])
+        device.requeue_buffer(buffers)
+
+    system.destroy_device()
+
+if __name__ == "__main__":
+    """
+    python benchmark.py            : synthetic buffers, no camera needed
+    python benchmark.py device     : buffers grabbed from the connected camera
+    python benchmark.py simulated  : every capture path on the simulated SDK
+    python benchmark.py imports    : import time of the entry points
+    """
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    if mode == 'device':
+        run_device()
+    elif mode == 'simulated':
+        benchmark_capture_paths()
+    elif mode == 'imports':
+        benchmark_imports()
+    else:
+        run_synthetic()
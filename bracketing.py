@@ -0,0 +1,265 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, math
+import numpy as np
+
+import constants
+from utils import get_system, get_png_path, create_devices_with_tries, check_initial_values, streaming_setup, buffer_to_ndarray, get_buffer_info
+from configuration import set_configuration, invalidate_config_cache
+from encoder import create_writer
+from catalog import create_catalog_writer
+from chunk_data import create_chunk_metadata
+from roi import crop_image
+from gating import get_full_scale
+from trigger import set_trigger_mode
+
+def validate_brackets(nodemap, brackets):
+    """
+    Checks every bracket before the stream starts: exposure within the
+    ExposureTime range and shorter than the frame period (the same limit
+    set_exposure asserts), gain within the Gain range
+    """
+    nodes = nodemap.get_node(['ExposureTime', 'Gain', 'AcquisitionFrameRate'])
+    frame_rate = nodes['AcquisitionFrameRate'].value
+
+    for bracket in brackets:
+        exposure = bracket['exposure']
+        if 1/frame_rate < exposure*1e-6:
+            raise Exception('Bracket exposure %.1f us is longer than the frame period at %.1f Hz' % (exposure, frame_rate))
+        if not nodes['ExposureTime'].min <= exposure <= nodes['ExposureTime'].max:
+            raise Exception('Bracket exposure %.1f us is outside [%.1f, %.1f]' % (
+                exposure, nodes['ExposureTime'].min, nodes['ExposureTime'].max))
+        gain = bracket.get('gain', constants.GAIN)
+        if not nodes['Gain'].min <= gain <= nodes['Gain'].max:
+            raise Exception('Bracket gain %.1f is outside [%.1f, %.1f]' % (gain, nodes['Gain'].min, nodes['Gain'].max))
+
+def apply_bracket(nodes, bracket):
+    """
+    Writes exposure and gain of a bracket, only the nodes that change.
+    Returns True if anything was written.
+    """
+    changed = False
+    if not math.isclose(nodes['ExposureTime'].value, bracket['exposure'], rel_tol=1e-3):
+        nodes['ExposureTime'].value = bracket['exposure']
+        changed = True
+    gain = bracket.get('gain', constants.GAIN)
+    if not math.isclose(nodes['Gain'].value, gain, rel_tol=1e-3, abs_tol=1e-3):
+        nodes['Gain'].value = gain
+        changed = True
+    return changed
+
+def matches_bracket(values, bracket):
+    """
+    True when the chunk exposure / gain of a frame are the ones of the bracket
+    """
+    if 'ExposureTime' in values and not math.isclose(values['ExposureTime'], bracket['exposure'], rel_tol=1e-3):
+        return False
+    gain = bracket.get('gain', constants.GAIN)
+    if 'Gain' in values and not math.isclose(values['Gain'], gain, rel_tol=1e-3, abs_tol=1e-3):
+        return False
+    return True
+
+def hat_weight(arr, max_value):
+    """
+    Triangle weight, 0 at black and at saturation, 1 at mid-gray
+    """
+    return 1.0 - np.abs(2.0 * arr / max_value - 1.0)
+
+class HdrMerger:
+    """
+    Merges the frames of one bracket sweep into a radiance frame
+
+        radiance = sum(w(z) * z / (t * g)) / sum(w(z))
+
+    z being the pixel value, t the exposure time, g the linear gain and w the
+    hat weight, 0 at the full scale of the pixel format (4095 for Mono12 in
+    uint16). The accumulators are preallocated and reused for every sweep.
+    A pixel without weight in every frame (saturated or black everywhere)
+    takes the value of the shortest exposure, the best estimate there is.
+    """
+    def __init__(self):
+        self.weighted = None
+        self.weights = None
+        self.fallback = None
+        self.fallback_scale = 0.0
+
+    def reset(self):
+        if self.weighted is not None:
+            self.weighted.fill(0)
+            self.weights.fill(0)
+        self.fallback_scale = 0.0
+
+    def add(self, arr, exposure, gain=0.0, pixel_format=None):
+        if self.weighted is None:
+            self.weighted = np.zeros(arr.shape, dtype=np.float32)
+            self.weights = np.zeros(arr.shape, dtype=np.float32)
+            self.fallback = np.zeros(arr.shape, dtype=np.float32)
+            self.max_value = get_full_scale(arr, pixel_format)
+
+        z = arr.astype(np.float32)
+        w = np.clip(hat_weight(z, self.max_value), 0.0, None)
+        scale = 1.0 / (exposure * 1e-6 * 10 ** (gain / 20))
+        self.weighted += w * z * scale
+        self.weights += w
+        # Shortest exposure (largest scale) seen so far
+        if scale > self.fallback_scale:
+            np.multiply(z, scale, out=self.fallback)
+            self.fallback_scale = scale
+
+    def radiance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            radiance = self.weighted / self.weights
+        return np.where(self.weights > 0, radiance, self.fallback)
+
+def capture_brackets(device, brackets, writer, frames_per_bracket=None, sweeps=None, settle_frames=None,
+                     hdr_path=None, chunk_metadata=None, max_settle_frames=None, crop=None):
+    """
+    Steps through the brackets within one open stream
+    (1) Write exposure / gain of the next bracket
+    (2) Discard the frames that were exposed (or are already in flight) with
+        the previous settings. With chunk_metadata every frame's ExposureTime
+        / Gain chunk is checked against the bracket and frames are discarded
+        until they match (at most max_settle_frames in a row), without chunk
+        data a fixed settle_frames frames are discarded
+    (3) Grab frames_per_bracket frames, cropped to crop (the host crop from
+        set_configuration), and hand them to writer(arr, idx, info), info
+        being tagged with the bracket settings
+    (4) Optionally merge every sweep into one radiance frame (hdr_path)
+    Returns the per-frame tags.
+    """
+    frames_per_bracket = constants.BRACKET_FRAMES if frames_per_bracket is None else frames_per_bracket
+    sweeps = constants.BRACKET_SWEEPS if sweeps is None else sweeps
+    settle_frames = constants.BRACKET_SETTLE_FRAMES if settle_frames is None else settle_frames
+    max_settle_frames = constants.BRACKET_SETTLE_MAX_FRAMES if max_settle_frames is None else max_settle_frames
+    nodes = device.nodemap.get_node(['ExposureTime', 'Gain'])
+    merger = HdrMerger() if hdr_path else None
+    tags = []
+    idx = 0
+
+    for sweep in range(sweeps):
+        if merger is not None:
+            merger.reset()
+
+        for bracket_idx, bracket in enumerate(brackets):
+            # (1), (2)
+            changed = apply_bracket(nodes, bracket) or (sweep == 0 and bracket_idx == 0)
+            if changed and chunk_metadata is None:
+                for _ in range(settle_frames):
+                    device.requeue_buffer(device.get_buffer())
+
+            # (3)
+            for _ in range(frames_per_bracket):
+                discarded = 0
+                while True:
+                    buffer = device.get_buffer()
+                    info = get_buffer_info(buffer)
+                    if chunk_metadata is None:
+                        break
+                    info.update(chunk_metadata.parse(buffer))
+                    if matches_bracket(info, bracket):
+                        chunk_metadata.record(idx, info)
+                        break
+                    device.requeue_buffer(buffer)
+                    discarded += 1
+                    if discarded > max_settle_frames:
+                        raise Exception('Bracket %d (%.1f us) not applied after %d frames, chunk exposure %.1f us' % (
+                            bracket_idx, bracket['exposure'], discarded, info.get('ExposureTime', 0.0)))
+                arr = crop_image(buffer_to_ndarray(buffer), crop).copy()
+                device.requeue_buffer(buffer)
+
+                info.update({'sweep': sweep, 'bracket': bracket_idx, 'exposure': bracket['exposure'],
+                             'gain': bracket.get('gain', constants.GAIN)})
+                writer(arr, idx, info)
+                tags.append(dict(info, idx=idx))
+                idx += 1
+
+                # (4)
+                if merger is not None:
+                    merger.add(arr, info['exposure'], info['gain'], info.get('pixel_format'))
+
+        if merger is not None:
+            import cv2
+
+            if not os.path.isdir(hdr_path):
+                os.makedirs(hdr_path)
+            radiance = merger.radiance()
+            name = os.path.join(hdr_path, '%s_hdr_%04d' % (constants.PNG_NAME, sweep))
+            np.save(name + '.npy', radiance)
+            cv2.imwrite(name + '.tiff', radiance)
+            print(f'Saved radiance frame {name}')
+
+    return tags
+
+def capture_bracketing():
+    """
+    Exposure bracketing / HDR sweep
+    (1) Start device
+    (2) Streaming setup and set configuration
+    (3) Validate every bracket against the exposure range and frame rate
+    (4) Capture all brackets in one stream, saving every frame and the
+        settings it was taken with (<PNG_PATH>/brackets.json). With
+        CHUNK_METADATA the settling is checked on the frames' chunk data and
+        the chunk values are saved to the sidecar
+    """
+    # (1) Start device
+    system = get_system()
+    devices = create_devices_with_tries()
+    device = system.select_device(devices)
+    nodemap = device.nodemap
+    tl_stream_nodemap = device.tl_stream_nodemap
+    print(f'Device used in the example:\n\t{device}')
+
+    # (2) Streaming setup & set configuration
+    check_initial_values(nodemap)
+    streaming_setup(tl_stream_nodemap)
+    crop = set_configuration(nodemap)
+    set_trigger_mode(nodemap, 'bracketing')
+
+    # (3)
+    brackets = constants.BRACKETS
+    validate_brackets(nodemap, brackets)
+
+    # (4)
+    png_path = get_png_path()
+    chunk_metadata = create_chunk_metadata(nodemap)
+    writer = create_catalog_writer(create_writer(png_path), png_path, nodemap, crop)
+    hdr_path = png_path if constants.BRACKET_HDR else None
+    with device.start_stream(constants.NUM_BUFFERS):
+        print(f'Stream started, {len(brackets)} brackets x {constants.BRACKET_FRAMES} frames, '
+              f'{constants.BRACKET_SWEEPS} sweeps')
+        try:
+            tags = capture_brackets(device, brackets, writer, frames_per_bracket=constants.BRACKET_FRAMES,
+                                    sweeps=constants.BRACKET_SWEEPS, settle_frames=constants.BRACKET_SETTLE_FRAMES,
+                                    hdr_path=hdr_path, chunk_metadata=chunk_metadata, crop=crop)
+        finally:
+            writer.close()
+            # Exposure and gain no longer match the cached profile
+            invalidate_config_cache(nodemap)
+        device.stop_stream()
+
+    if not os.path.isdir(png_path):
+        os.makedirs(png_path)
+    with open(os.path.join(png_path, 'brackets.json'), 'w') as f:
+        json.dump(tags, f, indent=1)
+    print(f'Saved {len(tags)} frames, settings in {os.path.join(png_path, "brackets.json")}')
+    if chunk_metadata is not None:
+        chunk_metadata.save(png_path + constants.CHUNK_SUFFIX)
+
+    system.destroy_device()
+    print(f'Destroyed all created devices')
+
+if __name__ == "__main__":
+
+    capture_bracketing()
@@ -13,15 +13,23 @@
 
 
 import time, os
-from PIL import Image as PIL_Image  # pip install Pillow
 import numpy as np
 from pathlib import Path
 
-from arena_api.system import system
-from arena_api.buffer import *
 
 from utils import *
 from configuration import *
+from pipeline import CapturePipeline, print_pipeline_stats
+from encoder import create_writer
+from metrics import create_metrics, report_metrics
+from preview import create_preview
+from chunk_data import create_chunk_metadata, enable_chunks
+from roi import crop_image
+from gating import create_gate, report_gate
+from autotune import apply_stream_settings
+from trigger import create_trigger, report_trigger, load_timing_segments
+from session import create_session
+from catalog import create_catalog_writer
 
 import ctypes
 
@@ -35,13 +43,15 @@ def capture_image():
     (4) Calculate bytes per pixel for reshaping
     (5) Create array from buffer cpointer data
     (6) Create a NumPy array with the image shape
-    (7) Display the NumPy array using OpenCV
+    (7) Offer the NumPy array to the live preview (PREVIEW), the loop itself
+        never displays anything
     (8) When Esc is pressed, stop stream and destroy OpenCV windows
     """
     
     # (1) Start device
+    start = time.perf_counter()
     devices = create_devices_with_tries()
-    device = system.select_device(devices)
+    device = get_system().select_device(devices)
     nodemap = device.nodemap
     tl_stream_nodemap = device.tl_stream_nodemap
     print(f'Device used in the example:\n\t{device}')
@@ -49,35 +59,216 @@ def capture_image():
     # (2) Streaming setup & set configuration
     check_initial_values(nodemap)
     streaming_setup(tl_stream_nodemap)
-    set_configuration(nodemap) # exposure time, binning, gain, pixel format, height/width, gamma
+    crop = set_configuration(nodemap) # exposure time, binning, gain, pixel format, height/width, gamma, ROI
+    num_buffers = apply_stream_settings(device, num_buffers=100)
     
     # (3)    
     img_cnt = 0
-    png_path = constants.PNG_PATH
+    png_path = get_png_path()
+    metrics = create_metrics()
+    preview = create_preview()
+    chunk_metadata = create_chunk_metadata(nodemap)
+    gate = create_gate(png_path)
+    trigger = create_trigger(nodemap)
+    num_images = trigger.num_triggers if trigger is not None else constants.NUM_IMAGES
+    writer = create_catalog_writer(create_writer(png_path, encoder='thread'), png_path, nodemap, crop)
     
-    with device.start_stream(100):
+    with device.start_stream(num_buffers):
         print(f'Stream started')
+        if trigger is not None:
+            trigger.start()
 
-        while img_cnt < constants.NUM_IMAGES:
+        while img_cnt < num_images:
             # Copy buffer and requeue to avoid running out of buffers
             print(f'Grabbing an image buffer')
+            t0 = time.perf_counter()
             buffer = device.get_buffer()
+            t1 = time.perf_counter()
+            if img_cnt == 0:
+                print('Time to first frame : %.1f ms' % ((t1 - start) * 1e3))
+            if trigger is not None:
+                trigger.record_buffer(get_buffer_info(buffer), t1)
                         
-            arr = np.array(buffer.data, dtype = np.uint8)
-            arr = arr.reshape((buffer.height, buffer.width))
+            # Zero-copy view on the buffer, valid until the buffer is requeued
+            arr = crop_image(buffer_to_ndarray(buffer), crop)
+            t2 = time.perf_counter()
             
-            show_image(arr)
-            save_image_opencv(npndarray=arr, idx= img_cnt, png_path=png_path)
+            # The preview process renders the frame, the loop never waits on a GUI
+            if preview is not None:
+                preview.publish(arr)
+            t3 = time.perf_counter()
+            if gate is None or gate.check(arr, img_cnt, get_buffer_info(buffer)):
+                path = writer(arr, img_cnt, get_buffer_info(buffer))
+                print(f'Saved image path is: {path}')
+            t4 = time.perf_counter()
+            if chunk_metadata is not None:
+                chunk_metadata.read(buffer, img_cnt)
             img_cnt +=1
+            if metrics is not None:
+                metrics.frame(get_buffer_info(buffer))
             device.requeue_buffer(buffer)
 
+            if metrics is not None:
+                metrics.record('get_buffer', t1 - t0)
+                metrics.record('convert', t2 - t1)
+                metrics.record('write', t4 - t3)
+                metrics.record('requeue', time.perf_counter() - t4)
+
         # (4) Clean up
+        report_metrics(metrics, tl_stream_nodemap, png_path)
         device.stop_stream()
+        writer.close()
+        if preview is not None:
+            preview.close()
+        if chunk_metadata is not None:
+            chunk_metadata.save(png_path + constants.CHUNK_SUFFIX)
+        report_gate(gate, png_path)
+        report_trigger(trigger, nodemap, png_path)
         
-    system.destroy_device()
+    get_system().destroy_device()
     print(f'Destroyed all created devices')
         
+def capture_image_pipeline():
+    """
+    Same as capture_image() but acquisition and saving are decoupled
+    (1) Start device
+    (2) Streaming setup and set configuration
+    (3) The acquisition thread copies every frame into a bounded queue and
+        requeues the buffer immediately
+    (4) NUM_WRITERS writer threads hand the queued frames to the writer
+        selected by ENCODER (see encoder.create_writer), the acquisition
+        thread also offers every frame to the non-blocking preview and
+        parses its chunk metadata before requeueing the buffer. With GATE
+        only frames that differ from the last saved one are queued. With
+        TRIGGER_MODE a frame is acquired per scheduled software trigger
+        (held while the queue is backlogged) or hardware line edge
+    (5) Report queue depth, drop counts and per-stage metrics, save the
+        chunk metadata sidecar and the trigger timing
+    (6) With SESSION the progress is checkpointed to persist.json: an
+        interrupted run continues where it stopped, a camera lost while
+        streaming is reconnected and the capture continues. The sidecars
+        (metrics, chunk metadata, gate log, trigger timing) are saved with
+        every checkpoint and continued by the resumed run
+    (7) With CATALOG every written frame is recorded in the catalog
+        (catalog.py), committed with the session checkpoints
+    """
+    # (1) Start device
+    start = time.perf_counter()
+    devices = create_devices_with_tries()
+    device = get_system().select_device(devices)
+    nodemap = device.nodemap
+    tl_stream_nodemap = device.tl_stream_nodemap
+    print(f'Device used in the example:\n\t{device}')
+
+    # (2) Streaming setup & set configuration
+    check_initial_values(nodemap)
+    streaming_setup(tl_stream_nodemap)
+    crop = set_configuration(nodemap)
+    num_buffers = apply_stream_settings(device)
+
+    png_path = get_png_path()
+    first_idx = 0
+    session = create_session()
+    if session is not None:
+        png_path, first_idx = session.begin(device, png_path)
+
+    writer = create_writer(png_path, resume=session.writer_state if session is not None else None)
+    writer = create_catalog_writer(writer, png_path, nodemap, crop)
+    if session is not None:
+        session.start(writer)
+
+    # (3), (4)
+    metrics = create_metrics()
+    preview = create_preview()
+    chunk_metadata = create_chunk_metadata(nodemap)
+    gate = create_gate(png_path, first_idx)
+    trigger = None
+    trigger_segments = []
+    if first_idx:
+        # (6) Continue the sidecars of the interrupted run
+        if metrics is not None:
+            metrics.resume(png_path + constants.METRICS_SUFFIX)
+        if chunk_metadata is not None:
+            chunk_metadata.resume(png_path + constants.CHUNK_SUFFIX, first_idx)
+        if constants.TRIGGER_MODE:
+            trigger_segments = load_timing_segments(png_path + constants.TRIGGER_SUFFIX)
+
+    def save_sidecars():
+        if metrics is not None:
+            metrics.write(png_path + constants.METRICS_SUFFIX)
+        if chunk_metadata is not None:
+            chunk_metadata.flush(png_path + constants.CHUNK_SUFFIX)
+        if gate is not None:
+            gate.flush()
+        if trigger is not None:
+            trigger.write(png_path + constants.TRIGGER_SUFFIX, trigger_segments)
+
+    if session is not None:
+        session.add_sidecar(save_sidecars)
+    first_frame_time = None
+    try:
+        while True:
+            trigger = create_trigger(nodemap, num_triggers=constants.NUM_IMAGES - first_idx,
+                                     backpressure=lambda: pipeline.is_backlogged(), offset=first_idx)
+            num_images = trigger.num_triggers if trigger is not None else constants.NUM_IMAGES - first_idx
+            pipeline = CapturePipeline(device, writer, metrics=metrics, preview=preview, chunk_metadata=chunk_metadata,
+                                       crop=crop, gate=gate, trigger=trigger, session=session)
+            try:
+                with device.start_stream(num_buffers):
+                    print(f'Stream started with {constants.NUM_WRITERS} writers, '
+                          f'queue size {constants.QUEUE_SIZE}, overflow policy {constants.OVERFLOW_POLICY}')
+                    if trigger is not None:
+                        trigger.start()
+                    try:
+                        stats = pipeline.run(num_images, first_idx=first_idx)
+                    finally:
+                        first_frame_time = first_frame_time or pipeline.first_frame_time
+                    report_metrics(metrics, tl_stream_nodemap, png_path)
+                    device.stop_stream()
+                break
+            except Exception as e:
+                if session is None:
+                    raise
+                # (6) Lost device: reopen it, restore what it lost and continue numbering
+                if trigger is not None:
+                    trigger.stop()
+                    trigger_segments.append(trigger.summary())
+                    trigger = None
+                device = session.reconnect(device, e)
+                nodemap = device.nodemap
+                tl_stream_nodemap = device.tl_stream_nodemap
+                streaming_setup(tl_stream_nodemap)
+                crop = resume_configuration(nodemap, session.state['profile'])
+                num_buffers = apply_stream_settings(device)
+                first_idx = session.next_idx
+                if chunk_metadata is not None:
+                    enable_chunks(nodemap, chunk_metadata.names)
+                    chunk_metadata.truncate(first_idx)
+    finally:
+        if session is not None:
+            session.stop()
+        writer.close()
+        if preview is not None:
+            preview.close()
+    if session is not None:
+        session.finish()
+
+    # (5)
+    print_pipeline_stats(stats)
+    if chunk_metadata is not None:
+        chunk_metadata.save(png_path + constants.CHUNK_SUFFIX)
+    report_gate(gate, png_path)
+    report_trigger(trigger, nodemap, png_path, trigger_segments)
+    if first_frame_time is not None:
+        print('Time to first frame : %.1f ms' % ((first_frame_time - start) * 1e3))
+
+    get_system().destroy_device()
+    print(f'Destroyed all created devices')
+
 if __name__ == "__main__":
     print('start capturing')
     
-    capture_image()    
\ No newline at end of file
+    if constants.PIPELINE:
+        capture_image_pipeline()
+    else:
+        capture_image()    
\ No newline at end of file
@@ -0,0 +1,399 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, time, sqlite3, threading, collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import constants
+
+"""
+Capture catalog
+
+Every frame a writer saves is recorded in one SQLite database
+(constants.CATALOG_PATH, default PNG_ROOT/catalog.sqlite) with its file, or
+recording and offset, and the camera settings it was taken with. Captures
+are found with a query instead of globbing the PNG_PATH directories, and
+CatalogLoader decodes the matching frames in parallel into one preallocated
+stack.
+
+    python catalog.py [serial]   prints the runs in the catalog
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    run TEXT NOT NULL,          -- absolute PNG_PATH of the capture
+    idx INTEGER NOT NULL,       -- frame index in the run
+    path TEXT NOT NULL,         -- image file or .arec recording
+    offset INTEGER,             -- pixel data offset in the recording, NULL for image files
+    format TEXT NOT NULL,       -- png, tiff, npy or arec
+    nbytes INTEGER NOT NULL,
+    serial TEXT,
+    frame_id INTEGER,
+    timestamp_ns INTEGER,       -- device timestamp
+    exposure REAL,              -- us
+    gain REAL,                  -- dB
+    pixel_format TEXT,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    channels INTEGER NOT NULL,
+    dtype TEXT NOT NULL,        -- numpy dtype string of the saved array
+    roi_x INTEGER,              -- sensor offset of the saved region, binned pixels
+    roi_y INTEGER,
+    created REAL,               -- host time.time()
+    PRIMARY KEY (run, idx)
+);
+CREATE INDEX IF NOT EXISTS frames_serial_time ON frames (serial, timestamp_ns);
+CREATE INDEX IF NOT EXISTS frames_exposure ON frames (exposure, gain);
+"""
+
+COLUMNS = ('run', 'idx', 'path', 'offset', 'format', 'nbytes', 'serial', 'frame_id', 'timestamp_ns', 'exposure',
+           'gain', 'pixel_format', 'width', 'height', 'channels', 'dtype', 'roi_x', 'roi_y', 'created')
+
+def get_catalog_path():
+    return constants.CATALOG_PATH or os.path.join(constants.PNG_ROOT, 'catalog.sqlite')
+
+def connect(path=None):
+    """
+    WAL journal so a loader can query while a capture is writing
+    """
+    path = path or get_catalog_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+def get_capture_settings(nodemap, crop=None):
+    """
+    Settings of the frames that are constant for a run, read once from the
+    device. Exposure and gain of the chunk data override them per frame.
+    """
+    nodes = nodemap.get_node(['DeviceSerialNumber', 'PixelFormat', 'ExposureTime', 'Gain', 'OffsetX', 'OffsetY'])
+    roi_x, roi_y = nodes['OffsetX'].value, nodes['OffsetY'].value
+    if crop is not None:
+        # Host crop, (rows, columns) slices of the camera image
+        roi_x += crop[1].start
+        roi_y += crop[0].start
+    return {'serial': str(nodes['DeviceSerialNumber'].value), 'pixel_format': str(nodes['PixelFormat'].value),
+            'exposure': nodes['ExposureTime'].value, 'gain': nodes['Gain'].value, 'roi_x': roi_x, 'roi_y': roi_y}
+
+class CatalogWriter:
+    """
+    Wraps a frame writer and records every frame it saves
+    (1) The writer is called first, its return value says where the frame
+        went: a file path, the pixel data offset of a recording or None
+        (stack, nothing to record)
+    (2) The row is kept in memory, with several writer threads under a lock
+    (3) Rows are committed in one transaction by sync() after the writer
+        synced, so the catalog only lists frames that are on disk. A session
+        checkpoint (session.py) is a catalog commit, without session the
+        rows are committed by close()
+
+    Exposure and gain of a row are the frame's chunk values (ExposureTime /
+    Gain), the bracket tags (exposure / gain, bracketing.py) or else the
+    configured settings. A frame written again (resumed session) replaces
+    its row.
+    """
+    def __init__(self, writer, png_path, settings=None, path=None):
+        self.writer = writer
+        self.run = os.path.abspath(png_path)
+        self.settings = settings or {}
+        self.path = path or get_catalog_path()
+        self.connection = connect(self.path)
+        self.rows = []
+        self.lock = threading.Lock()
+        self.num_rows = 0
+
+    def __call__(self, arr, idx, info):
+        # (1)
+        location = self.writer(arr, idx, info)
+        if location is None:
+            return None
+
+        if isinstance(location, str):
+            path, offset, image_format = os.path.abspath(location), None, os.path.splitext(location)[1][1:]
+        else:
+            path, offset, image_format = os.path.abspath(self.writer.path), int(location), 'arec'
+
+        settings = self.settings
+        row = (self.run, idx, path, offset, image_format, arr.nbytes, settings.get('serial'),
+               info.get('frame_id'), info.get('timestamp_ns'),
+               info.get('ExposureTime', info.get('exposure', settings.get('exposure'))),
+               info.get('Gain', info.get('gain', settings.get('gain'))),
+               info.get('pixel_format', settings.get('pixel_format')), arr.shape[1], arr.shape[0],
+               arr.shape[2] if arr.ndim == 3 else 1, arr.dtype.str,
+               settings.get('roi_x'), settings.get('roi_y'), time.time())
+        # (2)
+        with self.lock:
+            self.rows.append(row)
+        return location
+
+    def commit(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+            if not rows:
+                return
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO frames (%s) VALUES (%s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    rows)
+            self.num_rows += len(rows)
+
+    def sync(self):
+        # (3)
+        state = self.writer.sync() if hasattr(self.writer, 'sync') else None
+        self.commit()
+        return state
+
+    def close(self):
+        try:
+            self.writer.close()
+        finally:
+            self.commit()
+            self.connection.close()
+        print(f'Catalogued {self.num_rows} frames of {self.run} in {self.path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def create_catalog_writer(writer, png_path, nodemap=None, crop=None):
+    """
+    CatalogWriter around writer if constants.CATALOG is on, else writer itself
+    """
+    if not constants.CATALOG:
+        return writer
+    settings = get_capture_settings(nodemap, crop) if nodemap is not None else None
+    return CatalogWriter(writer, png_path, settings)
+
+class FrameCache:
+    """
+    LRU cache of decoded frames, keyed by (path, offset)
+    """
+    def __init__(self, capacity=None):
+        capacity = constants.CATALOG_CACHE_FRAMES if capacity is None else capacity
+        self.capacity = capacity
+        self.frames = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            arr = self.frames.get(key)
+            if arr is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return arr
+
+    def put(self, key, arr):
+        if not self.capacity:
+            return
+        # Cached frames are shared by every caller
+        arr.flags.writeable = False
+        with self.lock:
+            self.frames[key] = arr
+            self.frames.move_to_end(key)
+            while len(self.frames) > self.capacity:
+                self.frames.popitem(last=False)
+
+def check_order(order):
+    """
+    ORDER BY clause of catalog columns, each optionally followed by ASC or DESC
+    """
+    for term in order.split(','):
+        words = term.split()
+        direction = words[1].upper() if len(words) == 2 else 'ASC'
+        if not 1 <= len(words) <= 2 or words[0] not in COLUMNS or direction not in ('ASC', 'DESC'):
+            raise Exception(f'Invalid catalog order {order!r}, use columns of {COLUMNS} with optional ASC / DESC')
+    return order
+
+class CatalogLoader:
+    """
+    Query the catalog and load the matching frames
+    (1) query() selects rows by equality (serial='...', run=...) or by range
+        with a (min, max) tuple (exposure=(1000, 5000)), None leaves a bound
+        open, in timestamp order
+    (2) load() allocates one (n, height, width[, channels]) array from the
+        shapes in the rows, before anything is decoded
+    (3) num_workers threads decode the frames into their slot of the stack:
+        recordings are copied out of a memory map opened once per file and
+        .npy files are read straight into the slot, OpenCV (png / tiff) can
+        only decode into a new array which is then copied over. OpenCV and
+        file reads release the GIL.
+    (4) A copy of every decoded frame goes into an LRU cache of
+        cache_frames frames, repeated loads of the same frames only copy
+    """
+    def __init__(self, path=None, num_workers=None, cache_frames=None):
+        num_workers = constants.CATALOG_WORKERS if num_workers is None else num_workers
+        cache_frames = constants.CATALOG_CACHE_FRAMES if cache_frames is None else cache_frames
+        self.connection = connect(path)
+        self.num_workers = num_workers or os.cpu_count()
+        self.cache = FrameCache(cache_frames)
+        self.recordings = {}
+        self.lock = threading.Lock()
+
+    def query(self, where=None, params=(), order='timestamp_ns, idx', limit=None, **filters):
+        # (1)
+        clauses = [where] if where else []
+        params = list(params)
+        for name, value in filters.items():
+            if name not in COLUMNS:
+                raise Exception(f'Unknown catalog column {name}, use one of {COLUMNS}')
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    clauses.append(f'{name} >= ?')
+                    params.append(low)
+                if high is not None:
+                    clauses.append(f'{name} <= ?')
+                    params.append(high)
+            else:
+                clauses.append(f'{name} = ?')
+                params.append(value)
+
+        sql = 'SELECT * FROM frames'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(f'({clause})' for clause in clauses)
+        sql += f' ORDER BY {check_order(order)}'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        return self.connection.execute(sql, params).fetchall()
+
+    def runs(self, serial=None):
+        sql = ('SELECT run, serial, COUNT(*) AS frames, MIN(exposure) AS min_exposure, MAX(exposure) AS max_exposure, '
+               'MIN(created) AS created FROM frames')
+        if serial is not None:
+            return self.connection.execute(sql + ' WHERE serial = ? GROUP BY run ORDER BY created', (serial,)).fetchall()
+        return self.connection.execute(sql + ' GROUP BY run ORDER BY created').fetchall()
+
+    def _recording(self, path, end):
+        # The recording may have grown since it was mapped (capture still running)
+        with self.lock:
+            mm = self.recordings.get(path)
+            if mm is None or len(mm) < end:
+                mm = np.memmap(path, dtype=np.uint8, mode='r')
+                self.recordings[path] = mm
+            return mm
+
+    def _read_npy(self, path, out):
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                shape = None
+            if shape != out.shape or dtype != out.dtype or fortran_order or not out.flags.c_contiguous:
+                np.copyto(out, np.load(path))
+            elif f.readinto(out.reshape(-1).view(np.uint8)) != out.nbytes:
+                raise Exception(f'{path} is truncated')
+
+    def _decode(self, row, out=None):
+        """
+        Frame of row, decoded into out (a new array when None)
+        """
+        shape = (row['height'], row['width']) + ((row['channels'],) if row['channels'] > 1 else ())
+        if out is None:
+            out = np.empty(shape, dtype=row['dtype'])
+        if row['format'] == 'arec':
+            mm = self._recording(row['path'], row['offset'] + row['nbytes'])
+            np.copyto(out, np.ndarray(shape, dtype=row['dtype'], buffer=mm, offset=row['offset']))
+            return out
+        if row['format'] == 'npy':
+            self._read_npy(row['path'], out)
+            return out
+
+        import cv2
+        arr = cv2.imread(row['path'], cv2.IMREAD_UNCHANGED)
+        if arr is None:
+            raise Exception(f'Failed to read {row["path"]}')
+        np.copyto(out, arr)
+        return out
+
+    def get(self, row, out=None):
+        """
+        One frame, from the cache when it was decoded before (read-only), or
+        written into out when given
+        """
+        key = (row['path'], row['offset'])
+        arr = self.cache.get(key)
+        if arr is not None:
+            if out is None:
+                return arr
+            np.copyto(out, arr)
+            return out
+
+        arr = self._decode(row, out)
+        if self.cache.capacity:
+            self.cache.put(key, arr if out is None else arr.copy())
+        return arr
+
+    def load(self, rows=None, **filters):
+        """
+        Stack of the frames of rows, or of query(**filters)
+        """
+        if rows is None:
+            rows = self.query(**filters)
+        if not rows:
+            return None
+
+        # (2)
+        shapes = {(row['height'], row['width'], row['channels'], row['dtype']) for row in rows}
+        if len(shapes) > 1:
+            raise Exception(f'Frames of different shapes or dtypes {sorted(shapes)} can not be stacked, '
+                            'narrow the query (e.g. by run or pixel_format)')
+        height, width, channels, dtype = shapes.pop()
+        stack = np.empty((len(rows), height, width) + ((channels,) if channels > 1 else ()), dtype=dtype)
+
+        # (3), (4)
+        def load_frame(i):
+            self.get(rows[i], stack[i])
+
+        start = time.perf_counter()
+        hits = self.cache.hits
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(load_frame, range(len(rows))))
+        elapsed = time.perf_counter() - start
+        print('Loaded %d frames (%d cached) in %.2f sec, %.1f MB/s' % (
+            len(rows), self.cache.hits - hits, elapsed, stack.nbytes / elapsed / 1e6 if elapsed > 0 else 0.0))
+        return stack
+
+    def close(self):
+        self.connection.close()
+        self.recordings.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+if __name__ == "__main__":
+    import sys
+
+    with CatalogLoader() as loader:
+        for run in loader.runs(sys.argv[1] if len(sys.argv) > 1 else None):
+            print('%s  %s  %d frames, exposure %s - %s us' % (
+                run['run'], run['serial'], run['frames'], run['min_exposure'], run['max_exposure']))
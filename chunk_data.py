@@ -0,0 +1,326 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, io, math, struct, ctypes, threading
+import numpy as np
+
+import constants
+
+"""
+Per-frame chunk metadata
+
+With 'ChunkModeActive' the camera appends chunks after the image data. In the
+GigE Vision layout every chunk is followed by a trailer of chunk ID and
+length (both 32 bit big endian), so the chunks can be walked backwards from
+the end of the buffer.
+The chunk IDs and value encodings are defined in the camera XML. Instead of
+parsing it, the layout is learned from the first buffers: the values the SDK
+reports through buffer.get_chunk() are searched in the raw chunks. After that
+every frame is parsed with one read of the chunk bytes and a NumPy structured
+dtype view, a few microseconds per frame.
+"""
+
+# Chunk name -> column dtype
+CHUNK_COLUMNS = {
+    'Timestamp': np.uint64,
+    'ExposureTime': np.float64,
+    'Gain': np.float64,
+    'FrameID': np.uint64,
+}
+
+# Encodings tried when locating a value in the raw chunk bytes
+CHUNK_ENCODINGS = {
+    8: ['<u8', '<f8', '>u8', '>f8'],
+    4: ['<u4', '<f4', '>u4', '>f4'],
+}
+
+CHUNK_NODES = ['ChunkModeActive', 'ChunkSelector', 'ChunkEnable']
+
+def chunks_supported(nodemap):
+    return all(node is not None for node in nodemap.get_node(CHUNK_NODES).values())
+
+def enable_chunks(nodemap, names=None):
+    """
+    Activates chunk mode and enables the chosen chunks, returns the enabled names
+    """
+    names = names or constants.CHUNKS
+    nodes = nodemap.get_node(CHUNK_NODES)
+    if any(node is None for node in nodes.values()):
+        raise Exception('Chunk data is not supported by the device')
+
+    nodes['ChunkModeActive'].value = True
+    enabled = []
+    for name in names:
+        if name not in nodes['ChunkSelector'].enumentry_names:
+            print(f'[WARNING] Chunk {name} is not supported by the device, skipped')
+            continue
+        nodes['ChunkSelector'].value = name
+        nodes['ChunkEnable'].value = True
+        enabled.append(name)
+    print(f'Enabled chunks : {enabled}')
+    return enabled
+
+def get_buffer_size(image_buffer):
+    """
+    Number of valid bytes in the buffer (image + chunks)
+    """
+    for name in ('size_filled', 'payload_size', 'size'):
+        size = getattr(image_buffer, name, None)
+        if size:
+            return size
+    return len(image_buffer.data)
+
+def get_image_size(image_buffer):
+    return image_buffer.width * image_buffer.height * image_buffer.bits_per_pixel // 8
+
+def scan_chunks(raw, image_size):
+    """
+    Walks the chunk trailers backwards, returns [(chunk_id, start, length)]
+    of the chunks after the image data
+    """
+    chunks = []
+    end = len(raw)
+    while end - 8 >= image_size:
+        chunk_id, length = struct.unpack_from('>II', raw, end - 8)
+        start = end - 8 - length
+        if length == 0 or start < image_size:
+            break
+        chunks.append((chunk_id, start, length))
+        end = start
+    return chunks
+
+def locate_value(raw, chunks, value, kind):
+    """
+    All (offset, encoding) in the chunks whose decoded value equals value,
+    kind being the NumPy dtype kind of the column ('u' or 'f')
+    """
+    matches = set()
+    for _, start, length in chunks:
+        # A chunk of 4 or 8 bytes holds exactly one value
+        sizes = [length] if length in CHUNK_ENCODINGS else list(CHUNK_ENCODINGS)
+        for size in sizes:
+            for offset in range(start, start + length - size + 1, size):
+                for encoding in CHUNK_ENCODINGS[size]:
+                    if np.dtype(encoding).kind != kind:
+                        continue
+                    decoded = np.frombuffer(raw, dtype=encoding, count=1, offset=offset)[0]
+                    if math.isclose(float(decoded), float(value), rel_tol=1e-6, abs_tol=1e-9):
+                        matches.add((offset, encoding))
+    return matches
+
+class ChunkMetadata:
+    """
+    Parses chunk values of every frame and collects them into columns
+    (1) learn_layout() on the first buffers: offset and encoding of every
+        chunk value. Values that can not be located unambiguously after
+        CHUNK_LEARN_FRAMES frames are read through the SDK (buffer.get_chunk)
+    (2) read(buffer, idx) parses the values straight from buffer memory and
+        appends one row to the columnar arrays (grown by doubling)
+    (3) save() writes all rows as one structured .npy sidecar. flush()
+        (session checkpoints) appends the rows added since the last flush,
+        the .npy header is rewritten in place with the new length, and
+        resume() reloads the rows of an interrupted run
+    """
+    def __init__(self, names=None, capacity=1024):
+        self.names = [name for name in (names or constants.CHUNKS) if name in CHUNK_COLUMNS]
+        self.layout = None
+        self.sdk_names = []
+        self.candidates = {}
+        self.learned_frames = 0
+        self.lock = threading.Lock()
+
+        self.row_dtype = np.dtype([('idx', np.int64)] + [(name, CHUNK_COLUMNS[name]) for name in self.names])
+        self.rows = np.zeros(capacity, dtype=self.row_dtype)
+        self.count = 0
+        self.flushed = 0
+
+    def enable(self, nodemap):
+        self.names = [name for name in enable_chunks(nodemap, self.names) if name in CHUNK_COLUMNS]
+        self.row_dtype = np.dtype([('idx', np.int64)] + [(name, CHUNK_COLUMNS[name]) for name in self.names])
+        self.rows = np.zeros(len(self.rows), dtype=self.row_dtype)
+
+    def read_sdk(self, image_buffer, names):
+        nodes = image_buffer.get_chunk(['Chunk' + name for name in names])
+        return {name: nodes['Chunk' + name].value for name in names}
+
+    def learn_layout(self, image_buffer):
+        """
+        Narrows down where every chunk value sits, from the SDK values of the
+        first frames. Candidates are intersected across frames (a frame ID
+        of 0 and a gain of 0.0 look the same in one frame, not in three) and
+        a location taken by one value is removed from the others.
+        Returns the SDK values of this frame.
+        """
+        size = get_buffer_size(image_buffer)
+        raw = ctypes.string_at(image_buffer.pdata, size)
+        chunks = scan_chunks(raw, get_image_size(image_buffer))
+        values = self.read_sdk(image_buffer, self.names)
+
+        for name in self.names:
+            found = locate_value(raw, chunks, values[name], np.dtype(CHUNK_COLUMNS[name]).kind)
+            self.candidates[name] = found if name not in self.candidates else self.candidates[name] & found
+        self.learned_frames += 1
+
+        resolved = {}
+        pending = dict(self.candidates)
+        progress = True
+        while progress and pending:
+            progress = False
+            taken = {offset for offset, _ in resolved.values()}
+            for name, found in list(pending.items()):
+                offsets = sorted({offset for offset, _ in found if offset not in taken})
+                if len(offsets) == 1:
+                    # Little endian first when the same bytes decode the same both ways
+                    encodings = sorted(encoding for offset, encoding in found if offset == offsets[0])
+                    resolved[name] = (offsets[0], encodings[0])
+                    del pending[name]
+                    progress = True
+                    break
+
+        if pending and self.learned_frames < constants.CHUNK_LEARN_FRAMES:
+            return values
+
+        self.sdk_names = list(pending)
+        if resolved:
+            names = list(resolved)
+            offsets = [resolved[name][0] for name in names]
+            formats = [resolved[name][1] for name in names]
+            self.base = min(offsets)
+            itemsize = max(offset + np.dtype(fmt).itemsize for offset, fmt in zip(offsets, formats)) - self.base
+            self.layout = np.dtype({'names': names, 'formats': formats,
+                                    'offsets': [offset - self.base for offset in offsets], 'itemsize': itemsize})
+        else:
+            self.layout = np.dtype([])
+        if self.sdk_names:
+            print(f'[WARNING] Chunks {self.sdk_names} could not be located in the buffer, read through the SDK')
+        return values
+
+    def parse(self, image_buffer):
+        """
+        Chunk values of one buffer as a dict, read before the buffer is requeued
+        """
+        if self.layout is None:
+            return self.learn_layout(image_buffer)
+
+        values = {}
+        if self.layout.names:
+            raw = ctypes.string_at(ctypes.addressof(image_buffer.pdata.contents) + self.base, self.layout.itemsize)
+            row = np.frombuffer(raw, dtype=self.layout, count=1)[0]
+            values = {name: row[name].item() for name in self.layout.names}
+        if self.sdk_names:
+            values.update(self.read_sdk(image_buffer, self.sdk_names))
+        return values
+
+    def read(self, image_buffer, idx):
+        values = self.parse(image_buffer)
+        self.record(idx, values)
+        return values
+
+    def record(self, idx, values):
+        with self.lock:
+            if self.count == len(self.rows):
+                self.rows = np.concatenate([self.rows, np.zeros(len(self.rows), dtype=self.row_dtype)])
+            row = self.rows[self.count]
+            row['idx'] = idx
+            for name in self.names:
+                row[name] = values.get(name, 0)
+            self.count += 1
+
+    def columns(self):
+        """
+        Collected values, one array per chunk
+        """
+        with self.lock:
+            rows = self.rows[:self.count]
+            return {name: rows[name] for name in self.row_dtype.names}
+
+    def flush(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self.lock:
+            if not self.flushed or not os.path.isfile(path) or not append_npy(path, self.rows[self.flushed:self.count], self.count):
+                np.save(path, self.rows[:self.count])
+            self.flushed = self.count
+
+    def save(self, path):
+        self.flush(path)
+        print(f'Saved chunk metadata of {self.count} frames to {path}')
+
+    def truncate(self, first_idx):
+        """
+        Drops the rows from frame first_idx on, they are captured again after a reconnect
+        """
+        with self.lock:
+            self.count = int(np.searchsorted(self.rows['idx'][:self.count], first_idx))
+            self.flushed = min(self.flushed, self.count)
+
+    def resume(self, path, first_idx):
+        """
+        Rows of the frames before first_idx from the sidecar of an interrupted run
+        """
+        if not os.path.isfile(path):
+            return
+        saved = np.load(path)
+        if saved.dtype != self.row_dtype:
+            print(f'[WARNING] {path} has other chunks than {self.names}, not resumed')
+            return
+        saved = saved[saved['idx'] < first_idx]
+        with self.lock:
+            if len(saved) > len(self.rows):
+                self.rows = np.zeros(len(saved) * 2, dtype=self.row_dtype)
+            self.rows[:len(saved)] = saved
+            self.count = len(saved)
+            self.flushed = 0
+        print(f'Resumed chunk metadata of {len(saved)} frames from {path}')
+
+def append_npy(path, rows, count):
+    """
+    Appends rows to the 1-D .npy file at path and sets its length to count.
+    np.save pads the header so the length can grow in place, returns False
+    if the new header does not fit (the file is left unchanged).
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version != (1, 0):
+            return False
+        np.lib.format.read_array_header_1_0(f)
+        data_offset = f.tell()
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(rows.dtype),
+                                                      'fortran_order': False, 'shape': (count,)})
+        if len(header.getvalue()) != data_offset:
+            return False
+
+        f.seek(data_offset + (count - len(rows)) * rows.dtype.itemsize)
+        f.write(rows.tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+def create_chunk_metadata(nodemap):
+    """
+    ChunkMetadata with the chunks enabled on the device if constants.CHUNK_METADATA is on, else None.
+    A device without chunk support captures without metadata, with a warning.
+    """
+    if not constants.CHUNK_METADATA:
+        return None
+    if not chunks_supported(nodemap):
+        print('[WARNING] Chunk data is not supported by the device, capturing without chunk metadata')
+        return None
+    chunk_metadata = ChunkMetadata()
+    chunk_metadata.enable(nodemap)
+    return chunk_metadata
@@ -0,0 +1,205 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, argparse
+
+import constants
+
+"""
+Command line entry point
+
+    python cli.py [--profile run.json] [--set NAME=VALUE ...] <command> ...
+
+    stream     live capture (capture.py), --loop for the single threaded loop
+    burst      burst capture into the RAM ring buffer (rapid_capture.py)
+    configure  configure the camera and exit, --autotune to tune the stream
+    export     .arec recording to image files (recording.py)
+    benchmark  synthetic, device, simulated or imports (benchmark.py)
+    catalog    query the capture catalog, --stack to load the frames (catalog.py)
+
+A run profile is a JSON file of constants.py settings, e.g.
+{"NUM_IMAGES": 500, "ENCODER": "recording"}. Flags are applied after the
+profile, the profile after constants.py, before any backend is imported
+(defaults bound to constants at import see the profile). Every backend is
+imported by its command only, so a command does not pay for the SDK,
+OpenCV or matplotlib when it does not use them.
+"""
+
+def parse_value(text):
+    """
+    JSON value (10, 2.5, true, null, "a", [1, 2]) or else the plain string
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def load_run_profile(path):
+    with open(path) as f:
+        profile = json.load(f)
+    if not isinstance(profile, dict):
+        raise Exception(f'{path} has to contain a JSON object of settings')
+    return profile
+
+def apply_run_profile(profile):
+    """
+    Sets the constants of the profile, unknown names are an error so a typo
+    does not silently run with the default
+    """
+    for name, value in profile.items():
+        if not name.isupper() or not hasattr(constants, name):
+            raise Exception(f'Unknown setting {name}, see constants.py')
+        setattr(constants, name, value)
+
+def get_run_profile(args):
+    profile = load_run_profile(args.profile) if args.profile else {}
+    for item in args.set:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise Exception(f'--set expects NAME=VALUE, got {item}')
+        profile[name.strip()] = parse_value(value)
+
+    # Shortcuts for the common settings
+    shortcuts = {'NUM_IMAGES': args.num_images, 'PNG_PATH': args.output, 'ENCODER': args.encoder,
+                 'PIXEL_FORMAT': args.pixel_format, 'FRAME_RATE': args.frame_rate, 'EXPOSURE_TIME': args.exposure}
+    profile.update({name: value for name, value in shortcuts.items() if value is not None})
+    return profile
+
+def run_stream(args):
+    import capture
+    if args.loop:
+        capture.capture_image()
+    else:
+        capture.capture_image_pipeline()
+
+def run_burst(args):
+    import rapid_capture
+    rapid_capture.capture_burst()
+
+def run_configure(args):
+    if args.autotune:
+        import autotune
+        autotune.autotune()
+        return
+
+    from utils import get_system, create_devices_with_tries, check_initial_values, streaming_setup
+    from configuration import set_configuration
+
+    system = get_system()
+    devices = create_devices_with_tries()
+    device = system.select_device(devices)
+    print(f'Device used in the example:\n\t{device}')
+    check_initial_values(device.nodemap)
+    streaming_setup(device.tl_stream_nodemap)
+    set_configuration(device.nodemap)
+    system.destroy_device()
+
+def run_export(args):
+    from recording import export_recording
+    png_path = args.output or os.path.splitext(args.recording)[0]
+    export_recording(args.recording, png_path, args.format, num_workers=args.workers)
+
+def run_benchmark(args):
+    import benchmark
+    if args.mode == 'device':
+        benchmark.run_device()
+    elif args.mode == 'simulated':
+        benchmark.benchmark_capture_paths()
+    elif args.mode == 'imports':
+        benchmark.benchmark_imports()
+    else:
+        benchmark.run_synthetic()
+
+def run_catalog(args):
+    from catalog import CatalogLoader
+
+    filters = {}
+    if args.serial:
+        filters['serial'] = args.serial
+    if args.run:
+        filters['run'] = os.path.abspath(args.run)
+    if args.min_exposure is not None or args.max_exposure is not None:
+        filters['exposure'] = (args.min_exposure, args.max_exposure)
+
+    with CatalogLoader() as loader:
+        if not filters and not args.stack:
+            for run in loader.runs():
+                print('%s  %s  %d frames, exposure %s - %s us' % (
+                    run['run'], run['serial'], run['frames'], run['min_exposure'], run['max_exposure']))
+            return
+
+        rows = loader.query(limit=args.limit, **filters)
+        print(f'{len(rows)} frames match')
+        if args.stack and rows:
+            import numpy as np
+            np.save(args.stack, loader.load(rows))
+            print(f'Saved the stack to {args.stack}')
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Arena capture')
+    parser.add_argument('--profile', help='JSON file of constants.py settings')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override one setting, the value is parsed as JSON (repeatable)')
+    parser.add_argument('-n', '--num-images', type=int)
+    parser.add_argument('-o', '--output', help='output path (PNG_PATH)')
+    parser.add_argument('--encoder', choices=['thread', 'process', 'recording', 'stack'])
+    parser.add_argument('--pixel-format')
+    parser.add_argument('--frame-rate', type=float)
+    parser.add_argument('--exposure', type=float, help='exposure time in us')
+    parser.add_argument('--simulated', type=int, metavar='N', help='run on N simulated cameras (fake_arena.py)')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stream = commands.add_parser('stream', help='live capture')
+    stream.add_argument('--loop', action='store_true', help='single threaded loop instead of the pipeline')
+    stream.set_defaults(func=run_stream)
+
+    burst = commands.add_parser('burst', help='burst capture into RAM')
+    burst.set_defaults(func=run_burst)
+
+    configure = commands.add_parser('configure', help='configure the camera and exit')
+    configure.add_argument('--autotune', action='store_true', help='tune buffers / packet size and store the result')
+    configure.set_defaults(func=run_configure)
+
+    export = commands.add_parser('export', help='export a .arec recording to images')
+    export.add_argument('recording')
+    export.add_argument('--format', default='png', choices=['png', 'tiff', 'npy'])
+    export.add_argument('--workers', type=int)
+    export.set_defaults(func=run_export)
+
+    benchmark = commands.add_parser('benchmark', help='benchmarks')
+    benchmark.add_argument('mode', nargs='?', default='synthetic', choices=['synthetic', 'device', 'simulated', 'imports'])
+    benchmark.set_defaults(func=run_benchmark)
+
+    catalog = commands.add_parser('catalog', help='query the capture catalog')
+    catalog.add_argument('--serial')
+    catalog.add_argument('--run', help='PNG_PATH of a capture')
+    catalog.add_argument('--min-exposure', type=float)
+    catalog.add_argument('--max-exposure', type=float)
+    catalog.add_argument('--limit', type=int)
+    catalog.add_argument('--stack', metavar='PATH', help='load the matching frames and save them as one .npy stack')
+    catalog.set_defaults(func=run_catalog)
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    apply_run_profile(get_run_profile(args))
+    if args.simulated:
+        import fake_arena
+        fake_arena.install(num_devices=args.simulated)
+    args.func(args)
+
+if __name__ == "__main__":
+
+    main()
@@ -12,9 +12,9 @@
 # -----------------------------------------------------------------------------
 
 
-import time
-from arena_api.system import system
+import time, os, json, math, threading
 import constants
+from roi import set_roi
 
 def set_exposure(nodemap, long=False):
     
@@ -83,11 +83,7 @@ def set_binning(nodemap):
     nodes = nodemap.get_node(['BinningSelector', 'BinningVertical', 'BinningHorizontal', 'BinningVerticalMode', 'BinningHorizontalMode'])
 
     binning_selector = nodemap["BinningSelector"]
-    print("Checking if sensor binning is supported")
-    if("Digital" not in binning_selector.enumentry_names or
-            not binning_selector.enumentry_nodes.get("Digital").is_readable):
-        print("Digital binning not supported by device: not available from BinningSelector")
-        quit()
+    check_binning(nodemap)
 
     # Entry we will use for BinningVerticalMode and BinningHorizontal Mode
     BINTYPE = "Sum"
@@ -175,14 +171,269 @@ def set_gamma(nodemap):
     print('Setting Gamma to %d'%(constants.GAMMA))
     nodes["Gamma"].value = constants.GAMMA
 
+# Nodes are written in this order: frame rate before exposure (the exposure
+# maximum depends on it), binning and pixel format before width/height (their
+# maximum depends on both), offsets cleared before width/height grow
+CONFIGURATION_ORDER = [
+    'AcquisitionFrameRateEnable', 'AcquisitionFrameRate',
+    'ExposureAuto', 'ExposureTime',
+    'GainAuto', 'Gain',
+    'BinningSelector', 'BinningHorizontalMode', 'BinningVerticalMode',
+    'BinningHorizontal', 'BinningVertical',
+    'PixelFormat',
+    'OffsetX', 'OffsetY',
+    'Width', 'Height',
+    'Gamma',
+]
+
+# Desired values that are only known once the nodes they depend on are written
+MAX = 'max'
+CLAMP = 'clamp'
+
+def get_profile():
+    """
+    Desired node values from constants, same settings as the set_* functions
+    """
+    profile = {}
+    if constants.EXPOSURE_LONG:
+        if 1/constants.FRAME_RATE < constants.EXPOSURE_TIME*1e-6:
+            print('Allowable exposure time : %6f [sec]'%(1/constants.FRAME_RATE))
+            print('[WARNING] Lower the exposure time!!!!')
+        assert 1/constants.FRAME_RATE > constants.EXPOSURE_TIME*1e-6 # unit to seconds (30 Hz frame rate -> max 1/30 sec exposure)
+
+        profile['AcquisitionFrameRateEnable'] = True
+        profile['AcquisitionFrameRate'] = constants.FRAME_RATE
+        profile['ExposureAuto'] = 'Off'
+        profile['ExposureTime'] = constants.EXPOSURE_TIME
+    else:
+        profile['ExposureTime'] = (CLAMP, constants.EXPOSURE_TIME)
+
+    profile['GainAuto'] = 'Off'
+    profile['Gain'] = constants.GAIN
+    profile['BinningSelector'] = 'Digital'
+    profile['BinningHorizontalMode'] = 'Sum'
+    profile['BinningVerticalMode'] = 'Sum'
+    profile['BinningHorizontal'] = constants.BINNING
+    profile['BinningVertical'] = constants.BINNING
+    profile['PixelFormat'] = constants.PIXEL_FORMAT
+    if constants.ROI:
+        # Written by set_roi(), kept in the profile so the cache sees preset changes
+        profile['ROI'] = {constants.ROI: constants.ROI_PRESETS.get(constants.ROI)}
+    else:
+        profile['OffsetX'] = 0
+        profile['OffsetY'] = 0
+        profile['Width'] = MAX
+        profile['Height'] = MAX
+    profile['Gamma'] = constants.GAMMA
+    return profile
+
+def is_equal(current, desired):
+    if isinstance(desired, float) or isinstance(current, float):
+        return math.isclose(current, desired, rel_tol=1e-3, abs_tol=1e-6)
+    return current == desired
+
+def resolve_value(node, desired):
+    if desired == MAX:
+        return node.max
+    if isinstance(desired, tuple) and desired[0] == CLAMP:
+        return min(max(desired[1], node.min), node.max)
+    return desired
+
+# Written node -> later nodes whose value or range can change with it (the
+# sensor geometry follows binning, the exposure limit follows the frame rate)
+DEPENDENT_NODES = {
+    'AcquisitionFrameRateEnable': ['AcquisitionFrameRate', 'ExposureTime'],
+    'AcquisitionFrameRate': ['ExposureTime'],
+    'ExposureAuto': ['ExposureTime'],
+    'GainAuto': ['Gain'],
+    'BinningSelector': ['BinningHorizontalMode', 'BinningVerticalMode', 'BinningHorizontal', 'BinningVertical',
+                        'OffsetX', 'OffsetY', 'Width', 'Height'],
+    'BinningHorizontal': ['OffsetX', 'Width'],
+    'BinningVertical': ['OffsetY', 'Height'],
+    'PixelFormat': ['OffsetX', 'OffsetY', 'Width', 'Height'],
+    'OffsetX': ['Width'],
+    'OffsetY': ['Height'],
+}
+
+def apply_profile(nodemap, profile):
+    """
+    Writes only the nodes that differ from the profile
+    (1) Read the current values of all profile nodes in one get_node call
+    (2) Walk the nodes in CONFIGURATION_ORDER and resolve the desired value
+    (3) Write a node only if it differs from the value of the initial read.
+        Only the nodes that depend on a node just written (DEPENDENT_NODES,
+        e.g. Width / OffsetX after binning) are read again
+    Returns the list of (node name, old value, new value) that were written.
+    """
+    names = [name for name in CONFIGURATION_ORDER if name in profile]
+
+    # (1)
+    nodes = nodemap.get_node(names)
+    current = {}
+    for name in names:
+        if nodes[name] is None:
+            print(f'[WARNING] {name} node not found, skipped')
+            continue
+        current[name] = nodes[name].value
+
+    # (2), (3)
+    changes = []
+    stale = set()
+    for name in names:
+        if name not in current:
+            continue
+        node = nodes[name]
+        value = node.value if name in stale else current[name]
+        desired = resolve_value(node, profile[name])
+        if is_equal(value, desired):
+            continue
+
+        if not node.is_writable:
+            raise Exception(f'{name} node is not writable')
+        node.value = desired
+        changes.append((name, value, desired))
+        stale.update(DEPENDENT_NODES.get(name, ()))
+    return changes
+
+# Devices are configured in parallel (multi_capture), every load-modify-save
+# of the configuration cache holds this lock
+_config_cache_lock = threading.Lock()
+
+def load_config_cache():
+    if not os.path.isfile(constants.CONFIG_CACHE_PATH):
+        return {}
+    try:
+        with open(constants.CONFIG_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_config_cache(cache):
+    """
+    Atomic replace, a reader never sees a partly written file
+    """
+    tmp_path = '%s.%d.tmp' % (constants.CONFIG_CACHE_PATH, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp_path, constants.CONFIG_CACHE_PATH)
+
+def update_config_cache(serial, profile=None):
+    """
+    Stores the profile applied to device serial, None removes the device
+    """
+    with _config_cache_lock:
+        cache = load_config_cache()
+        if profile is not None:
+            cache[serial] = profile
+        elif serial in cache:
+            del cache[serial]
+        else:
+            return
+        save_config_cache(cache)
+
+def invalidate_config_cache(nodemap):
+    """
+    To be called after nodes of the profile were changed outside of
+    set_configuration (e.g. exposure bracketing), so the next run configures again
+    """
+    update_config_cache(str(nodemap.get_node('DeviceSerialNumber').value))
+
+# Read back before a cached configuration is trusted: a camera that was power
+# cycled or replaced under the same serial has lost (some of) them
+VERIFY_NODES = ['AcquisitionFrameRateEnable', 'AcquisitionFrameRate', 'ExposureTime', 'PixelFormat']
+
+def verify_profile(nodemap, profile, names=VERIFY_NODES):
+    """
+    True when the device still has the profile values of names
+    """
+    names = [name for name in names if name in profile]
+    nodes = nodemap.get_node(names)
+    for name in names:
+        node = nodes[name]
+        if node is not None and not is_equal(node.value, resolve_value(node, profile[name])):
+            return False
+    return True
+
+def check_binning(nodemap):
+    binning_selector = nodemap["BinningSelector"]
+    print("Checking if sensor binning is supported")
+    if("Digital" not in binning_selector.enumentry_names or
+            not binning_selector.enumentry_nodes.get("Digital").is_readable):
+        print("Digital binning not supported by device: not available from BinningSelector")
+        quit()
+
+def set_configuration_diff(nodemap):
+    """
+    Diff based configuration
+    (1) Build the profile and skip everything if this device already got the
+        same profile in a previous run (CONFIG_CACHE) and still has it
+        (verify_profile reads back VERIFY_NODES)
+    (2) Otherwise write only the nodes that differ (apply_profile)
+    (3) Remember the applied profile by device serial number
+    """
+    start = time.perf_counter()
+
+    # (1)
+    profile = get_profile()
+    serial = str(nodemap.get_node('DeviceSerialNumber').value)
+    if constants.CONFIG_CACHE:
+        with _config_cache_lock:
+            cached = load_config_cache().get(serial)
+        if cached == json.loads(json.dumps(profile)):
+            if verify_profile(nodemap, profile):
+                print(f'Device {serial} already has the requested configuration, skipped')
+                return []
+            print(f'[WARNING] Device {serial} lost its cached configuration (power cycled or replaced), configuring')
+
+    # (2)
+    if 'BinningSelector' in profile:
+        check_binning(nodemap)
+    try:
+        changes = apply_profile(nodemap, profile)
+    except Exception:
+        # The device state is unknown now, do not trust the cache any more
+        if constants.CONFIG_CACHE:
+            update_config_cache(serial)
+        raise
+
+    for name, old, new in changes:
+        print(f'Set {name} : {old} -> {new}')
+    print('Configuration: %d nodes written in %.1f ms' % (len(changes), (time.perf_counter() - start) * 1e3))
+
+    # (3)
+    if constants.CONFIG_CACHE:
+        update_config_cache(serial, profile)
+    return changes
+
 def set_configuration(nodemap):
     print('Start Setting =================')
     
-    set_exposure(nodemap=nodemap, long=constants.EXPOSURE_LONG)
-    set_binning(nodemap)
-    set_gain(nodemap)
-    set_pixel_format(nodemap)
-    set_width_height(nodemap)
-    set_gamma(nodemap)
+    if constants.CONFIG_DIFF:
+        set_configuration_diff(nodemap)
+    else:
+        set_exposure(nodemap=nodemap, long=constants.EXPOSURE_LONG)
+        set_binning(nodemap)
+        set_gain(nodemap)
+        set_pixel_format(nodemap)
+        set_width_height(nodemap)
+        set_gamma(nodemap)
+
+    # Host crop to apply to every frame when the camera can not set the ROI
+    crop = set_roi(nodemap) if constants.ROI else None
     
-    print('End Setting ===================')
\ No newline at end of file
+    print('End Setting ===================')
+    return crop
+
+def resume_configuration(nodemap, profile=None):
+    """
+    Configuration of a device that was reconnected in the middle of a
+    session: the profile is diffed against the device and only what it lost
+    is written. The configuration cache is not consulted, a power cycled
+    camera is still listed there with its old settings.
+    Returns the host crop like set_configuration().
+    """
+    start = time.perf_counter()
+    changes = apply_profile(nodemap, profile or get_profile())
+    crop = set_roi(nodemap) if constants.ROI else None
+    print('Configuration restored: %d nodes written in %.1f ms' % (len(changes), (time.perf_counter() - start) * 1e3))
+    return crop
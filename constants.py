@@ -1,13 +1,13 @@
-import datetime
-
 # Save
-PNG_PATH = './captured_images' + '/' + datetime.datetime.now().strftime('%Y_%m_%d_%H_%M')
+PNG_ROOT = './captured_images'
+PNG_PATH = None # None = PNG_ROOT/<date_time> of the run (utils.get_png_path)
 PNG_NAME = 'capture'
 
 # streaming configuration
 NUM_IMAGES = 10
 TIMEOUT = 2000 # ms
 NUM_BUFFERS = 10
+DEVICE_WAIT_TIMEOUT = 60 # sec, waiting for a device to be connected at startup
 
 # camera configuration
 FRAME_RATE = 60.0 # Hz
@@ -18,5 +18,134 @@ WHITE_BALANCING = False # False = white balancing off
 GAIN = 0.0
 GAMMA = 1.0
 BINNING = 1
-TRIGGER_MODE = True # True = trigger mode ON
+TRIGGER_MODE = False # True = trigger mode ON (trigger.py)
+
+
+# pipeline (acquisition thread -> bounded queue -> writer threads)
+PIPELINE = True
+NUM_WRITERS = 4
+QUEUE_SIZE = 64
+OVERFLOW_POLICY = 'block' # 'block', 'drop_oldest' or 'drop_newest'
+PIPELINE_REPORT_INTERVAL = 1.0 # sec, 0 = only report at the end
+
+# encoder (process pool, frames are passed through shared memory)
+ENCODER = 'process' # 'thread' = encode in the pipeline writer threads, 'process' = EncoderPool, 'recording' = raw recording, 'stack' = FrameStacker
+ENCODER_WORKERS = 0 # 0 = os.cpu_count()
+ENCODER_SLOTS = 0 # shared memory frame slots, 0 = 2 * ENCODER_WORKERS
+ENCODER_ORDERED = False # True = files are written in submission order
+IMAGE_FORMAT = 'png' # 'png', 'tiff' or 'npy' (uncompressed)
+PNG_COMPRESSION = 3 # 0 (fastest) - 9 (smallest)
+
+# raw recording (.arec, see recording.py)
+RECORDING_EXTENSION = '.arec'
+RECORDING_PREALLOCATE = 0 # bytes reserved up front, 0 = grow while recording
+RECORDING_WRITE_BUFFER = 16 * 1024 * 1024 # bytes
+
+# burst (rapid_capture.py, frames are kept in a preallocated RAM ring buffer)
+BURST = False # True = python rapid_capture.py runs capture_burst()
+BURST_FRAMES = 1000 # ring buffer size in frames
+BURST_BYTES = 0 # ring buffer size in bytes, overrides BURST_FRAMES when > 0
+BURST_DURATION = 0 # sec, trigger window; 0 = stop when BURST_FRAMES frames are captured
+BURST_FLUSH = 'after' # 'after' = save when the window closed, 'background' = save while capturing
+
+# multi-device capture (multi_capture.py)
+MULTI_MATCH = 'timestamp' # 'timestamp' (PTP synchronized clocks) or 'frame_id' (shared hardware trigger)
+MULTI_TOLERANCE_NS = 1000000 # ns, max timestamp difference within a matched set
+MULTI_MAX_PENDING = 64 # unmatched frames kept per camera
+MULTI_PTP = True # enable PTP on every device when matching by timestamp
+
+# configuration (configuration.py)
+CONFIG_DIFF = True # write only the nodes that differ from the requested values
+CONFIG_CACHE = True # skip configuration when the device already got the same profile
+CONFIG_CACHE_PATH = './config_cache.json'
+
+# instrumentation (metrics.py)
+METRICS = True # per-stage latency, fps and dropped frames, exported as <PNG_PATH>_metrics.json/.prom
+METRICS_SUFFIX = '_metrics'
+
+# live preview (preview.py, rendered in a separate process)
+PREVIEW = False # needs a display, off for headless runs and benchmarks
+PREVIEW_FPS = 15.0 # Hz, display rate cap, independent of acquisition
+PREVIEW_DOWNSAMPLE = 4 # decimation factor
+PREVIEW_MODE = 'stride' # 'stride' (every n-th pixel) or 'bin' (n x n mean)
+
+# stacking (stacking.py, ENCODER = 'stack')
+STACK_DTYPE = 'float64' # accumulator dtype, 'float32' or 'float64'
+STACK_CLIP_WINDOW = 0 # frames per sigma-clipping block, 0 = no sigma-clipped mean
+STACK_SIGMA = 3.0
+STACK_NOISE_MAPS = True # save per-pixel std and variance
+
+# exposure bracketing (bracketing.py)
+BRACKETS = [ # exposure in us, gain in dB
+    {'exposure': 1000.0, 'gain': 0.0},
+    {'exposure': 4000.0, 'gain': 0.0},
+    {'exposure': 15000.0, 'gain': 0.0},
+]
+BRACKET_FRAMES = 1 # frames saved per bracket
+BRACKET_SWEEPS = 1 # number of times the bracket list is captured
+BRACKET_SETTLE_FRAMES = 2 # frames discarded after exposure / gain changed, without chunk data
+BRACKET_SETTLE_MAX_FRAMES = 30 # with chunk data: frames discarded at most until the chunk exposure / gain match
+BRACKET_HDR = True # merge every sweep into one radiance frame
+
+# chunk metadata (chunk_data.py)
+CHUNK_METADATA = False # per-frame Timestamp / ExposureTime / Gain / FrameID, saved as <PNG_PATH>_chunks.npy
+CHUNKS = ['Timestamp', 'ExposureTime', 'Gain', 'FrameID']
+CHUNK_LEARN_FRAMES = 3 # frames used to locate the chunk values in the buffer
+CHUNK_SUFFIX = '_chunks.npy'
+
+# region of interest (roi.py), sizes and offsets in binned pixels
+ROI = None # name of a preset, None = full sensor
+ROI_PRESETS = {
+    'center_half': {'width': 1224, 'height': 1024, 'offset_x': 'center', 'offset_y': 'center'},
+    'top_strip': {'width': 2448, 'height': 256, 'offset_x': 0, 'offset_y': 0},
+}
+LINK_SPEED = 125000000 # bytes/s, used when the device has no DeviceLinkSpeed node (GigE)
+
+# change detection gating (gating.py), frames nearly identical to the last saved one are skipped
+GATE = False
+GATE_METRIC = 'mad' # 'mad' (mean absolute difference) or 'tile' (largest tile mean difference)
+GATE_THRESHOLD = 0.02 # fraction of the pixel format full scale
+GATE_DOWNSAMPLE = 8 # decimation factor of the compared copy
+GATE_TILE = 16 # tile size in decimated pixels ('tile')
+GATE_KEYFRAME_INTERVAL = 100 # a frame is saved after this many skipped frames, 0 = never
+GATE_SUFFIX = '_gate.json' # summary
+GATE_LOG_SUFFIX = '_gate.jsonl' # one decision per line, written while capturing
+
+# stream autotuning (autotune.py), results per camera / host NIC
+AUTOTUNE_PATH = './autotune.json'
+AUTOTUNE_BUFFERS = [4, 10, 32, 100] # stream buffer counts tried
+AUTOTUNE_HANDLING_MODES = ['OldestFirst', 'NewestOnly']
+AUTOTUNE_PACKETS = [('auto', 0), (9000, 0), (1500, 0), (9000, 10000)] # (packet size in bytes or 'auto', inter-packet delay)
+AUTOTUNE_FRAMES = 100 # measured frames per configuration
+AUTOTUNE_WARMUP = 10 # frames discarded after the stream started
+
+# triggered acquisition (trigger.py), used with TRIGGER_MODE = True
+TRIGGER_SELECTOR = 'FrameStart'
+TRIGGER_SOURCE = 'Software' # 'Software' = TriggerScheduler, 'Line0', 'Line2', ... = hardware input
+TRIGGER_ACTIVATION = 'RisingEdge' # hardware lines only
+TRIGGER_SCHEDULE = 'rate' # 'rate', 'times' or 'burst'
+TRIGGER_RATE = 30.0 # Hz ('rate')
+TRIGGER_TIMES = [0.0, 0.1, 0.25, 0.5, 1.0] # sec from the start ('times')
+TRIGGER_BURST_COUNT = 5 # triggers per burst ('burst')
+TRIGGER_BURST_INTERVAL = 0.01 # sec between the triggers of a burst
+TRIGGER_BURST_PERIOD = 1.0 # sec between the starts of two bursts
+TRIGGER_SPIN = 0.002 # sec busy-waited before every trigger instead of sleeping
+TRIGGER_BACKPRESSURE = 0.8 # pipeline queue fill that holds the next software trigger, 0 = never hold
+TRIGGER_SUFFIX = '_trigger.json'
+
+# sessions (session.py), checkpointed to persist.json so a crashed or disconnected capture resumes
+SESSION = True
+SESSION_PATH = None # None = PNG_ROOT/persist.json
+SESSION_KEY = 'session' # key of the checkpoint, the other keys of the file are kept
+SESSION_RESUME = True # continue a session that did not complete, False = always start a new one
+SESSION_CHECKPOINT_INTERVAL = 2.0 # sec between checkpoints
+SESSION_CHECKPOINT_FRAMES = 500 # frames finished that trigger an earlier checkpoint
+RECONNECT_TIMEOUT = 300 # sec, waiting for a lost device to come back
+RECONNECT_BACKOFF_INITIAL = 0.05 # sec, first device list poll interval, doubled up to RECONNECT_BACKOFF_MAX
+RECONNECT_BACKOFF_MAX = 2.0 # sec
 
+# capture catalog (catalog.py), SQLite index of every saved frame
+CATALOG = True
+CATALOG_PATH = None # None = PNG_ROOT/catalog.sqlite
+CATALOG_WORKERS = 0 # loader decode threads, 0 = os.cpu_count()
+CATALOG_CACHE_FRAMES = 256 # decoded frames kept by the loader (LRU), 0 = no cache
@@ -0,0 +1,338 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, io, sys, queue, threading, collections
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+import constants
+
+IMAGE_EXTENSIONS = {'png': '.png', 'tiff': '.tiff', 'npy': '.npy'}
+
+def get_image_name(idx, image_format='png'):
+    """
+    Deterministic file name of frame idx, same scheme as save_image_opencv
+    """
+    return "%s_%04d%s"%(constants.PNG_NAME, idx, IMAGE_EXTENSIONS[image_format])
+
+def encode_array(arr, image_format='png', png_compression=None):
+    """
+    Encodes an array to the bytes of a png / tiff / npy file
+    """
+    png_compression = constants.PNG_COMPRESSION if png_compression is None else png_compression
+    if image_format == 'npy':
+        bytes_io = io.BytesIO()
+        np.save(bytes_io, arr)
+        return bytes_io.getvalue()
+
+    import cv2
+    params = []
+    if image_format == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    ok, encoded = cv2.imencode(IMAGE_EXTENSIONS[image_format], arr, params)
+    if not ok:
+        raise Exception(f'Failed to encode frame as {image_format}')
+    return encoded.tobytes()
+
+def write_array(path, arr, image_format='png', png_compression=None):
+    png_compression = constants.PNG_COMPRESSION if png_compression is None else png_compression
+    with open(path, 'wb') as f:
+        f.write(encode_array(arr, image_format, png_compression))
+
+def fsync_files(paths, directory=None):
+    """
+    Flushes written files (and the directory entries) to disk, used in
+    batches by the writers' sync()
+    """
+    for path in list(paths) + ([directory] if directory else []):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+# Shared memory blocks attached in a worker process, by name
+_attached = {}
+
+def _attach(shm_name):
+    """
+    Attaches the block of the pool without tracking it: the pool owns and
+    unlinks it, a resource tracker of the worker would unlink it (and warn
+    about a leak) when the worker exits. Before Python 3.13 attaching always
+    registers, which is harmless with the pool's tracker (a set of names).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    return shared_memory.SharedMemory(name=shm_name)
+
+def _encode_slot(shm_name, offset, shape, dtype, path, image_format, png_compression, return_bytes):
+    """
+    Runs in a worker process: reads the frame from shared memory and encodes it
+    """
+    if shm_name not in _attached:
+        _attached[shm_name] = _attach(shm_name)
+    shm = _attached[shm_name]
+
+    arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+    if return_bytes:
+        return encode_array(arr, image_format, png_compression)
+
+    write_array(path, arr, image_format, png_compression)
+    return None
+
+class EncoderPool:
+    """
+    Process pool encoder for png / tiff / npy (uncompressed) output
+    (1) Frames are copied into a free slot of a shared memory block, only the
+        slot offset, shape and dtype are sent to the worker (no pickling of
+        pixel data)
+    (2) A worker process encodes the slot and the slot is freed again
+    (3) submit() blocks while every slot is in use, which gives backpressure
+        to the caller
+
+    File names follow the PNG_NAME_%04d scheme of the frame index, so they do
+    not depend on which worker encodes a frame.
+    With ordered=False the workers write their files as soon as they are done.
+    With ordered=True the workers return the encoded bytes and the files are
+    written in submission order by a single writer thread.
+    """
+    def __init__(self, png_path, num_workers=None, image_format=None, png_compression=None, ordered=None,
+                 num_slots=None):
+        num_workers = constants.ENCODER_WORKERS if num_workers is None else num_workers
+        image_format = constants.IMAGE_FORMAT if image_format is None else image_format
+        png_compression = constants.PNG_COMPRESSION if png_compression is None else png_compression
+        ordered = constants.ENCODER_ORDERED if ordered is None else ordered
+        num_slots = constants.ENCODER_SLOTS if num_slots is None else num_slots
+        if image_format not in IMAGE_EXTENSIONS:
+            raise Exception(f'Unknown image format {image_format}, use one of {list(IMAGE_EXTENSIONS)}')
+
+        self.png_path = png_path
+        self.num_workers = num_workers or os.cpu_count()
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.ordered = ordered
+        self.num_slots = num_slots or 2 * self.num_workers
+
+        # Started before the workers so they share it, see _attach()
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        self.shm = None
+        self.slot_size = 0
+        self.free_slots = queue.Queue()
+        self.lock = threading.Lock()
+        self.errors = []
+
+        self.unsynced = []
+        self.submitted = 0
+        self.completed = 0
+        self.completed_changed = threading.Condition()
+
+        self.pending = collections.deque()
+        self.pending_ready = threading.Condition()
+        self.ordered_writer = None
+        if self.ordered:
+            self.ordered_writer = threading.Thread(target=self._write_in_order, name='ordered-writer', daemon=True)
+            self.ordered_writer.start()
+
+        if not os.path.isdir(png_path):
+            os.makedirs(png_path)
+
+    def _allocate(self, nbytes):
+        # The shared memory block is sized by the first frame
+        with self.lock:
+            if self.shm is None:
+                self.slot_size = nbytes
+                self.shm = shared_memory.SharedMemory(create=True, size=nbytes * self.num_slots)
+                for slot in range(self.num_slots):
+                    self.free_slots.put(slot)
+
+    def _complete(self):
+        with self.completed_changed:
+            self.completed += 1
+            self.completed_changed.notify_all()
+
+    def _release(self, slot, future, path):
+        self.free_slots.put(slot)
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+        if not self.ordered:
+            if future.exception() is None:
+                self.unsynced.append(path)
+            self._complete()
+
+    def submit(self, arr, idx):
+        if self.errors:
+            raise self.errors[0]
+
+        if self.shm is None:
+            self._allocate(arr.nbytes)
+        if arr.nbytes > self.slot_size:
+            raise Exception(f'Frame of {arr.nbytes} bytes does not fit in a {self.slot_size} bytes slot')
+
+        # (1) Copy into a free slot, waits if all slots are being encoded
+        slot = self.free_slots.get()
+        offset = slot * self.slot_size
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=self.shm.buf, offset=offset)[...] = arr
+
+        # (2) Encode in a worker process
+        path = os.path.join(self.png_path, get_image_name(idx, self.image_format))
+        future = self.executor.submit(_encode_slot, self.shm.name, offset, arr.shape, arr.dtype.str,
+                                      path, self.image_format, self.png_compression, self.ordered)
+        with self.completed_changed:
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._release(slot, f, path))
+
+        if self.ordered:
+            with self.pending_ready:
+                self.pending.append((path, future))
+                self.pending_ready.notify()
+        return path
+
+    def __call__(self, arr, idx, info):
+        # Same signature as a CapturePipeline writer
+        return self.submit(arr, idx)
+
+    def _write_in_order(self):
+        while True:
+            with self.pending_ready:
+                while not self.pending:
+                    self.pending_ready.wait()
+                item = self.pending.popleft()
+            if item is None:
+                return
+
+            path, future = item
+            try:
+                encoded = future.result()
+                with open(path, 'wb') as f:
+                    f.write(encoded)
+                self.unsynced.append(path)
+            except Exception as e:
+                self.errors.append(e)
+            self._complete()
+
+    def sync(self):
+        """
+        Waits for the frames submitted so far to be written, then fsyncs
+        the files written since the last sync
+        """
+        with self.completed_changed:
+            submitted = self.submitted
+            self.completed_changed.wait_for(lambda: self.completed >= submitted)
+        paths, self.unsynced = self.unsynced, []
+        fsync_files(paths, self.png_path)
+
+    def close(self):
+        """
+        Waits for every submitted frame to be written and frees the shared memory
+        """
+        if self.ordered:
+            with self.pending_ready:
+                self.pending.append(None)
+                self.pending_ready.notify()
+            self.ordered_writer.join()
+
+        self.executor.shutdown(wait=True)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ImageWriter:
+    """
+    Encodes and writes in the calling thread, one file per frame
+    """
+    def __init__(self, png_path, image_format=None, png_compression=None):
+        image_format = constants.IMAGE_FORMAT if image_format is None else image_format
+        png_compression = constants.PNG_COMPRESSION if png_compression is None else png_compression
+        if image_format not in IMAGE_EXTENSIONS:
+            raise Exception(f'Unknown image format {image_format}, use one of {list(IMAGE_EXTENSIONS)}')
+
+        self.png_path = png_path
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.unsynced = []
+
+        if not os.path.isdir(png_path):
+            os.makedirs(png_path)
+
+    def __call__(self, arr, idx, info):
+        path = os.path.join(self.png_path, get_image_name(idx, self.image_format))
+        write_array(path, arr, self.image_format, self.png_compression)
+        self.unsynced.append(path)
+        return path
+
+    def sync(self):
+        """
+        fsync of the files written since the last sync
+        """
+        paths, self.unsynced = self.unsynced, []
+        fsync_files(paths, self.png_path)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def split_workers(num_writers):
+    """
+    Encoder processes per writer when num_writers EncoderPools run at once,
+    so that together they use ENCODER_WORKERS (or every cpu) and not that
+    many per camera
+    """
+    total = constants.ENCODER_WORKERS or os.cpu_count()
+    return max(1, total // max(1, num_writers))
+
+
+def create_writer(png_path, encoder=None, resume=None, num_workers=None):
+    """
+    Frame writer selected by constants.ENCODER
+        - 'thread'    : ImageWriter, encodes in the calling thread
+        - 'process'   : EncoderPool, encodes in worker processes
+        - 'recording' : RecordingWriter, raw frames appended to one file
+        - 'stack'     : FrameStacker, only the reduced stack is saved
+    Every writer is called as writer(arr, idx, info) and has to be closed.
+    The call returns where the frame went (file path, offset in the
+    recording, None for the stack), see catalog.CatalogWriter.
+    resume is the writer state of a session checkpoint (see session.py),
+    image files need none as their names follow the frame index.
+    num_workers overrides ENCODER_WORKERS for the 'process' pool, see
+    split_workers() when several writers run side by side.
+    """
+    encoder = encoder or constants.ENCODER
+    if encoder == 'thread':
+        return ImageWriter(png_path)
+    if encoder == 'process':
+        return EncoderPool(png_path, num_workers=num_workers)
+    if encoder == 'recording':
+        from recording import RecordingWriter
+        return RecordingWriter(png_path + constants.RECORDING_EXTENSION, resume=resume)
+    if encoder == 'stack':
+        from stacking import FrameStacker
+        return FrameStacker(png_path)
+    raise Exception(f'Unknown encoder {encoder}, use thread, process, recording or stack')
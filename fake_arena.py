@@ -0,0 +1,462 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import sys, time, types, ctypes, struct, enum, threading, contextlib
+import numpy as np
+
+"""
+Simulated arena_api
+
+Drop-in replacement for the parts of arena_api used by this repository
+(system, device, nodemap, tl_stream_nodemap and buffers with data / pdata /
+has_chunkdata), generating frames at a configurable resolution, pixel format
+and frame rate. install() registers it as arena_api in sys.modules, so it has
+to be called before capture.py, utils.py, ... are imported.
+
+    import fake_arena
+    fake_arena.install(num_devices=2, width=1920, height=1080, frame_rate=120)
+    import capture
+    capture.capture_image_pipeline()
+"""
+
+PixelFormat = enum.Enum('PixelFormat', ['Mono8', 'Mono10', 'Mono12', 'Mono16', 'Mono10p', 'Mono12p',
+                                        'Mono12Packed', 'BayerRG8', 'BayerRG16', 'RGB8', 'BGR8'])
+
+# chunk name -> (GigE Vision chunk ID, little endian encoding)
+CHUNKS = {
+    'Timestamp': (0xA0000001, '<u8'),
+    'ExposureTime': (0xA0000002, '<f8'),
+    'Gain': (0xA0000003, '<f8'),
+    'FrameID': (0xA0000004, '<u8'),
+}
+
+# pixel format -> bits per pixel
+BITS_PER_PIXEL = {
+    'Mono8': 8, 'Mono10': 16, 'Mono12': 16, 'Mono16': 16,
+    'Mono10p': 10, 'Mono12p': 12, 'Mono12Packed': 12,
+    'BayerRG8': 8, 'BayerRG16': 16, 'RGB8': 24, 'BGR8': 24,
+}
+
+class FakeNode:
+    """
+    Node with value / min / max / inc and enumeration entries. min and max
+    can be callables, so they can depend on other nodes (e.g. Width on binning)
+    """
+    def __init__(self, name, value, min=None, max=None, inc=1, is_writable=True, is_readable=True,
+                 enumentry_names=None, on_execute=None, getter=None, setter=None):
+        self.name = name
+        self._value = value
+        self._min = min
+        self._max = max
+        self.inc = inc
+        self.is_writable = is_writable
+        self.is_readable = is_readable
+        self.enumentry_names = enumentry_names or []
+        self.enumentry_nodes = {entry: types.SimpleNamespace(is_readable=True) for entry in self.enumentry_names}
+        self.on_execute = on_execute
+        # Nodes whose value lives elsewhere (e.g. ChunkEnable of the selected chunk)
+        self.getter = getter
+        self.setter = setter
+
+    @property
+    def min(self):
+        return self._min() if callable(self._min) else self._min
+
+    @property
+    def max(self):
+        return self._max() if callable(self._max) else self._max
+
+    @property
+    def value(self):
+        if not self.is_readable:
+            raise Exception(f'{self.name} node is not readable')
+        if self.getter is not None:
+            return self.getter()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if not self.is_writable:
+            raise Exception(f'{self.name} node is not writable')
+        if self.enumentry_names and value not in self.enumentry_names:
+            raise Exception(f'{value} is not an entry of {self.name}')
+        if self.max is not None and value > self.max:
+            raise Exception(f'{self.name} value {value} is over maximum {self.max}')
+        if self.min is not None and value < self.min:
+            raise Exception(f'{self.name} value {value} is under minimum {self.min}')
+        if self.setter is not None:
+            self.setter(value)
+        else:
+            self._value = value
+
+    def execute(self):
+        if self.on_execute is not None:
+            self.on_execute()
+
+    def __repr__(self):
+        return f'FakeNode({self.name}={self._value!r})'
+
+class FakeNodeMap:
+    def __init__(self, nodes):
+        self.nodes = {node.name: node for node in nodes}
+        self.get_node_calls = 0
+
+    def add(self, node):
+        self.nodes[node.name] = node
+        return node
+
+    def get_node(self, names):
+        # One round trip, like arena_api a list of names returns a dict
+        self.get_node_calls += 1
+        if isinstance(names, (list, tuple)):
+            return {name: self.nodes.get(name) for name in names}
+        return self.nodes.get(names)
+
+    def __getitem__(self, name):
+        node = self.nodes.get(name)
+        if node is None:
+            raise KeyError(name)
+        return node
+
+class FakeBuffer:
+    """
+    Buffer backed by ctypes memory, like arena_api's Buffer
+    """
+    def __init__(self, size):
+        self.size = size
+        self._memory = (ctypes.c_ubyte * size)()
+        self.pdata = ctypes.cast(self._memory, ctypes.POINTER(ctypes.c_ubyte))
+        self.width = 0
+        self.height = 0
+        self.bits_per_pixel = 8
+        self.pixel_format = PixelFormat.Mono8
+        self.frame_id = 0
+        self.timestamp_ns = 0
+        self.has_chunkdata = False
+        self.is_incomplete = False
+        self.size_filled = size
+        self.chunks = {}
+
+    @property
+    def data(self):
+        # Like arena_api, a new list of ints (one per byte) on every access
+        return list(self._memory)
+
+    def get_chunk(self, names):
+        if not self.has_chunkdata:
+            raise Exception('Buffer has no chunk data')
+        nodes = {name: types.SimpleNamespace(value=self.chunks[name[len('Chunk'):]]) for name in names}
+        return nodes if isinstance(names, (list, tuple)) else nodes[names]
+
+    def __repr__(self):
+        return f'FakeBuffer({self.width}x{self.height} {self.pixel_format.name} #{self.frame_id})'
+
+class FakeDevice:
+    """
+    Simulated camera. Frames are generated at AcquisitionFrameRate when
+    AcquisitionFrameRateEnable is on, otherwise at max_frame_rate
+    (0 = as fast as the consumer asks). With TriggerMode on, one frame is
+    exposed per TriggerSoftware command or fire_line() call instead.
+    """
+    def __init__(self, serial, width=2448, height=2048, pixel_format='Mono8', frame_rate=60.0,
+                 max_frame_rate=0, clock_offset_ns=0):
+        self.serial = serial
+        self.sensor_width = width
+        self.sensor_height = height
+        self.max_frame_rate = max_frame_rate
+        self.clock_offset_ns = clock_offset_ns
+
+        binning = lambda: self.nodemap.nodes['BinningHorizontal'].value
+        self.nodemap = FakeNodeMap([
+            FakeNode('DeviceSerialNumber', str(serial), is_writable=False),
+            FakeNode('DeviceModelName', 'Simulated Arena camera', is_writable=False),
+            FakeNode('AcquisitionMode', 'Continuous', enumentry_names=['Continuous', 'SingleFrame', 'MultiFrame']),
+            FakeNode('AcquisitionFrameRateEnable', False),
+            FakeNode('AcquisitionFrameRate', frame_rate, min=1.0, max=1000.0),
+            FakeNode('ExposureAuto', 'Continuous', enumentry_names=['Off', 'Once', 'Continuous']),
+            FakeNode('ExposureTime', 5000.0, min=10.0, max=lambda: 1e6 / self.nodemap.nodes['AcquisitionFrameRate'].value),
+            FakeNode('GainAuto', 'Continuous', enumentry_names=['Off', 'Once', 'Continuous']),
+            FakeNode('Gain', 0.0, min=0.0, max=48.0),
+            FakeNode('Gamma', 1.0, min=0.2, max=2.0),
+            FakeNode('BinningSelector', 'Sensor', enumentry_names=['Digital', 'Sensor']),
+            FakeNode('BinningHorizontalMode', 'Sum', enumentry_names=['Sum', 'Average']),
+            FakeNode('BinningVerticalMode', 'Sum', enumentry_names=['Sum', 'Average']),
+            FakeNode('BinningHorizontal', 1, min=1, max=4),
+            FakeNode('BinningVertical', 1, min=1, max=4),
+            FakeNode('PixelFormat', pixel_format, enumentry_names=list(BITS_PER_PIXEL)),
+            FakeNode('WidthMax', 0, getter=lambda: self.sensor_width // binning(), is_writable=False),
+            FakeNode('HeightMax', 0, getter=lambda: self.sensor_height // binning(), is_writable=False),
+            FakeNode('DeviceLinkSpeed', 125000000, is_writable=False),
+            FakeNode('Width', width, min=16, max=lambda: self.sensor_width // binning(), inc=16),
+            FakeNode('Height', height, min=16, max=lambda: self.sensor_height // binning(), inc=2),
+            FakeNode('OffsetX', 0, min=0, max=lambda: self.sensor_width // binning() - self.nodemap.nodes['Width'].value, inc=16),
+            FakeNode('OffsetY', 0, min=0, max=lambda: self.sensor_height // binning() - self.nodemap.nodes['Height'].value, inc=2),
+            FakeNode('DeviceStreamChannelPacketSize', 1500, min=576, max=9000, inc=4),
+            FakeNode('GevSCPD', 0, min=0, max=1000000),
+            FakeNode('GevSCDA', 0xA9FE0001, is_writable=False),
+            FakeNode('PtpEnable', False),
+            FakeNode('TriggerSelector', 'FrameStart', enumentry_names=['FrameStart', 'AcquisitionStart']),
+            FakeNode('TriggerMode', 'Off', enumentry_names=['Off', 'On']),
+            FakeNode('TriggerSource', 'Software', enumentry_names=['Software', 'Line0', 'Line2', 'Line3']),
+            FakeNode('TriggerActivation', 'RisingEdge', enumentry_names=['RisingEdge', 'FallingEdge']),
+            FakeNode('TriggerSoftware', None, on_execute=lambda: self._trigger('Software')),
+            FakeNode('TriggerArmed', False, is_writable=False, getter=lambda: self.streaming),
+            FakeNode('ChunkModeActive', False),
+            FakeNode('ChunkSelector', 'Timestamp', enumentry_names=list(CHUNKS)),
+            FakeNode('ChunkEnable', False,
+                     getter=lambda: self.chunks_enabled[self.nodemap.nodes['ChunkSelector'].value],
+                     setter=lambda value: self.chunks_enabled.__setitem__(self.nodemap.nodes['ChunkSelector'].value, value)),
+        ])
+        self.chunks_enabled = {name: False for name in CHUNKS}
+        self.tl_stream_nodemap = FakeNodeMap([
+            FakeNode('StreamBufferHandlingMode', 'OldestFirst',
+                     enumentry_names=['OldestFirst', 'OldestFirstOverwrite', 'NewestOnly']),
+            FakeNode('StreamAutoNegotiatePacketSize', True),
+            FakeNode('StreamPacketResendEnable', True),
+            FakeNode('StreamDeliveredFrameCount', 0, is_writable=False),
+            FakeNode('StreamLostFrameCount', 0, is_writable=False),
+            FakeNode('StreamIncompleteFrameCount', 0, is_writable=False),
+            FakeNode('StreamResendRequestCount', 0, is_writable=False),
+        ])
+
+        self.streaming = False
+        self.connected = True
+        self.free_buffers = []
+        self.frame_id = 0
+        self.next_frame_time = 0.0
+        self.patterns = {}
+        self.lock = threading.Lock()
+        self.buffer_available = threading.Condition(self.lock)
+        self.triggers = []
+        self.trigger_received = threading.Condition(threading.Lock())
+
+    def __str__(self):
+        return f'Simulated device {self.serial}'
+
+    def _frame_rate(self):
+        if self.nodemap.nodes['AcquisitionFrameRateEnable'].value:
+            return self.nodemap.nodes['AcquisitionFrameRate'].value
+        return self.max_frame_rate
+
+    def _pattern(self, nbytes):
+        # A few random frames generated once and cycled
+        if nbytes not in self.patterns:
+            self.patterns[nbytes] = np.random.default_rng(int(self.serial) % 2**32).integers(
+                0, 256, (4, nbytes), dtype=np.uint8)
+        return self.patterns[nbytes]
+
+    @contextlib.contextmanager
+    def start_stream(self, number_of_buffers=10):
+        width = self.nodemap.nodes['Width'].value
+        height = self.nodemap.nodes['Height'].value
+        pixel_format = self.nodemap.nodes['PixelFormat'].value
+        bits_per_pixel = BITS_PER_PIXEL[pixel_format]
+        nbytes = (width * height * bits_per_pixel + 7) // 8
+        self.image_size = nbytes
+
+        # Every enabled chunk: 8 bytes of data + chunk ID + length trailer
+        self.chunk_layout = []
+        if self.nodemap.nodes['ChunkModeActive'].value:
+            self.chunk_layout = [name for name, enabled in self.chunks_enabled.items() if enabled]
+        chunk_bytes = 16 * len(self.chunk_layout)
+
+        self.free_buffers = []
+        for _ in range(number_of_buffers):
+            buffer = FakeBuffer(nbytes + chunk_bytes)
+            buffer.width, buffer.height = width, height
+            buffer.bits_per_pixel = bits_per_pixel
+            buffer.pixel_format = PixelFormat[pixel_format]
+            buffer.has_chunkdata = bool(self.chunk_layout)
+            self.free_buffers.append(buffer)
+
+        self.streaming = True
+        self.next_frame_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stop_stream()
+
+    def stop_stream(self):
+        self.streaming = False
+        with self.trigger_received:
+            self.triggers = []
+
+    def _trigger(self, source):
+        # Triggers from another source than the selected one are ignored
+        nodes = self.nodemap.nodes
+        if not self.streaming or nodes['TriggerMode'].value != 'On' or nodes['TriggerSource'].value != source:
+            return
+        with self.trigger_received:
+            self.triggers.append(time.perf_counter_ns())
+            self.trigger_received.notify_all()
+
+    def fire_line(self, line='Line0'):
+        """
+        Simulates an edge on a hardware trigger input
+        """
+        self._trigger(line)
+
+    def _deliver(self, timeout_ms):
+        with self.buffer_available:
+            if not self.buffer_available.wait_for(lambda: self.free_buffers, timeout_ms / 1000):
+                raise Exception('get_buffer timed out: all buffers are held by the application')
+            buffer = self.free_buffers.pop(0)
+
+        frame_rate = self._frame_rate()
+        triggered_ns = None
+        if self.nodemap.nodes['TriggerMode'].value == 'On':
+            # A frame is exposed per trigger, it is ready after the exposure
+            with self.trigger_received:
+                if not self.trigger_received.wait_for(lambda: self.triggers, timeout_ms / 1000):
+                    self.requeue_buffer(buffer)
+                    raise Exception('get_buffer timed out: no trigger')
+                triggered_ns = self.triggers.pop(0)
+            ready = triggered_ns * 1e-9 + self.nodemap.nodes['ExposureTime'].value * 1e-6
+            delay = ready - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elif frame_rate:
+            # Frames come at a fixed rate, a slow consumer misses them
+            now = time.perf_counter()
+            missed = int((now - self.next_frame_time) * frame_rate)
+            if missed > 0:
+                self.frame_id += missed
+                self.tl_stream_nodemap.nodes['StreamLostFrameCount']._value += missed
+                self.next_frame_time += missed / frame_rate
+            delay = self.next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_frame_time += 1 / frame_rate
+
+        pattern = self._pattern(self.image_size)
+        ctypes.memmove(buffer._memory, pattern[self.frame_id % len(pattern)].ctypes.data, self.image_size)
+        buffer.frame_id = self.frame_id
+        buffer.timestamp_ns = (triggered_ns or time.perf_counter_ns()) + self.clock_offset_ns
+        if self.chunk_layout:
+            self._write_chunks(buffer)
+        self.frame_id += 1
+        self.tl_stream_nodemap.nodes['StreamDeliveredFrameCount']._value += 1
+        return buffer
+
+    def _write_chunks(self, buffer):
+        values = {
+            'Timestamp': buffer.timestamp_ns,
+            'ExposureTime': self.nodemap.nodes['ExposureTime'].value,
+            'Gain': self.nodemap.nodes['Gain'].value,
+            'FrameID': buffer.frame_id,
+        }
+        offset = self.image_size
+        for name in self.chunk_layout:
+            chunk_id, encoding = CHUNKS[name]
+            chunk = np.array([values[name]], dtype=encoding).tobytes() + struct.pack('>II', chunk_id, 8)
+            ctypes.memmove(ctypes.addressof(buffer._memory) + offset, chunk, len(chunk))
+            offset += len(chunk)
+        buffer.chunks = {name: values[name] for name in self.chunk_layout}
+
+    def get_buffer(self, number_of_buffers=None, timeout=2000):
+        if not self.connected:
+            raise Exception('Device lost')
+        if not self.streaming:
+            raise Exception('Stream is not started')
+        if number_of_buffers is None:
+            return self._deliver(timeout)
+        return [self._deliver(timeout) for _ in range(number_of_buffers)]
+
+    def requeue_buffer(self, buffers):
+        if not isinstance(buffers, (list, tuple)):
+            buffers = [buffers]
+        with self.buffer_available:
+            self.free_buffers.extend(buffers)
+            self.buffer_available.notify_all()
+
+class FakeSystem:
+    def __init__(self, num_devices=1, **device_kwargs):
+        self.num_devices = num_devices
+        self.device_kwargs = device_kwargs
+        self.devices = []
+        self.unplugged = {}  # serial -> perf_counter when it is enumerated again
+
+    @property
+    def device_infos(self):
+        now = time.perf_counter()
+        serials = [str(100000000 + i) for i in range(self.num_devices)]
+        return [{'serial': serial, 'model': 'Simulated Arena camera'}
+                for serial in serials if self.unplugged.get(serial, 0) <= now]
+
+    def create_device(self, device_infos=None):
+        # Every device is opened fresh with default node values, like after a power cycle
+        if device_infos is None:
+            self.devices = [FakeDevice(serial=int(info['serial']), **self.device_kwargs) for info in self.device_infos]
+            return self.devices
+        devices = [FakeDevice(serial=int(info['serial']), **self.device_kwargs) for info in device_infos]
+        self.devices.extend(devices)
+        return devices
+
+    def select_device(self, devices):
+        return devices[0]
+
+    def destroy_device(self, device=None):
+        for d in self.devices if device is None else [device]:
+            d.stop_stream()
+        self.devices = [] if device is None else [d for d in self.devices if d is not device]
+
+    def unplug(self, device, duration):
+        """
+        Simulates a lost device: get_buffer fails from now on and the serial
+        is missing from device_infos for duration seconds
+        """
+        device.connected = False
+        self.unplugged[str(device.serial)] = time.perf_counter() + duration
+
+class BufferFactory:
+    @staticmethod
+    def copy(buffer):
+        copied = FakeBuffer(buffer.size)
+        ctypes.memmove(copied._memory, buffer._memory, buffer.size)
+        for name in ('width', 'height', 'bits_per_pixel', 'pixel_format', 'frame_id', 'timestamp_ns', 'has_chunkdata', 'chunks'):
+            setattr(copied, name, getattr(buffer, name))
+        return copied
+
+    @staticmethod
+    def destroy(buffer):
+        pass
+
+system = FakeSystem()
+
+def install(num_devices=1, **device_kwargs):
+    """
+    Registers the simulated SDK as arena_api (arena_api.system, .buffer, .enums)
+    """
+    system.num_devices = num_devices
+    system.device_kwargs = device_kwargs
+
+    arena_api = types.ModuleType('arena_api')
+    system_module = types.ModuleType('arena_api.system')
+    system_module.system = system
+    buffer_module = types.ModuleType('arena_api.buffer')
+    buffer_module.BufferFactory = BufferFactory
+    buffer_module.__all__ = ['BufferFactory']
+    enums_module = types.ModuleType('arena_api.enums')
+    enums_module.PixelFormat = PixelFormat
+
+    arena_api.system = system_module
+    arena_api.buffer = buffer_module
+    arena_api.enums = enums_module
+    sys.modules.update({
+        'arena_api': arena_api,
+        'arena_api.system': system_module,
+        'arena_api.buffer': buffer_module,
+        'arena_api.enums': enums_module,
+    })
+    return system
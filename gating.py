@@ -0,0 +1,238 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, threading
+import numpy as np
+
+import constants
+from preview import stride_image
+from pixel_formats import CODECS, get_codec_name
+
+GATE_METRICS = ('mad', 'tile')
+
+def get_full_scale(arr, pixel_format=None):
+    """
+    Largest pixel value, from the bit depth of the pixel format when it is
+    known (Mono12 in uint16 -> 4095), else from the dtype
+    """
+    if pixel_format is not None:
+        try:
+            return float(2 ** CODECS[get_codec_name(pixel_format)][2] - 1)
+        except Exception:
+            pass
+    return float(np.iinfo(arr.dtype).max) if arr.dtype.kind in 'ui' else 1.0
+
+class ChangeGate:
+    """
+    Change detection between acquisition and writing
+    (1) Every frame is decimated by factor (a strided view) and converted
+        into a preallocated float32 array
+    (2) The difference against the reference (the last kept frame) is
+        reduced to one number, normalized to the full scale of the pixel
+        format:
+            - 'mad'  : mean absolute difference over the frame
+            - 'tile' : largest mean absolute difference of tile x tile
+                       blocks, so a small moving object is not averaged away
+    (3) The frame is kept when the metric reaches threshold, or as a
+        keyframe when keyframe_interval frames were skipped in a row (and
+        always the first frame). Kept frames become the new reference, so
+        slow drift adds up until it is saved.
+    Every decision is appended to the log at log_path (JSON lines) as it is
+    made, only the counters stay in memory. save() writes the summary.
+    """
+    def __init__(self, metric=None, threshold=None, factor=None, tile=None, keyframe_interval=None, log_path=None,
+                 first_idx=0):
+        metric = constants.GATE_METRIC if metric is None else metric
+        threshold = constants.GATE_THRESHOLD if threshold is None else threshold
+        factor = constants.GATE_DOWNSAMPLE if factor is None else factor
+        tile = constants.GATE_TILE if tile is None else tile
+        keyframe_interval = constants.GATE_KEYFRAME_INTERVAL if keyframe_interval is None else keyframe_interval
+        if metric not in GATE_METRICS:
+            raise Exception(f'Unknown gate metric {metric}, use one of {GATE_METRICS}')
+
+        self.metric = metric
+        self.threshold = threshold
+        self.factor = factor
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+
+        self.reference = None
+        self.skipped_in_row = 0
+        self.kept = 0
+        self.skipped = 0
+        self.kept_bytes = 0
+        self.skipped_bytes = 0
+        self.lock = threading.Lock()
+        self.log_path = log_path
+        self.log = None
+        if log_path:
+            self.open_log(log_path, first_idx)
+
+    def open_log(self, path, first_idx=0):
+        """
+        A resumed session (first_idx > 0) keeps the decisions of the frames
+        before first_idx and their counters, the log is continued after them
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.log_path = path
+
+        lines = []
+        if first_idx and os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        decision = json.loads(line)
+                    except ValueError:
+                        break  # last line cut off by the crash
+                    if decision['idx'] >= first_idx:
+                        continue
+                    lines.append(line)
+                    if decision['saved']:
+                        self.kept += 1
+                        self.kept_bytes += decision.get('nbytes', 0)
+                    else:
+                        self.skipped += 1
+                        self.skipped_bytes += decision.get('nbytes', 0)
+            print(f'Resumed gate log {path} after {len(lines)} decisions')
+        self.log = open(path, 'w')
+        self.log.writelines(lines)
+
+    def _allocate(self, small, full_scale):
+        self.small = np.empty(small.shape, dtype=np.float32)
+        self.reference = np.empty(small.shape, dtype=np.float32)
+        self.diff = np.empty(small.shape, dtype=np.float32)
+        self.scale = 1.0 / full_scale
+
+        # Tiles cover the decimated frame cropped to whole tiles
+        height = small.shape[0] // self.tile * self.tile
+        width = small.shape[1] // self.tile * self.tile
+        if self.metric == 'tile' and (height == 0 or width == 0):
+            raise Exception(f'Gate tile {self.tile} is larger than the decimated frame {small.shape[:2]}')
+        self.tiled_shape = (height // self.tile, self.tile, width // self.tile, self.tile) + small.shape[2:]
+        self.tiled_size = (height, width)
+
+    def measure(self):
+        # (2) on self.small against self.reference
+        np.subtract(self.small, self.reference, out=self.diff)
+        np.abs(self.diff, out=self.diff)
+        if self.metric == 'mad':
+            value = self.diff.mean()
+        else:
+            height, width = self.tiled_size
+            tiles = self.diff[:height, :width].reshape(self.tiled_shape)
+            value = tiles.mean(axis=(1, 3)).max()
+        return float(value) * self.scale
+
+    def check(self, arr, idx, info=None):
+        """
+        Returns True if the frame should be saved, tags info with the decision
+        """
+        info = info if info is not None else {}
+        with self.lock:
+            # (1)
+            small = stride_image(arr, self.factor)
+            if self.reference is None:
+                self._allocate(small, get_full_scale(arr, info.get('pixel_format')))
+                np.copyto(self.small, small, casting='unsafe')
+                metric, reason = None, 'first'
+            else:
+                np.copyto(self.small, small, casting='unsafe')
+                metric = self.measure()
+                # (3)
+                if metric >= self.threshold:
+                    reason = 'change'
+                elif self.keyframe_interval and self.skipped_in_row + 1 >= self.keyframe_interval:
+                    reason = 'keyframe'
+                else:
+                    reason = None
+
+            keep = reason is not None
+            if keep:
+                self.reference, self.small = self.small, self.reference
+                self.skipped_in_row = 0
+                self.kept += 1
+                self.kept_bytes += arr.nbytes
+            else:
+                self.skipped_in_row += 1
+                self.skipped += 1
+                self.skipped_bytes += arr.nbytes
+
+            if self.log is not None:
+                self.log.write(json.dumps({'idx': idx, 'frame_id': info.get('frame_id'), 'metric': metric,
+                                           'saved': keep, 'reason': reason or 'skip', 'nbytes': arr.nbytes}) + '\n')
+        info['gate_metric'] = metric
+        info['gate_reason'] = reason or 'skip'
+        return keep
+
+    def summary(self):
+        with self.lock:
+            total = self.kept + self.skipped
+            return {
+                'metric': self.metric,
+                'threshold': self.threshold,
+                'downsample': self.factor,
+                'tile': self.tile,
+                'keyframe_interval': self.keyframe_interval,
+                'frames': total,
+                'saved': self.kept,
+                'skipped': self.skipped,
+                'saved_bytes': self.kept_bytes,
+                'skipped_bytes': self.skipped_bytes,
+                'reduction': (self.kept_bytes + self.skipped_bytes) / self.kept_bytes if self.kept_bytes else 0.0,
+            }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('Gate: saved %d of %d frames (%.1fx less data), metric %s, threshold %.4f' % (
+            summary['saved'], summary['frames'], summary['reduction'], summary['metric'], summary['threshold']))
+
+    def flush(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.flush()
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def save(self, path):
+        """
+        Writes the summary as JSON and closes the decision log
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.close()
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'log': self.log_path}, f, indent=1)
+        print(f'Saved gate summary to {path}' + (f', decisions in {self.log_path}' if self.log_path else ''))
+
+def create_gate(png_path=None, first_idx=0):
+    """
+    ChangeGate if constants.GATE is on, else None. The decisions are logged
+    to <png_path>_gate.jsonl, continued after first_idx in a resumed session
+    """
+    if not constants.GATE:
+        return None
+    return ChangeGate(log_path=png_path + constants.GATE_LOG_SUFFIX if png_path else None, first_idx=first_idx)
+
+def report_gate(gate, png_path):
+    if gate is None:
+        return
+    gate.print_summary()
+    gate.save(png_path + constants.GATE_SUFFIX)
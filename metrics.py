@@ -0,0 +1,263 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, time, bisect, threading, contextlib
+
+import constants
+from utils import get_png_path
+
+# Histogram bucket upper bounds in seconds, 1-2-5 steps from 10 us to 10 s
+LATENCY_BUCKETS = [m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)] + [10.0]
+
+# Statistics read from tl_stream_nodemap, missing nodes are skipped
+STREAM_STATISTICS = [
+    'StreamDeliveredFrameCount',
+    'StreamLostFrameCount',
+    'StreamIncompleteFrameCount',
+    'StreamMissedPacketCount',
+    'StreamResendRequestCount',
+    'StreamResendPacketCount',
+]
+
+class LatencyHistogram:
+    """
+    Fixed bucket latency histogram, recording is one bisect and a few adds
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile (0-100)
+        """
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + [self.max], self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.sum / self.count * 1e3 if self.count else 0.0,
+            'min_ms': self.min * 1e3 if self.count else 0.0,
+            'max_ms': self.max * 1e3,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+            'sum_s': self.sum,
+            'buckets': list(self.counts),
+        }
+
+    def merge(self, summary):
+        """
+        Adds the counts of a saved summary (a resumed session)
+        """
+        if 'buckets' not in summary or len(summary['buckets']) != len(self.counts) or not summary['count']:
+            return
+        self.counts = [a + b for a, b in zip(self.counts, summary['buckets'])]
+        self.count += summary['count']
+        self.sum += summary['sum_s']
+        self.min = min(self.min, summary['min_ms'] * 1e-3)
+        self.max = max(self.max, summary['max_ms'] * 1e-3)
+
+class CaptureMetrics:
+    """
+    Per-stage latency, delivered frame rate and frame ID gaps of a capture loop
+
+        with metrics.stage('get_buffer'):
+            buffer = device.get_buffer()
+        metrics.frame(get_buffer_info(buffer))
+
+    A gap in consecutive frame IDs means the stream engine or the camera
+    dropped frames (e.g. NewestOnly discarding buffers nobody picked up).
+    resume() continues the counts of the export of an interrupted run.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.dropped = 0
+        self.last_frame_id = None
+        self.first_frame_time = None
+        self.last_frame_time = None
+        self.previous_elapsed = 0.0
+        self.stream_statistics = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = LatencyHistogram()
+            self.stages[name].record(seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def frame(self, info):
+        now = time.perf_counter()
+        with self.lock:
+            frame_id = info.get('frame_id')
+            if frame_id is not None and self.last_frame_id is not None and frame_id > self.last_frame_id + 1:
+                self.dropped += frame_id - self.last_frame_id - 1
+            if frame_id is not None:
+                self.last_frame_id = frame_id
+
+            if self.first_frame_time is None:
+                self.first_frame_time = now
+            self.last_frame_time = now
+            self.frames += 1
+
+    def read_stream_statistics(self, tl_stream_nodemap):
+        # Not every transport layer has (or can read) every counter, those are skipped
+        for name in STREAM_STATISTICS:
+            try:
+                node = tl_stream_nodemap.get_node(name)
+                if node is not None and node.is_readable:
+                    self.stream_statistics[name] = node.value
+            except Exception:
+                continue
+
+    def elapsed(self):
+        elapsed = self.previous_elapsed
+        if self.first_frame_time is not None:
+            elapsed += self.last_frame_time - self.first_frame_time
+        return elapsed
+
+    def fps(self):
+        elapsed = self.elapsed()
+        if self.frames < 2 or not elapsed:
+            return 0.0
+        return (self.frames - 1) / elapsed
+
+    def resume(self, path):
+        """
+        Continues the metrics exported to <path>.json
+        """
+        if not os.path.isfile(path + '.json'):
+            return
+        with open(path + '.json') as f:
+            summary = json.load(f)
+        with self.lock:
+            self.frames += summary['frames']
+            self.dropped += summary['dropped_frames']
+            self.previous_elapsed += summary.get('elapsed_s', 0.0)
+            for name, stage in summary['stages'].items():
+                self.stages.setdefault(name, LatencyHistogram()).merge(stage)
+        print(f'Resumed metrics of {summary["frames"]} frames from {path}.json')
+
+    def summary(self):
+        with self.lock:
+            return {
+                'frames': self.frames,
+                'dropped_frames': self.dropped,
+                'fps': self.fps(),
+                'elapsed_s': self.elapsed(),
+                'stages': {name: histogram.summary() for name, histogram in self.stages.items()},
+                'stream': dict(self.stream_statistics),
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=1)
+
+    def to_prometheus(self, prefix='arena_capture'):
+        """
+        Prometheus text exposition format
+        """
+        lines = [
+            f'# TYPE {prefix}_frames_total counter',
+            f'{prefix}_frames_total {self.frames}',
+            f'# TYPE {prefix}_dropped_frames_total counter',
+            f'{prefix}_dropped_frames_total {self.dropped}',
+            f'# TYPE {prefix}_fps gauge',
+            f'{prefix}_fps {self.fps():.3f}',
+            f'# TYPE {prefix}_stage_seconds histogram',
+        ]
+        with self.lock:
+            for name, histogram in self.stages.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram.sum:.9f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+
+            for name, value in self.stream_statistics.items():
+                lines.append(f'# TYPE {prefix}_{name} gauge')
+                lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self):
+        summary = self.summary()
+        print('Delivered %d frames at %.1f fps, %d dropped (frame ID gaps)' % (
+            summary['frames'], summary['fps'], summary['dropped_frames']))
+        for name, stage in summary['stages'].items():
+            print('\t%-12s mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms  max %8.3f ms' % (
+                name, stage['mean_ms'], stage['p50_ms'], stage['p99_ms'], stage['max_ms']))
+        for name, value in summary['stream'].items():
+            print(f'\t{name} : {value}')
+
+    def write(self, path):
+        """
+        Writes <path>.json and <path>.prom
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.json', 'w') as f:
+            f.write(self.to_json())
+        with open(path + '.prom', 'w') as f:
+            f.write(self.to_prometheus())
+
+    def export(self, path):
+        self.write(path)
+        print(f'Saved metrics to {path}.json and {path}.prom')
+
+def create_metrics():
+    """
+    CaptureMetrics if constants.METRICS is on, else None
+    """
+    return CaptureMetrics() if constants.METRICS else None
+
+def report_metrics(metrics, tl_stream_nodemap, png_path=None):
+    """
+    Reads the stream statistics, prints the summary and exports it next to png_path
+    """
+    if metrics is None:
+        return
+    metrics.read_stream_statistics(tl_stream_nodemap)
+    metrics.print_summary()
+    metrics.export((png_path or get_png_path()) + constants.METRICS_SUFFIX)
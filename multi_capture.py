@@ -0,0 +1,203 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, threading, collections, contextlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import constants
+from utils import get_png_path, create_devices_with_tries, streaming_setup
+from configuration import set_configuration
+from trigger import set_trigger_mode
+from pipeline import CapturePipeline, print_pipeline_stats
+from encoder import create_writer, split_workers
+from catalog import create_catalog_writer
+
+def get_serial(device):
+    return str(device.nodemap['DeviceSerialNumber'].value)
+
+def configure_device(device):
+    """
+    Streaming setup, configuration and trigger mode of one device, returns
+    the host crop of set_configuration()
+    """
+    nodemap = device.nodemap
+    streaming_setup(device.tl_stream_nodemap)
+    crop = set_configuration(nodemap)
+    set_trigger_mode(nodemap, 'multi_capture')
+
+    # Device timestamps are only comparable across cameras when their clocks
+    # are synchronized with PTP (IEEE 1588)
+    if constants.MULTI_MATCH == 'timestamp' and constants.MULTI_PTP:
+        ptp_enable = nodemap.get_node('PtpEnable')
+        if ptp_enable is not None and ptp_enable.is_writable:
+            ptp_enable.value = True
+        else:
+            print(f'[WARNING] PTP not available on {get_serial(device)}, timestamps may not be comparable')
+    return crop
+
+def configure_devices(devices):
+    """
+    Configures every device in parallel, one thread per device.
+    Returns the host crops in the order of devices.
+    """
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        return list(executor.map(configure_device, devices))
+
+class FrameSetAligner:
+    """
+    Groups frames from several cameras into matched sets
+        - match = 'frame_id'  : frames with the same frame ID (cameras fed by
+                                the same hardware trigger)
+        - match = 'timestamp' : frames whose device timestamps are within
+                                tolerance_ns (PTP synchronized clocks)
+    Frames are expected in order per camera. When the heads of all cameras do
+    not match, the oldest head can not be matched any more and is discarded.
+    on_set(set_idx, frames, skew_ns) is called for every matched set, frames
+    being {serial: (arr, info)}.
+    """
+    def __init__(self, serials, on_set, match=None, tolerance_ns=None, max_pending=None):
+        match = constants.MULTI_MATCH if match is None else match
+        tolerance_ns = constants.MULTI_TOLERANCE_NS if tolerance_ns is None else tolerance_ns
+        max_pending = constants.MULTI_MAX_PENDING if max_pending is None else max_pending
+        if match not in ('frame_id', 'timestamp'):
+            raise Exception(f'Unknown match mode {match}, use frame_id or timestamp')
+
+        self.on_set = on_set
+        self.match = match
+        self.key = 'frame_id' if match == 'frame_id' else 'timestamp_ns'
+        self.tolerance_ns = tolerance_ns if match == 'timestamp' else 0
+        self.max_pending = max_pending
+
+        self.pending = {serial: collections.deque() for serial in serials}
+        self.unmatched = {serial: 0 for serial in serials}
+        self.skews = []
+        self.lock = threading.Lock()
+
+    def add(self, serial, arr, info):
+        matched = []
+        with self.lock:
+            pending = self.pending[serial]
+            pending.append((arr, info))
+            if len(pending) > self.max_pending:
+                # One camera stalled, do not hold the others forever
+                pending.popleft()
+                self.unmatched[serial] += 1
+
+            while all(self.pending.values()):
+                keys = {s: q[0][1][self.key] for s, q in self.pending.items()}
+                skew = max(keys.values()) - min(keys.values())
+                if skew <= self.tolerance_ns:
+                    frames = {s: q.popleft() for s, q in self.pending.items()}
+                    matched.append((len(self.skews), frames, skew))
+                    self.skews.append(skew)
+                else:
+                    oldest = min(keys, key=keys.get)
+                    self.pending[oldest].popleft()
+                    self.unmatched[oldest] += 1
+
+        for set_idx, frames, skew in matched:
+            self.on_set(set_idx, frames, skew)
+
+    def writer_for(self, serial):
+        # CapturePipeline writer feeding this aligner
+        def writer(arr, idx, info):
+            self.add(serial, arr, info)
+        return writer
+
+def capture_multi(system=None, num_images=None):
+    """
+    Synchronized capture from every discovered device
+    (1) Create all devices and configure them in parallel
+    (2) One CapturePipeline (acquisition thread) per device
+    (3) Frames are aligned by frame ID or timestamp into matched sets
+    (4) Every set is written with the same index into one directory per
+        camera (PNG_PATH/<serial>)
+    (5) Report per-camera throughput, unmatched frames and skew
+
+    system defaults to arena_api's system and can be replaced by any object
+    with the same create_device() / destroy_device() interface.
+    """
+    num_images = constants.NUM_IMAGES if num_images is None else num_images
+    if system is None:
+        from arena_api.system import system
+
+    # (1)
+    devices = create_devices_with_tries(system)
+    serials = [get_serial(device) for device in devices]
+    print(f'Capturing from {len(devices)} devices: {serials}')
+    crops = dict(zip(serials, configure_devices(devices)))
+
+    png_path = get_png_path()
+    num_workers = split_workers(len(devices))
+    writers = {serial: create_catalog_writer(create_writer(os.path.join(png_path, serial), num_workers=num_workers),
+                                             os.path.join(png_path, serial), device.nodemap, crops[serial])
+               for serial, device in zip(serials, devices)}
+
+    def on_set(set_idx, frames, skew):
+        for serial, (arr, info) in frames.items():
+            writers[serial](arr, set_idx, info)
+
+    # (2), (3) One writer thread per pipeline keeps frames in order per camera
+    aligner = FrameSetAligner(serials, on_set)
+    pipelines = {serial: CapturePipeline(device, aligner.writer_for(serial), num_writers=1, report_interval=0,
+                                         crop=crops[serial])
+                 for serial, device in zip(serials, devices)}
+    stats = {}
+
+    def run(serial):
+        stats[serial] = pipelines[serial].run(num_images)
+
+    with contextlib.ExitStack() as stack:
+        for device in devices:
+            stack.enter_context(device.start_stream(constants.NUM_BUFFERS))
+        print('Streams started')
+
+        threads = [threading.Thread(target=run, args=(serial,), name=f'camera-{serial}') for serial in serials]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for device in devices:
+            device.stop_stream()
+
+    # (4)
+    for writer in writers.values():
+        writer.close()
+
+    # (5)
+    for serial in serials:
+        if serial not in stats:
+            print(f'Camera {serial}: acquisition failed')
+            continue
+        print(f'Camera {serial}:', end=' ')
+        print_pipeline_stats(stats[serial])
+        print(f'\tunmatched frames: {aligner.unmatched[serial]}')
+
+    skews = np.array(aligner.skews, dtype=np.float64)
+    if len(skews):
+        unit = 'ns' if aligner.match == 'timestamp' else 'frame ids'
+        print('Matched %d sets, skew mean %.0f, max %.0f %s' % (len(skews), skews.mean(), skews.max(), unit))
+    else:
+        print('No matched sets')
+
+    system.destroy_device()
+    print(f'Destroyed all created devices')
+    return stats, aligner
+
+if __name__ == "__main__":
+    print('start capturing from all devices')
+
+    capture_multi()
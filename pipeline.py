@@ -0,0 +1,236 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import queue, threading, time
+
+import constants
+from utils import buffer_to_ndarray, get_buffer_info
+from roi import crop_image
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+class CapturePipeline:
+    """
+    Decoupled acquisition and writing
+    (1) The acquisition thread grabs a buffer, copies the image out of it and
+        requeues the buffer right away
+    (2) The copy is put into a bounded queue
+    (3) A pool of writer threads drains the queue and calls
+        writer(arr, idx, info), info being get_buffer_info() of the frame
+        plus the chunk values when chunk_metadata is given
+
+    crop is the host crop from set_configuration(), only the region is copied.
+    gate (gating.ChangeGate) decides in acquisition order which frames are
+    queued at all, skipped frames are counted as gated. trigger
+    (trigger.create_trigger) gets the arrival time of every buffer for its
+    trigger-to-buffer latency. session (session.SessionManager) is told the
+    index of every frame that is finished: written, gated or dropped.
+
+    When the queue is full the overflow policy decides what happens:
+        - 'block'       : acquisition waits for a free slot (no frame lost in
+                          the pipeline, the stream engine may drop instead)
+        - 'drop_oldest' : the oldest queued frame is discarded
+        - 'drop_newest' : the frame that was just grabbed is discarded
+    """
+    def __init__(self, device, writer, num_writers=None, queue_size=None, overflow_policy=None,
+                 report_interval=None, metrics=None, preview=None, chunk_metadata=None, crop=None, gate=None,
+                 trigger=None, session=None):
+        num_writers = constants.NUM_WRITERS if num_writers is None else num_writers
+        queue_size = constants.QUEUE_SIZE if queue_size is None else queue_size
+        overflow_policy = constants.OVERFLOW_POLICY if overflow_policy is None else overflow_policy
+        report_interval = constants.PIPELINE_REPORT_INTERVAL if report_interval is None else report_interval
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise Exception(f'Unknown overflow policy {overflow_policy}, use one of {OVERFLOW_POLICIES}')
+
+        self.device = device
+        self.writer = writer
+        self.num_writers = num_writers
+        self.overflow_policy = overflow_policy
+        self.report_interval = report_interval
+        self.metrics = metrics
+        self.preview = preview
+        self.chunk_metadata = chunk_metadata
+        self.crop = crop
+        self.gate = gate
+        self.trigger = trigger
+        self.session = session
+        self.frames = queue.Queue(maxsize=queue_size)
+
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.written = 0
+        self.dropped = 0
+        self.gated = 0
+        self.max_queue_depth = 0
+        self.first_frame_time = None
+        self.errors = []
+
+    def stats(self):
+        with self.lock:
+            return {
+                'acquired': self.acquired,
+                'written': self.written,
+                'dropped': self.dropped,
+                'gated': self.gated,
+                'queue_depth': self.frames.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+    def is_backlogged(self, fill=None):
+        """
+        True when the queue is at least fill full, the trigger scheduler
+        holds software triggers meanwhile
+        """
+        fill = constants.TRIGGER_BACKPRESSURE if fill is None else fill
+        return bool(fill) and self.frames.qsize() >= fill * self.frames.maxsize
+
+    def _finish(self, idx):
+        if self.session is not None:
+            self.session.frame_done(idx)
+
+    def _drop(self, idx):
+        with self.lock:
+            self.dropped += 1
+        self._finish(idx)
+
+    def _put(self, item):
+        if self.overflow_policy == 'block':
+            self.frames.put(item)
+        elif self.overflow_policy == 'drop_newest':
+            try:
+                self.frames.put_nowait(item)
+            except queue.Full:
+                self._drop(item[0])
+        else:
+            while True:
+                try:
+                    self.frames.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        oldest = self.frames.get_nowait()
+                        self.frames.task_done()
+                        self._drop(oldest[0])
+                    except queue.Empty:
+                        pass
+
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.frames.qsize())
+
+    def _acquire(self, num_images, first_idx):
+        last_report = time.perf_counter()
+        try:
+            for idx in range(first_idx, first_idx + num_images):
+                t0 = time.perf_counter()
+                buffer = self.device.get_buffer()
+                t1 = time.perf_counter()
+                if self.first_frame_time is None:
+                    self.first_frame_time = t1
+                # Copy out of driver memory so the buffer can be requeued at once
+                arr = crop_image(buffer_to_ndarray(buffer), self.crop).copy()
+                info = get_buffer_info(buffer)
+                if self.trigger is not None:
+                    self.trigger.record_buffer(info, t1)
+                if self.chunk_metadata is not None:
+                    info.update(self.chunk_metadata.read(buffer, idx))
+                t2 = time.perf_counter()
+                self.device.requeue_buffer(buffer)
+                t3 = time.perf_counter()
+
+                if self.preview is not None:
+                    self.preview.publish(arr)
+
+                with self.lock:
+                    self.acquired += 1
+                if self.gate is None or self.gate.check(arr, idx, info):
+                    self._put((idx, arr, info))
+                else:
+                    with self.lock:
+                        self.gated += 1
+                    self._finish(idx)
+
+                if self.metrics is not None:
+                    metrics = self.metrics
+                    metrics.record('get_buffer', t1 - t0)
+                    metrics.record('convert', t2 - t1)
+                    metrics.record('requeue', t3 - t2)
+                    metrics.record('enqueue', time.perf_counter() - t3)
+                    metrics.frame(info)
+
+                if self.report_interval and time.perf_counter() - last_report >= self.report_interval:
+                    stats = self.stats()
+                    print('Pipeline: queue depth %d, acquired %d, written %d, dropped %d' % (
+                        stats['queue_depth'], stats['acquired'], stats['written'], stats['dropped']))
+                    last_report = time.perf_counter()
+
+                if self.errors:
+                    break
+        except Exception as e:
+            self.errors.append(e)
+
+    def _write(self):
+        while True:
+            item = self.frames.get()
+            try:
+                if item is None:
+                    return
+                idx, arr, info = item
+                start = time.perf_counter()
+                self.writer(arr, idx, info)
+                if self.metrics is not None:
+                    self.metrics.record('write', time.perf_counter() - start)
+                with self.lock:
+                    self.written += 1
+                self._finish(idx)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.frames.task_done()
+
+    def run(self, num_images=None, first_idx=0):
+        """
+        Runs the pipeline on an already started stream and returns the stats,
+        frames are numbered from first_idx (a resumed session)
+        """
+        num_images = constants.NUM_IMAGES if num_images is None else num_images
+        writers = [threading.Thread(target=self._write, name=f'writer-{i}', daemon=True)
+                   for i in range(self.num_writers)]
+        for thread in writers:
+            thread.start()
+
+        start = time.perf_counter()
+        acquisition = threading.Thread(target=self._acquire, args=(num_images, first_idx), name='acquisition')
+        acquisition.start()
+        acquisition.join()
+        acquisition_time = time.perf_counter() - start
+
+        # One sentinel per writer, always blocking so none of them is dropped
+        for _ in writers:
+            self.frames.put(None)
+        for thread in writers:
+            thread.join()
+        total_time = time.perf_counter() - start
+
+        if self.errors:
+            raise self.errors[0]
+
+        stats = self.stats()
+        stats['acquisition_fps'] = stats['acquired'] / acquisition_time if acquisition_time > 0 else 0.0
+        stats['total_time'] = total_time
+        return stats
+
+def print_pipeline_stats(stats):
+    print('Pipeline: acquired %d, written %d, dropped %d, gated %d, max queue depth %d, acquisition %.1f fps' % (
+        stats['acquired'], stats['written'], stats['dropped'], stats['gated'], stats['max_queue_depth'],
+        stats['acquisition_fps']))
@@ -0,0 +1,178 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import ctypes, threading
+import numpy as np
+
+"""
+Pixel format codecs
+
+Decoders turn the raw image bytes of a buffer into a (height, width) array,
+uint8 for 8 bit formats and uint16 for everything above. The packed formats
+are unpacked with whole-array NumPy operations on strided views of the
+byte groups, writing into a preallocated output and one scratch array:
+
+    Mono10p      4 pixels in 5 bytes, LSB first (PFNC)
+    Mono12p      2 pixels in 3 bytes, LSB first (PFNC)
+    Mono12Packed 2 pixels in 3 bytes, GigE Vision layout: byte 0 and 2 are
+                 the high 8 bits, byte 1 holds both low nibbles
+
+Bayer formats are passed through undemosaiced with the decoder of the mono
+format of the same bit layout (BayerRG12p -> Mono12p).
+"""
+
+def unpack_mono10p(raw, out, scratch):
+    groups = raw.reshape(-1, 5)
+    pixels = out.reshape(-1, 4)
+    b0, b1, b2, b3, b4 = (groups[:, i] for i in range(5))
+
+    # p0 = b0 | (b1 & 0x03) << 8
+    np.bitwise_and(b1, 0x03, out=pixels[:, 0])
+    np.left_shift(pixels[:, 0], 8, out=pixels[:, 0])
+    np.bitwise_or(pixels[:, 0], b0, out=pixels[:, 0])
+    # p1 = b1 >> 2 | (b2 & 0x0F) << 6
+    np.bitwise_and(b2, 0x0F, out=pixels[:, 1])
+    np.left_shift(pixels[:, 1], 6, out=pixels[:, 1])
+    np.right_shift(b1, 2, out=scratch)
+    np.bitwise_or(pixels[:, 1], scratch, out=pixels[:, 1])
+    # p2 = b2 >> 4 | (b3 & 0x3F) << 4
+    np.bitwise_and(b3, 0x3F, out=pixels[:, 2])
+    np.left_shift(pixels[:, 2], 4, out=pixels[:, 2])
+    np.right_shift(b2, 4, out=scratch)
+    np.bitwise_or(pixels[:, 2], scratch, out=pixels[:, 2])
+    # p3 = b3 >> 6 | b4 << 2
+    np.left_shift(b4, 2, out=pixels[:, 3], dtype=np.uint16)
+    np.right_shift(b3, 6, out=scratch)
+    np.bitwise_or(pixels[:, 3], scratch, out=pixels[:, 3])
+    return out
+
+def unpack_mono12p(raw, out, scratch):
+    groups = raw.reshape(-1, 3)
+    pixels = out.reshape(-1, 2)
+    b0, b1, b2 = groups[:, 0], groups[:, 1], groups[:, 2]
+
+    # p0 = b0 | (b1 & 0x0F) << 8
+    np.bitwise_and(b1, 0x0F, out=pixels[:, 0])
+    np.left_shift(pixels[:, 0], 8, out=pixels[:, 0])
+    np.bitwise_or(pixels[:, 0], b0, out=pixels[:, 0])
+    # p1 = b1 >> 4 | b2 << 4
+    np.left_shift(b2, 4, out=pixels[:, 1], dtype=np.uint16)
+    np.right_shift(b1, 4, out=scratch)
+    np.bitwise_or(pixels[:, 1], scratch, out=pixels[:, 1])
+    return out
+
+def unpack_mono12packed(raw, out, scratch):
+    groups = raw.reshape(-1, 3)
+    pixels = out.reshape(-1, 2)
+    b0, b1, b2 = groups[:, 0], groups[:, 1], groups[:, 2]
+
+    # p0 = b0 << 4 | (b1 & 0x0F)
+    np.left_shift(b0, 4, out=pixels[:, 0], dtype=np.uint16)
+    np.bitwise_and(b1, 0x0F, out=scratch)
+    np.bitwise_or(pixels[:, 0], scratch, out=pixels[:, 0])
+    # p1 = b2 << 4 | b1 >> 4
+    np.left_shift(b2, 4, out=pixels[:, 1], dtype=np.uint16)
+    np.right_shift(b1, 4, out=scratch)
+    np.bitwise_or(pixels[:, 1], scratch, out=pixels[:, 1])
+    return out
+
+def copy_mono8(raw, out, scratch):
+    np.copyto(out.reshape(-1), raw)
+    return out
+
+def copy_mono16(raw, out, scratch):
+    np.copyto(out.reshape(-1), raw.view('<u2'))
+    return out
+
+# codec name -> (decoder, bits per pixel in the buffer, significant bits,
+#                pixels per byte group, output dtype)
+CODECS = {
+    'Mono8': (copy_mono8, 8, 8, 1, np.uint8),
+    'Mono10': (copy_mono16, 16, 10, 1, np.uint16),
+    'Mono12': (copy_mono16, 16, 12, 1, np.uint16),
+    'Mono16': (copy_mono16, 16, 16, 1, np.uint16),
+    'Mono10p': (unpack_mono10p, 10, 10, 4, np.uint16),
+    'Mono12p': (unpack_mono12p, 12, 12, 2, np.uint16),
+    'Mono12Packed': (unpack_mono12packed, 12, 12, 2, np.uint16),
+}
+
+BAYER_PATTERNS = ('BayerRG', 'BayerGR', 'BayerGB', 'BayerBG')
+
+def get_codec_name(pixel_format):
+    """
+    Codec used for a pixel format, Bayer formats map onto the mono layout
+    """
+    pixel_format = getattr(pixel_format, 'name', str(pixel_format))
+    if pixel_format.startswith(BAYER_PATTERNS):
+        pixel_format = 'Mono' + pixel_format[len('BayerRG'):]
+    if pixel_format not in CODECS:
+        raise Exception(f'No decoder for pixel format {pixel_format}, supported: {list(CODECS)} and Bayer variants')
+    return pixel_format
+
+def is_packed(pixel_format):
+    return CODECS[get_codec_name(pixel_format)][1] % 8 != 0
+
+class PixelDecoder:
+    """
+    Decoder for one pixel format and frame size. The output array and the
+    scratch array are allocated once and reused for every frame, so decoding
+    does not allocate. Values keep the sensor bit depth (Mono12 0..4095).
+    """
+    def __init__(self, pixel_format, width, height):
+        self.pixel_format = getattr(pixel_format, 'name', str(pixel_format))
+        self.width = width
+        self.height = height
+        self.decoder, self.bits_per_pixel, self.bit_depth, group, self.dtype = CODECS[get_codec_name(pixel_format)]
+
+        num_pixels = width * height
+        if num_pixels % group:
+            raise Exception(f'{self.pixel_format} needs a multiple of {group} pixels, got {width}x{height}')
+        self.num_bytes = num_pixels * self.bits_per_pixel // 8
+
+        self.out = np.empty((height, width), dtype=self.dtype)
+        self.scratch = np.empty(num_pixels // group, dtype=np.uint16)
+
+    def decode(self, raw, out=None):
+        """
+        Decodes the raw image bytes (uint8 array) into out, by default the
+        preallocated output which is overwritten by the next decode
+        """
+        out = self.out if out is None else out
+        if raw.size < self.num_bytes:
+            raise Exception(f'{self.pixel_format} {self.width}x{self.height} needs {self.num_bytes} bytes, got {raw.size}')
+        return self.decoder(raw[:self.num_bytes], out, self.scratch)
+
+    def decode_buffer(self, image_buffer, out=None):
+        """
+        Decodes straight from buffer memory, chunk data after the image is ignored
+        """
+        pdata = ctypes.cast(image_buffer.pdata, ctypes.POINTER(ctypes.c_ubyte))
+        raw = np.ctypeslib.as_array(pdata, shape=(self.num_bytes,))
+        return self.decode(raw, out)
+
+_decoders = threading.local()
+
+def get_decoder(image_buffer):
+    """
+    PixelDecoder for the format and size of a buffer, cached per thread
+    (the scratch array must not be shared between threads)
+    """
+    key = (getattr(image_buffer.pixel_format, 'name', str(image_buffer.pixel_format)),
+           image_buffer.width, image_buffer.height)
+    cache = getattr(_decoders, 'cache', None)
+    if cache is None:
+        cache = _decoders.cache = {}
+    if key not in cache:
+        cache[key] = PixelDecoder(*key)
+    return cache[key]
@@ -0,0 +1,194 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+import constants
+
+def stride_image(arr, factor):
+    """
+    Decimation by striding, a view without any computation
+    """
+    return arr[::factor, ::factor]
+
+def bin_image(arr, factor):
+    """
+    Vectorized factor x factor binning (mean), the image is cropped to a
+    multiple of factor
+    """
+    height = arr.shape[0] // factor * factor
+    width = arr.shape[1] // factor * factor
+    blocks = arr[:height, :width].reshape((height // factor, factor, width // factor, factor) + arr.shape[2:])
+    return blocks.mean(axis=(1, 3)).astype(arr.dtype)
+
+def _preview_loop(setup, lock, sequence, stop_event, interval, factor, mode, title):
+    """
+    Runs in the preview process: waits for the mailbox of the first frame
+    (shared memory name, shape, dtype on the setup queue), then shows the
+    newest frame at most once per interval
+    """
+    import queue
+    import cv2
+
+    while True:
+        if stop_event.is_set():
+            return
+        try:
+            shm_name, shape, dtype = setup.get(timeout=0.1)
+            break
+        except queue.Empty:
+            pass
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    mailbox = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    frame = np.empty(shape, dtype=dtype)
+    last_sequence = 0
+
+    try:
+        while not stop_event.is_set():
+            start = time.perf_counter()
+
+            new_frame = False
+            with lock:
+                if sequence.value != last_sequence:
+                    np.copyto(frame, mailbox)
+                    last_sequence = sequence.value
+                    new_frame = True
+
+            if new_frame:
+                display = bin_image(frame, factor) if mode == 'bin' else frame
+                cv2.imshow(title, display)
+
+            wait_ms = max(1, int((interval - (time.perf_counter() - start)) * 1000))
+            if cv2.waitKey(wait_ms) == 27:  # Esc closes the preview, capture goes on
+                break
+            if new_frame and cv2.getWindowProperty(title, cv2.WND_PROP_VISIBLE) < 1:
+                break
+    finally:
+        cv2.destroyAllWindows()
+        shm.close()
+
+class Preview:
+    """
+    Non-blocking decimated live preview
+    (1) publish() is called from the capture loop. It returns at once when the
+        last frame was published less than 1/max_fps ago, or when the preview
+        process is busy reading the mailbox
+    (2) Otherwise the frame is written into a single-slot shared memory
+        mailbox, overwriting the previous one (latest wins). With mode
+        'stride' only every factor-th pixel is copied, with mode 'bin' the full
+        frame is copied and binned by the preview process
+    (3) A separate process renders the mailbox at no more than max_fps. It is
+        started by start() (create_preview() does) before the capture threads
+        exist, the first publish() only creates the mailbox and hands it over
+
+    The capture loop never waits on the GUI, the preview only ever sees the
+    newest frame.
+    """
+    def __init__(self, max_fps=None, factor=None, mode=None, title='Captured image'):
+        max_fps = constants.PREVIEW_FPS if max_fps is None else max_fps
+        factor = constants.PREVIEW_DOWNSAMPLE if factor is None else factor
+        mode = constants.PREVIEW_MODE if mode is None else mode
+        if mode not in ('stride', 'bin'):
+            raise Exception(f'Unknown preview mode {mode}, use stride or bin')
+
+        self.interval = 1.0 / max_fps
+        self.factor = factor
+        self.mode = mode
+        self.title = title
+        self.next_time = 0.0
+        self.published = 0
+
+        self.shm = None
+        self.mailbox = None
+        self.process = None
+        self.lock = mp.Lock()
+        self.sequence = mp.Value('Q', 0, lock=False)
+        self.stop_event = mp.Event()
+        self.setup = mp.Queue()
+
+    def start(self):
+        """
+        Starts the preview process, before the stream: forking a process
+        from a running capture thread stalls it
+        """
+        if self.process is not None:
+            return
+        # Shared with the child, a tracker of its own would unlink the mailbox when the preview exits
+        resource_tracker.ensure_running()
+        self.process = mp.Process(target=_preview_loop, name='preview', daemon=True, args=(
+            self.setup, self.lock, self.sequence, self.stop_event, self.interval, self.factor, self.mode, self.title))
+        self.process.start()
+
+    def _create_mailbox(self, shape, dtype):
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.mailbox = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.setup.put((self.shm.name, shape, np.dtype(dtype).str))
+
+    def publish(self, arr):
+        """
+        Offers a frame to the preview, returns True if it was taken
+        """
+        now = time.perf_counter()
+        if now < self.next_time:
+            return False
+
+        if self.process is None:
+            raise Exception('Preview not started, call start() before the stream')
+        frame = stride_image(arr, self.factor) if self.mode == 'stride' else arr
+        if self.mailbox is None:
+            self._create_mailbox(frame.shape, frame.dtype)
+        if frame.shape != self.mailbox.shape or not self.process.is_alive():
+            return False
+
+        if not self.lock.acquire(block=False):
+            return False
+        try:
+            np.copyto(self.mailbox, frame)
+            self.sequence.value += 1
+        finally:
+            self.lock.release()
+
+        self.next_time = now + self.interval
+        self.published += 1
+        return True
+
+    def close(self):
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout=5)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def create_preview():
+    """
+    Started Preview if constants.PREVIEW is on, else None
+    """
+    if not constants.PREVIEW:
+        return None
+    preview = Preview()
+    preview.start()
+    return preview
@@ -13,17 +13,24 @@
 
 
 import time, os
-from PIL import Image as PIL_Image  # pip install Pillow
 import numpy as np
 from pathlib import Path
 
-from arena_api.system import system
-from arena_api.buffer import *
 
 from utils import *
 from configuration import *
+from ring_buffer import FrameRingBuffer
+from encoder import create_writer
+from metrics import create_metrics, report_metrics
+from preview import create_preview
+from chunk_data import create_chunk_metadata
+from catalog import create_catalog_writer
+from roi import crop_image
+from gating import create_gate, report_gate
+from autotune import apply_stream_settings
+from trigger import set_trigger_mode
 
-import ctypes
+import ctypes, threading
 
 def capture_image():
     """
@@ -41,7 +48,7 @@ def capture_image():
     
     # (1) Start device
     devices = create_devices_with_tries()
-    device = system.select_device(devices)
+    device = get_system().select_device(devices)
     nodemap = device.nodemap
     tl_stream_nodemap = device.tl_stream_nodemap
     print(f'Device used in the example:\n\t{device}')
@@ -49,30 +56,183 @@ def capture_image():
     # (2) Streaming setup & set configuration
     check_initial_values(nodemap)
     streaming_setup(tl_stream_nodemap)
-    set_configuration(nodemap) # exposure time, binning, gain, pixel format, height/width, gamma
+    crop = set_configuration(nodemap) # exposure time, binning, gain, pixel format, height/width, gamma, ROI
+    set_trigger_mode(nodemap, 'rapid_capture')
     
     # (3)    
     img_cnt = 0
-    png_path = constants.PNG_PATH
+    png_path = get_png_path()
+    metrics = create_metrics()
+    writer = create_catalog_writer(create_writer(png_path, encoder='thread'), png_path, nodemap, crop)
     
     with device.start_stream(constants.NUM_BUFFERS):
         print(f'Stream started with {constants.NUM_BUFFERS} buffers')
 
         print(f'Grabbing an image buffer')
+        t0 = time.perf_counter()
         buffers = device.get_buffer(constants.NUM_BUFFERS)
+        if metrics is not None:
+            metrics.record('get_buffer', time.perf_counter() - t0)
         
         # Print image buffer info
         for count, buffer in enumerate(buffers):
-            save_image_mono8_to_png_with_PIL(buffer, png_path, count)
+            t0 = time.perf_counter()
+            path = writer(crop_image(buffer_to_ndarray(buffer), crop), count, get_buffer_info(buffer))
+            print(f'Saved image path is: {path}')
+            if metrics is not None:
+                metrics.record('write', time.perf_counter() - t0)
+                metrics.frame(get_buffer_info(buffer))
             
         device.requeue_buffer(buffers)
+        writer.close()
+        report_metrics(metrics, tl_stream_nodemap, png_path)
 
     # (4) Clean up
     device.stop_stream()
         
-    system.destroy_device()
+    get_system().destroy_device()
     print(f'Destroyed all created devices')
         
+def capture_burst():
+    """
+    Burst capture into a preallocated RAM ring buffer
+    (1) Start device
+    (2) Streaming setup and set configuration
+    (3) Allocate the ring buffer from the first frame, BURST_FRAMES frames or
+        BURST_BYTES bytes
+    (4) Copy every frame into a slot and requeue its buffer immediately, so
+        the burst is not limited by NUM_BUFFERS
+    (5) Flush the ring to disk, while capturing (BURST_FLUSH = 'background')
+        or after the trigger window closed (BURST_FLUSH = 'after'). A failing
+        background flush ends the capture and is raised after the join, a
+        failing capture stops the flusher once it saved the ring
+    """
+    # (1) Start device
+    devices = create_devices_with_tries()
+    device = get_system().select_device(devices)
+    nodemap = device.nodemap
+    tl_stream_nodemap = device.tl_stream_nodemap
+    print(f'Device used in the example:\n\t{device}')
+
+    # (2) Streaming setup & set configuration
+    check_initial_values(nodemap)
+    streaming_setup(tl_stream_nodemap)
+    crop = set_configuration(nodemap)
+    set_trigger_mode(nodemap, 'rapid_capture')
+    num_buffers = apply_stream_settings(device)
+
+    png_path = get_png_path()
+    background = constants.BURST_FLUSH == 'background'
+    metrics = create_metrics()
+    preview = create_preview()
+    chunk_metadata = create_chunk_metadata(nodemap)
+    gate = create_gate(png_path)
+    writer = create_catalog_writer(create_writer(png_path), png_path, nodemap, crop)
+
+    def flush_writer(arr, idx, info):
+        t0 = time.perf_counter()
+        writer(arr, idx, info)
+        if metrics is not None:
+            metrics.record('write', time.perf_counter() - t0)
+
+    flush_errors = []
+
+    def background_flush(stop_event):
+        try:
+            ring.flush(flush_writer, stop_event)
+        except Exception as e:
+            flush_errors.append(e)
+
+    stop_event = threading.Event()
+    flusher = None
+    try:
+        with device.start_stream(num_buffers):
+            print(f'Stream started with {num_buffers} buffers')
+
+            # (3) Ring buffer sized from the first frame. A background flush must
+            # not have its slots overwritten, so frames are dropped when it is full
+            buffer = device.get_buffer()
+            frame = crop_image(buffer_to_ndarray(buffer), crop)
+            ring = FrameRingBuffer(frame.shape, frame.dtype, num_frames=constants.BURST_FRAMES,
+                                   num_bytes=constants.BURST_BYTES, overwrite=not background)
+
+            if background:
+                flusher = threading.Thread(target=background_flush, args=(stop_event,), name='flusher', daemon=True)
+                flusher.start()
+
+            # (4) Capture until the window closes or the ring is full
+            start = time.perf_counter()
+            num_frames = 0
+            while True:
+                t1 = time.perf_counter()
+                info = get_buffer_info(buffer)
+                if chunk_metadata is not None:
+                    info.update(chunk_metadata.read(buffer, num_frames))
+                # Frames the gate skips do not take a ring slot
+                if gate is None or gate.check(frame, num_frames, info):
+                    ring.push(frame, info)
+                t2 = time.perf_counter()
+                if preview is not None:
+                    preview.publish(frame)
+                device.requeue_buffer(buffer)
+                num_frames += 1
+
+                if metrics is not None:
+                    metrics.record('push', t2 - t1)
+                    metrics.record('requeue', time.perf_counter() - t2)
+                    metrics.frame(info)
+
+                if constants.BURST_DURATION:
+                    if time.perf_counter() - start >= constants.BURST_DURATION:
+                        break
+                elif ring.pushed >= ring.capacity:
+                    break
+                if flusher is not None and not flusher.is_alive():
+                    print('[WARNING] Background flush failed, stopping the capture')
+                    break
+
+                t0 = time.perf_counter()
+                buffer = device.get_buffer()
+                frame = crop_image(buffer_to_ndarray(buffer), crop)
+                if metrics is not None:
+                    metrics.record('get_buffer', time.perf_counter() - t0)
+
+            elapsed = time.perf_counter() - start
+            if metrics is not None:
+                metrics.read_stream_statistics(tl_stream_nodemap)
+            device.stop_stream()
+
+        print('Captured %d frames in %.2f sec (%.1f fps), %d overwritten, %d dropped' % (
+            num_frames, elapsed, num_frames / elapsed if elapsed > 0 else 0.0, ring.overwritten, ring.dropped))
+
+        # (5) Flush
+        if not background:
+            print(f'Flushing {len(ring)} frames to {png_path}')
+            ring.flush(flush_writer)
+    finally:
+        # Also when the capture failed: the flusher saves what is in the ring and returns
+        stop_event.set()
+        if flusher is not None:
+            flusher.join()
+        if preview is not None:
+            preview.close()
+        writer.close()
+    if flush_errors:
+        raise flush_errors[0]
+
+    if metrics is not None:
+        metrics.print_summary()
+        metrics.export(png_path + constants.METRICS_SUFFIX)
+    if chunk_metadata is not None:
+        chunk_metadata.save(png_path + constants.CHUNK_SUFFIX)
+    report_gate(gate, png_path)
+
+    get_system().destroy_device()
+    print(f'Destroyed all created devices')
+
 if __name__ == "__main__":
     
-    capture_image()    
\ No newline at end of file
+    if constants.BURST:
+        capture_burst()
+    else:
+        capture_image()    
\ No newline at end of file
@@ -0,0 +1,266 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, sys, struct, threading
+from multiprocessing import Pool
+import numpy as np
+
+import constants
+
+"""
+Raw recording container (.arec)
+
+    file header   : FILE_MAGIC, version
+    frame record  : RECORD_MAGIC, one INDEX_DTYPE row, padding, pixel data
+    ...
+    index         : all INDEX_DTYPE rows
+    footer        : INDEX_MAGIC, index offset, frame count
+
+Pixel data starts on an ALIGNMENT boundary so it can be viewed through a
+memory map without copying. The index is written when the recording is
+closed. If the footer is missing (crash, power loss) the reader rebuilds the
+index from the frame records.
+"""
+
+FILE_MAGIC = b'ARNAREC1'
+RECORD_MAGIC = b'ARNAFRM1'
+INDEX_MAGIC = b'ARNAIDX1'
+VERSION = 1
+ALIGNMENT = 64
+
+FILE_HEADER = struct.Struct('<8sI')
+FOOTER = struct.Struct('<8sQQ')
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),        # pixel data offset in the file
+    ('nbytes', '<u8'),
+    ('frame_id', '<u8'),
+    ('timestamp_ns', '<u8'),  # device timestamp
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('channels', '<u2'),
+    ('dtype', 'S4'),          # numpy dtype string, e.g. |u1 or <u2
+    ('pixel_format', 'S16'),  # e.g. Mono8
+])
+
+RECORD_HEADER_SIZE = len(RECORD_MAGIC) + INDEX_DTYPE.itemsize
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class RecordingWriter:
+    """
+    Append-only writer
+    (1) Optionally preallocates preallocate_bytes so the file does not grow
+        (and fragment) while recording
+    (2) Every frame is written as one record through a large write buffer, so
+        the disk sees big sequential writes
+    (3) close() trims the preallocated tail and appends the index and footer
+
+    write() is thread safe, so a RecordingWriter can be used as a
+    CapturePipeline writer. It returns the offset of the pixel data.
+    resume is the sync() state of an interrupted recording: the file is
+    reopened, cut back to that offset and appended to.
+    """
+    def __init__(self, path, preallocate_bytes=None, write_buffer=None, resume=None):
+        preallocate_bytes = constants.RECORDING_PREALLOCATE if preallocate_bytes is None else preallocate_bytes
+        write_buffer = constants.RECORDING_WRITE_BUFFER if write_buffer is None else write_buffer
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.lock = threading.Lock()
+        if resume is not None and os.path.isfile(path):
+            self._reopen(resume['offset'], write_buffer)
+            return
+
+        self.f = open(path, 'wb', buffering=write_buffer)
+        if preallocate_bytes and hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self.f.fileno(), 0, preallocate_bytes)
+
+        self.f.write(FILE_HEADER.pack(FILE_MAGIC, VERSION))
+        self.offset = FILE_HEADER.size
+        self.index = []
+
+    def _reopen(self, offset, write_buffer):
+        # The frame records up to offset are complete, anything after them is dropped
+        reader = RecordingReader(self.path)
+        index = np.array(reader.index[reader.index['offset'] + reader.index['nbytes'] <= offset])
+        del reader
+
+        self.f = open(self.path, 'r+b', buffering=write_buffer)
+        self.f.truncate(offset)
+        self.f.seek(offset)
+        self.offset = offset
+        self.index = [index[i:i + 1] for i in range(len(index))]
+        print(f'Resumed recording {self.path} after {len(index)} frames')
+
+    def write(self, arr, frame_id=None, timestamp_ns=0, pixel_format='Mono8'):
+        arr = np.ascontiguousarray(arr)
+        channels = arr.shape[2] if arr.ndim == 3 else 1
+
+        with self.lock:
+            if frame_id is None:
+                frame_id = len(self.index)
+
+            data_offset = _align(self.offset + RECORD_HEADER_SIZE)
+            entry = np.array([(data_offset, arr.nbytes, frame_id, timestamp_ns, arr.shape[1], arr.shape[0],
+                               channels, arr.dtype.str, pixel_format)], dtype=INDEX_DTYPE)
+
+            self.f.write(RECORD_MAGIC)
+            self.f.write(entry.tobytes())
+            self.f.write(b'\0' * (data_offset - self.offset - RECORD_HEADER_SIZE))
+            self.f.write(memoryview(arr).cast('B'))
+
+            self.offset = data_offset + arr.nbytes
+            self.index.append(entry)
+        return data_offset
+
+    def write_buffer(self, image_buffer):
+        """
+        Writes a device buffer directly from driver memory (no intermediate copy)
+        """
+        from utils import buffer_to_ndarray, get_buffer_info
+
+        info = get_buffer_info(image_buffer)
+        return self.write(buffer_to_ndarray(image_buffer), frame_id=info['frame_id'],
+                   timestamp_ns=info['timestamp_ns'], pixel_format=info['pixel_format'])
+
+    def __call__(self, arr, idx, info):
+        # Same signature as a CapturePipeline writer
+        return self.write(arr, frame_id=info.get('frame_id', idx), timestamp_ns=info.get('timestamp_ns', 0),
+                   pixel_format=info.get('pixel_format', 'Mono8'))
+
+    def sync(self):
+        """
+        Flushes and fsyncs what was written so far, returns the state to
+        resume from
+        """
+        with self.lock:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            return {'path': self.path, 'offset': self.offset, 'frames': len(self.index)}
+
+    def close(self):
+        with self.lock:
+            self.f.flush()
+            self.f.truncate(self.offset)
+            self.f.seek(self.offset)
+
+            index = np.concatenate(self.index) if self.index else np.zeros(0, dtype=INDEX_DTYPE)
+            self.f.write(index.tobytes())
+            self.f.write(FOOTER.pack(INDEX_MAGIC, self.offset, len(index)))
+            self.f.close()
+        print(f'Recorded {len(index)} frames to {self.path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class RecordingReader:
+    """
+    Random access reader, every frame is a read-only NumPy view on a memory map
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mm = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic, version = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != FILE_MAGIC:
+            raise Exception(f'{path} is not an Arena recording')
+        if version != VERSION:
+            raise Exception(f'Unsupported recording version {version}')
+
+        self.index = self._read_index()
+
+    def _read_index(self):
+        if len(self.mm) >= FILE_HEADER.size + FOOTER.size:
+            magic, index_offset, count = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+            if magic == INDEX_MAGIC:
+                return np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+
+        print(f'No index found in {self.path}, rebuilding it from the frame records')
+        return self._scan_index()
+
+    def _scan_index(self):
+        entries = []
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER_SIZE <= len(self.mm):
+            if bytes(self.mm[offset:offset + len(RECORD_MAGIC)]) != RECORD_MAGIC:
+                break
+            entry = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=1, offset=offset + len(RECORD_MAGIC))
+            end = int(entry['offset'][0] + entry['nbytes'][0])
+            if end > len(self.mm):
+                # Frame was cut off while being written
+                break
+            entries.append(entry)
+            offset = end
+        return np.concatenate(entries) if entries else np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        entry = self.index[i]
+        shape = (int(entry['height']), int(entry['width']))
+        if entry['channels'] > 1:
+            shape = shape + (int(entry['channels']),)
+        return np.ndarray(shape, dtype=np.dtype(entry['dtype'].decode()), buffer=self.mm, offset=int(entry['offset']))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+# Reader opened once per export worker process
+_reader = None
+
+def _export_init(path):
+    global _reader
+    _reader = RecordingReader(path)
+
+def _export_frame(args):
+    from encoder import write_array, get_image_name
+
+    i, png_path, image_format = args
+    write_array(os.path.join(png_path, get_image_name(i, image_format)), _reader[i], image_format)
+    return i
+
+def export_recording(path, png_path, image_format='png', num_workers=None):
+    """
+    Converts a recording to one image per frame using all cores.
+    Workers memory-map the recording themselves, only frame numbers are sent.
+    """
+    if not os.path.isdir(png_path):
+        os.makedirs(png_path)
+
+    num_frames = len(RecordingReader(path))
+    print(f'Exporting {num_frames} frames from {path} to {png_path}')
+
+    with Pool(processes=num_workers or os.cpu_count(), initializer=_export_init, initargs=(path,)) as pool:
+        tasks = [(i, png_path, image_format) for i in range(num_frames)]
+        for count, _ in enumerate(pool.imap_unordered(_export_frame, tasks, chunksize=8)):
+            print(f'{count + 1} / {num_frames} frames exported', end='\r')
+    print(f'\nExported {num_frames} frames')
+
+if __name__ == "__main__":
+    """
+    python recording.py <recording.arec> [output directory] [png|tiff|npy]
+    """
+    path = sys.argv[1]
+    png_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(path)[0]
+    image_format = sys.argv[3] if len(sys.argv) > 3 else 'png'
+    export_recording(path, png_path, image_format)
@@ -0,0 +1,121 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import threading
+import numpy as np
+
+class FrameRingBuffer:
+    """
+    Preallocated RAM ring buffer for burst capture
+
+    All slots are allocated up front as one (num_frames, height, width) array,
+    sized either in frames or in bytes. push() copies a frame into the next
+    slot, so the driver buffer can be requeued right after it.
+
+    When the ring is full:
+        - overwrite=True  : the oldest frame is overwritten (keeps the most
+                            recent frames of a trigger window)
+        - overwrite=False : the new frame is dropped, which is required while
+                            frames are being flushed in the background
+    """
+    def __init__(self, shape, dtype, num_frames=0, num_bytes=0, overwrite=True):
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if num_bytes:
+            num_frames = num_bytes // frame_bytes
+        if num_frames < 1:
+            raise Exception(f'Ring buffer must hold at least one frame of {frame_bytes} bytes')
+
+        # Pages are mapped by the first push into them, a large ring costs
+        # nothing until it is used
+        self.frames = np.empty((num_frames,) + tuple(shape), dtype=dtype)
+        self.sequence = np.zeros(num_frames, dtype=np.int64)
+        self.info = [None] * num_frames
+
+        self.capacity = num_frames
+        self.overwrite = overwrite
+        self.head = 0    # oldest frame
+        self.count = 0
+        self.pushed = 0
+        self.overwritten = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+
+        print('Allocated ring buffer of %d frames (%.1f MB)' % (num_frames, self.frames.nbytes / 1e6))
+
+    def __len__(self):
+        return self.count
+
+    def push(self, arr, info=None):
+        """
+        Copies arr into the ring, returns False if the frame was dropped
+        """
+        with self.lock:
+            if self.count == self.capacity:
+                if not self.overwrite:
+                    self.dropped += 1
+                    self.pushed += 1
+                    return False
+                self.head = (self.head + 1) % self.capacity
+                self.count -= 1
+                self.overwritten += 1
+
+            slot = (self.head + self.count) % self.capacity
+            np.copyto(self.frames[slot], arr)
+            self.sequence[slot] = self.pushed
+            self.info[slot] = info
+
+            self.pushed += 1
+            self.count += 1
+            self.not_empty.notify()
+        return True
+
+    def peek(self, timeout=None):
+        """
+        Returns (sequence, frame view, info) of the oldest frame without
+        freeing its slot, or None if the ring stayed empty for timeout seconds
+        """
+        with self.not_empty:
+            if not self.count and not self.not_empty.wait_for(lambda: self.count > 0, timeout):
+                return None
+            slot = self.head
+            return int(self.sequence[slot]), self.frames[slot], self.info[slot]
+
+    def release(self):
+        """
+        Frees the slot of the oldest frame once it has been saved
+        """
+        with self.lock:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+
+    def flush(self, writer, stop_event=None):
+        """
+        Saves frames in order with writer(arr, idx, info), idx being the
+        sequence number of the frame in the burst.
+        Without stop_event the ring is emptied once. With stop_event it keeps
+        flushing until the event is set and the ring is empty (background flush).
+        """
+        flushed = 0
+        while True:
+            item = self.peek(timeout=0.1 if stop_event is not None else 0)
+            if item is None:
+                if stop_event is None or stop_event.is_set():
+                    return flushed
+                continue
+
+            idx, arr, info = item
+            writer(arr, idx, info or {})
+            self.release()
+            flushed += 1
@@ -0,0 +1,176 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import re
+
+import constants
+
+"""
+Region of interest
+
+The ROI is set on the camera (Width, Height, OffsetX, OffsetY) so only the
+region is read out and sent over the link. Presets are given in binned pixels
+(constants.ROI_PRESETS), offsets can be 'center'. When the camera can not
+crop, the full frame is streamed and cropped on the host with a view.
+"""
+
+ROI_NODES = ['Width', 'Height', 'OffsetX', 'OffsetY', 'WidthMax', 'HeightMax', 'PixelFormat',
+             'AcquisitionFrameRate', 'AcquisitionFrameRateEnable', 'DeviceLinkSpeed']
+
+def get_bits_per_pixel(pixel_format):
+    """
+    Bits per pixel on the link: packed formats (Mono12p, Mono12Packed) use
+    their bit depth, the others are padded to whole bytes per channel
+    """
+    match = re.search(r'(\d+)', pixel_format)
+    bits = int(match.group(1)) if match else 8
+    channels = 3 if pixel_format.startswith(('RGB', 'BGR')) else 1
+    if not (pixel_format.endswith('p') or pixel_format.endswith('Packed')):
+        bits = (bits + 7) // 8 * 8
+    return bits * channels
+
+def align(value, inc, minimum=0):
+    """
+    Largest value <= value that is minimum plus a multiple of inc
+    """
+    inc = max(int(inc or 1), 1)
+    return minimum + max(int(value) - minimum, 0) // inc * inc
+
+def get_preset(name):
+    if name not in constants.ROI_PRESETS:
+        raise Exception(f'Unknown ROI preset {name}, use one of {list(constants.ROI_PRESETS)}')
+    return constants.ROI_PRESETS[name]
+
+def plan_roi(nodemap, preset):
+    """
+    Resolves a preset against the device before anything is written
+    (1) Width / height aligned to their increments and clamped to the
+        sensor (at the current binning)
+    (2) Offsets aligned, 'center' centers the region
+    (3) Estimated maximum frame rate: readout time scales with the number of
+        rows, so the current AcquisitionFrameRate maximum is scaled by
+        current height / ROI height. The link caps it at
+        link speed / frame size
+    (4) Bandwidth at the frame rate that will be used
+    Returns a dict with width, height, offset_x, offset_y, frame_bytes,
+    max_fps, fps, bandwidth (bytes/s) and on_device (False = host cropping).
+    """
+    nodes = nodemap.get_node(ROI_NODES)
+    width_node, height_node = nodes['Width'], nodes['Height']
+    offset_x_node, offset_y_node = nodes['OffsetX'], nodes['OffsetY']
+
+    on_device = all(node is not None and node.is_writable
+                    for node in (width_node, height_node, offset_x_node, offset_y_node))
+
+    # (1) Without WidthMax / HeightMax, Width.max is what is left next to the offset
+    if on_device:
+        sensor_width = nodes['WidthMax'].value if nodes['WidthMax'] is not None else width_node.max + offset_x_node.value
+        sensor_height = nodes['HeightMax'].value if nodes['HeightMax'] is not None else height_node.max + offset_y_node.value
+        width_inc, height_inc = width_node.inc, height_node.inc
+        width_min, height_min = width_node.min, height_node.min
+    else:
+        sensor_width, sensor_height = width_node.value, height_node.value
+        width_inc = height_inc = 1
+        width_min = height_min = 1
+
+    width = align(min(preset.get('width', sensor_width), sensor_width), width_inc, width_min)
+    height = align(min(preset.get('height', sensor_height), sensor_height), height_inc, height_min)
+
+    # (2)
+    offset_x_inc = offset_x_node.inc if on_device else 1
+    offset_y_inc = offset_y_node.inc if on_device else 1
+    offset_x = preset.get('offset_x', 0)
+    offset_y = preset.get('offset_y', 0)
+    if offset_x == 'center':
+        offset_x = (sensor_width - width) // 2
+    if offset_y == 'center':
+        offset_y = (sensor_height - height) // 2
+    offset_x = align(min(offset_x, sensor_width - width), offset_x_inc)
+    offset_y = align(min(offset_y, sensor_height - height), offset_y_inc)
+
+    # (3) With host cropping the full frame still goes over the link
+    bits_per_pixel = get_bits_per_pixel(nodes['PixelFormat'].value)
+    frame_bytes = width * height * bits_per_pixel // 8
+    link_bytes = frame_bytes if on_device else sensor_width * sensor_height * bits_per_pixel // 8
+    link_speed = nodes['DeviceLinkSpeed'].value if nodes['DeviceLinkSpeed'] is not None else constants.LINK_SPEED
+
+    frame_rate_node = nodes['AcquisitionFrameRate']
+    max_fps = frame_rate_node.max
+    if on_device:
+        max_fps *= height_node.value / height
+    max_fps = min(max_fps, link_speed / link_bytes)
+
+    # (4)
+    fps = max_fps
+    if nodes['AcquisitionFrameRateEnable'] is not None and nodes['AcquisitionFrameRateEnable'].value:
+        fps = min(frame_rate_node.value, max_fps)
+
+    return {
+        'width': width, 'height': height, 'offset_x': offset_x, 'offset_y': offset_y,
+        'frame_bytes': frame_bytes, 'max_fps': max_fps, 'fps': fps,
+        'bandwidth': link_bytes * fps, 'link_speed': link_speed, 'on_device': on_device,
+    }
+
+def print_roi(name, roi):
+    print('ROI %s : %dx%d at (%d, %d), %s' % (name, roi['width'], roi['height'], roi['offset_x'], roi['offset_y'],
+                                            'on the camera' if roi['on_device'] else 'cropped on the host'))
+    print('\testimated max %.1f fps, %.1f fps -> %.1f MB/s (%.0f%% of the link)' % (
+        roi['max_fps'], roi['fps'], roi['bandwidth'] / 1e6, roi['bandwidth'] / roi['link_speed'] * 100))
+
+def apply_roi(nodemap, roi):
+    """
+    Writes the ROI to the camera. The offsets are cleared first, otherwise a
+    larger width / height can be over its maximum. Only nodes that change
+    are written.
+    """
+    nodes = nodemap.get_node(['Width', 'Height', 'OffsetX', 'OffsetY'])
+    target = {'Width': roi['width'], 'Height': roi['height'], 'OffsetX': roi['offset_x'], 'OffsetY': roi['offset_y']}
+    if all(nodes[name].value == value for name, value in target.items()):
+        return
+
+    for name in ('OffsetX', 'OffsetY'):
+        if nodes[name].value != 0:
+            nodes[name].value = 0
+    for name in ('Width', 'Height', 'OffsetX', 'OffsetY'):
+        if nodes[name].value != target[name]:
+            nodes[name].value = target[name]
+
+def get_host_crop(roi):
+    """
+    Slices for cropping on the host, None when the camera crops
+    """
+    if roi['on_device']:
+        return None
+    return (slice(roi['offset_y'], roi['offset_y'] + roi['height']),
+            slice(roi['offset_x'], roi['offset_x'] + roi['width']))
+
+def crop_image(arr, crop):
+    """
+    Zero-copy crop, a view on arr
+    """
+    return arr if crop is None else arr[crop]
+
+def set_roi(nodemap, name=None):
+    """
+    Plans, reports and applies the ROI preset name (default constants.ROI).
+    Returns the host crop to apply to every frame (see crop_image), None when
+    the camera does the cropping.
+    """
+    name = name or constants.ROI
+    roi = plan_roi(nodemap, get_preset(name))
+    print_roi(name, roi)
+    if roi['on_device']:
+        apply_roi(nodemap, roi)
+        print('AcquisitionFrameRate maximum with the ROI : %.1f fps' % nodemap.get_node('AcquisitionFrameRate').max)
+    return get_host_crop(roi)
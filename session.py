@@ -0,0 +1,255 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, time, datetime, threading
+
+import constants
+from utils import get_system, wait_for_device, find_device_info
+from configuration import get_profile
+
+"""
+Resumable capture sessions
+
+The state of a running capture (output path, next frame index, applied
+configuration, writer state) is checkpointed to constants.SESSION_PATH
+(default PNG_ROOT/persist.json) under constants.SESSION_KEY, the other keys of the file are
+kept. A run that crashed is resumed from its checkpoint: numbering and
+writing continue at the first frame that was not finished, without scanning
+the output directory. A camera that is lost while streaming is waited for
+and reopened, see SessionManager.reconnect().
+"""
+
+def get_session_path():
+    return constants.SESSION_PATH or os.path.join(constants.PNG_ROOT, 'persist.json')
+
+def load_persist(path=None):
+    path = path or get_session_path()
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_persist(persist, path=None):
+    """
+    Atomic replace: write a temporary file, fsync it, rename it over path
+    and fsync the directory, so a crash leaves either the old or the new
+    checkpoint and never a truncated one
+    """
+    path = path or get_session_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(persist, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class SessionManager:
+    """
+    Checkpointing of one capture session
+    (1) begin() resumes the session in the checkpoint if it was still running
+        for the same device and encoder, otherwise a new one is started
+    (2) The pipeline reports every frame whose fate is final (written, gated
+        or dropped) with frame_done(idx). next_idx is the first index that is
+        not done yet, with several writers frames finish out of order
+    (3) A background thread checkpoints every checkpoint_interval seconds, or
+        earlier once checkpoint_frames frames finished. The writer is synced
+        first (writer.sync(): fsync of the files / recording written since
+        the last checkpoint), so one checkpoint costs one batch of fsyncs
+        instead of one per frame. Then the sidecars registered with
+        add_sidecar() are saved, a resumed run continues them
+    (4) stop() takes the last checkpoint before the writer is closed,
+        finish() marks the session complete, the next run starts a new one
+    """
+    def __init__(self, path=None, key=None, checkpoint_frames=None, checkpoint_interval=None):
+        key = constants.SESSION_KEY if key is None else key
+        checkpoint_frames = constants.SESSION_CHECKPOINT_FRAMES if checkpoint_frames is None else checkpoint_frames
+        checkpoint_interval = constants.SESSION_CHECKPOINT_INTERVAL if checkpoint_interval is None else checkpoint_interval
+        self.path = path
+        self.key = key
+        self.checkpoint_frames = checkpoint_frames
+        self.checkpoint_interval = checkpoint_interval
+
+        self.state = None
+        self.writer = None
+        self.sidecars = []
+        self.next_idx = 0
+        self.done = set()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.due = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def begin(self, device, png_path, num_images=None):
+        """
+        (1) Returns (png_path, first frame index) to capture with
+        """
+        num_images = constants.NUM_IMAGES if num_images is None else num_images
+        serial = str(device.nodemap.get_node('DeviceSerialNumber').value)
+        saved = load_persist(self.path).get(self.key)
+
+        # A stack is only written at the end, there is nothing to resume
+        if (constants.SESSION_RESUME and saved and saved.get('status') == 'running'
+                and saved.get('serial') == serial and saved.get('encoder') == constants.ENCODER
+                and constants.ENCODER != 'stack' and saved.get('next_idx', 0) < num_images):
+            self.state = saved
+            self.next_idx = saved['next_idx']
+            print(f'Resuming session {saved["started"]} in {saved["png_path"]} at frame {self.next_idx} of {num_images}')
+        else:
+            now = datetime.datetime.now().isoformat(timespec='seconds')
+            self.state = {'status': 'running', 'serial': serial, 'png_path': png_path, 'encoder': constants.ENCODER,
+                          'image_format': constants.IMAGE_FORMAT, 'num_images': num_images, 'next_idx': 0,
+                          'started': now, 'reconnects': 0, 'writer': None}
+        self.state['num_images'] = num_images
+        self.state['profile'] = get_profile()
+        self.checkpoint()
+        return self.state['png_path'], self.next_idx
+
+    @property
+    def writer_state(self):
+        """
+        Writer state of the checkpoint to reopen the writer with (create_writer resume)
+        """
+        return self.state.get('writer') if self.state else None
+
+    def add_sidecar(self, save):
+        """
+        save() is called at every checkpoint, after the writer was synced
+        """
+        self.sidecars.append(save)
+
+    def start(self, writer):
+        self.writer = writer
+        self.thread = threading.Thread(target=self._run, name='session', daemon=True)
+        self.thread.start()
+
+    def frame_done(self, idx):
+        # (2)
+        with self.lock:
+            self.done.add(idx)
+            while self.next_idx in self.done:
+                self.done.remove(self.next_idx)
+                self.next_idx += 1
+            self.pending += 1
+            if self.pending >= self.checkpoint_frames:
+                self.due.set()
+
+    def _run(self):
+        # (3)
+        while not self.stop_event.is_set():
+            self.due.wait(self.checkpoint_interval)
+            self.due.clear()
+            if self.pending:
+                self.checkpoint()
+
+    def checkpoint(self, status='running'):
+        with self.checkpoint_lock:
+            # Frames before next_idx are complete before the sync, so they are on disk after it
+            with self.lock:
+                next_idx = self.next_idx
+                self.pending = 0
+            if self.writer is not None and hasattr(self.writer, 'sync'):
+                self.state['writer'] = self.writer.sync()
+            for save in self.sidecars:
+                save()
+
+            self.state.update({'status': status, 'next_idx': next_idx,
+                               'updated': datetime.datetime.now().isoformat(timespec='seconds')})
+            persist = load_persist(self.path)
+            persist[self.key] = self.state
+            save_persist(persist, self.path)
+
+    def stop(self):
+        """
+        Last checkpoint with the writer, to be called before the writer is closed
+        """
+        self.stop_event.set()
+        self.due.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.writer is not None:
+            self.checkpoint()
+            self.writer = None
+
+    def finish(self):
+        # (4)
+        self.stop()
+        self.checkpoint(status='complete')
+        print(f'Session complete: {self.next_idx} frames in {self.state["png_path"]}, '
+              f'{self.state["reconnects"]} reconnects')
+
+    def is_device_lost(self, device):
+        """
+        Lost when the camera is not enumerated any more or its nodemap can not be read
+        """
+        if find_device_info(self.state['serial']) is None:
+            return True
+        try:
+            device.nodemap.get_node('DeviceSerialNumber').value
+        except Exception:
+            return True
+        return False
+
+    def reconnect(self, device, error):
+        """
+        Called with the error that ended the stream. Reraises it when the
+        device is still there, otherwise waits for the camera to be enumerated
+        again (exponential backoff from RECONNECT_BACKOFF_INITIAL, so a camera
+        that is back is picked up within milliseconds) and returns the
+        reopened device. The caller sets it up again and continues at next_idx.
+        """
+        if not self.is_device_lost(device):
+            raise error
+
+        serial = self.state['serial']
+        print(f'[WARNING] Device {serial} lost ({error}), waiting up to {constants.RECONNECT_TIMEOUT} secs')
+        self.checkpoint()
+        system = get_system()
+        try:
+            system.destroy_device(device)
+        except Exception:
+            pass
+
+        start = time.perf_counter()
+        info = wait_for_device(serial=serial, timeout=constants.RECONNECT_TIMEOUT)
+        if info is None:
+            raise Exception(f'Device {serial} did not come back within {constants.RECONNECT_TIMEOUT} secs') from error
+
+        device = system.create_device(device_infos=[info])[0]
+        self.state['reconnects'] += 1
+        print('Device %s reconnected after %.2f s, resuming at frame %d' % (
+            serial, time.perf_counter() - start, self.next_idx))
+        return device
+
+def create_session():
+    """
+    SessionManager if constants.SESSION is on, else None
+    """
+    return SessionManager() if constants.SESSION else None
@@ -0,0 +1,168 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, threading
+import numpy as np
+
+import constants
+
+# MAD of normally distributed values times this is their standard deviation
+MAD_TO_STD = 1.4826
+
+class FrameStacker:
+    """
+    Streaming frame stacking with constant memory
+    (1) Every frame is folded into per-pixel accumulators: running mean and
+        Welford M2 (variance), min and max. All updates are vectorized and
+        write into preallocated arrays
+    (2) Optionally frames are also collected in blocks of clip_window frames.
+        Each full block is sigma-clipped and added to a clipped sum / count,
+        so outliers like hot pixels or cosmic hits are removed. The clip uses
+        the block median and MAD (median absolute deviation, scaled to a
+        standard deviation): mean and std of a small block are pulled by the
+        outlier itself, with 10 frames or less no value could ever be more
+        than 3 std from the mean
+    (3) save() writes only the reduced products: mean, min, max, the
+        sigma-clipped mean and optionally the per-pixel noise maps (std and
+        variance)
+
+    A FrameStacker can be used as a frame writer, writer(arr, idx, info).
+    The accumulators are allocated from the first frame.
+    """
+    def __init__(self, png_path, accumulator_dtype=None, clip_window=None, sigma=None, noise_maps=None):
+        accumulator_dtype = constants.STACK_DTYPE if accumulator_dtype is None else accumulator_dtype
+        clip_window = constants.STACK_CLIP_WINDOW if clip_window is None else clip_window
+        sigma = constants.STACK_SIGMA if sigma is None else sigma
+        noise_maps = constants.STACK_NOISE_MAPS if noise_maps is None else noise_maps
+        self.png_path = png_path
+        self.accumulator_dtype = np.dtype(accumulator_dtype)
+        self.clip_window = clip_window
+        self.sigma = sigma
+        self.noise_maps = noise_maps
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _allocate(self, arr):
+        shape, dtype = arr.shape, self.accumulator_dtype
+        self.frame_dtype = arr.dtype
+        self.mean = np.zeros(shape, dtype=dtype)
+        self.m2 = np.zeros(shape, dtype=dtype)
+        self.delta = np.empty(shape, dtype=dtype)
+        self.delta2 = np.empty(shape, dtype=dtype)
+        self.min = arr.copy()
+        self.max = arr.copy()
+
+        if self.clip_window > 1:
+            self.window = np.empty((self.clip_window,) + shape, dtype=arr.dtype)
+            self.window_count = 0
+            self.clipped_sum = np.zeros(shape, dtype=dtype)
+            self.clipped_count = np.zeros(shape, dtype=np.uint32)
+
+    def add(self, arr):
+        with self.lock:
+            if self.count == 0:
+                self._allocate(arr)
+            elif arr.shape != self.mean.shape:
+                raise Exception(f'Frame shape {arr.shape} does not match the stack {self.mean.shape}')
+
+            # (1) Welford: delta = x - mean, mean += delta / n, M2 += delta * (x - mean)
+            self.count += 1
+            np.subtract(arr, self.mean, out=self.delta)
+            np.multiply(self.delta, 1.0 / self.count, out=self.delta2)
+            self.mean += self.delta2
+            np.subtract(arr, self.mean, out=self.delta2)
+            self.delta2 *= self.delta
+            self.m2 += self.delta2
+            np.minimum(self.min, arr, out=self.min)
+            np.maximum(self.max, arr, out=self.max)
+
+            # (2)
+            if self.clip_window > 1:
+                self.window[self.window_count] = arr
+                self.window_count += 1
+                if self.window_count == self.clip_window:
+                    self._clip_window(self.window)
+                    self.window_count = 0
+
+    def _clip_window(self, window):
+        window = window.astype(self.accumulator_dtype)
+        deviation = np.abs(window - np.median(window, axis=0))
+        block_std = MAD_TO_STD * np.median(deviation, axis=0)
+        # Integer frames: a MAD of 0 (most values equal) still keeps +-1 LSB noise
+        if self.frame_dtype.kind in 'ui':
+            np.maximum(block_std, 1.0, out=block_std)
+        keep = deviation <= self.sigma * block_std
+        self.clipped_sum += np.where(keep, window, 0).sum(axis=0)
+        self.clipped_count += keep.sum(axis=0, dtype=np.uint32)
+
+    def __call__(self, arr, idx, info):
+        self.add(arr)
+
+    def result(self):
+        """
+        Reduced products as a dict of arrays
+        """
+        with self.lock:
+            if self.count == 0:
+                raise Exception('No frame was stacked')
+
+            products = {
+                'mean': self.mean.copy(),
+                'min': self.min.copy(),
+                'max': self.max.copy(),
+            }
+            if self.noise_maps:
+                variance = self.m2 / max(self.count - 1, 1)
+                products['variance'] = variance
+                products['std'] = np.sqrt(variance)
+
+            if self.clip_window > 1:
+                # A partial last block is clipped as well
+                if self.window_count > 1:
+                    self._clip_window(self.window[:self.window_count])
+                    self.window_count = 0
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    clipped = self.clipped_sum / self.clipped_count
+                products['clipped_mean'] = np.where(self.clipped_count > 0, clipped, self.mean)
+            return products
+
+    def save(self):
+        """
+        Saves the products as float32 .npy and the mean, min and max
+        also as png in the frame dtype
+        """
+        import cv2
+
+        if not os.path.isdir(self.png_path):
+            os.makedirs(self.png_path)
+
+        products = self.result()
+        for name, arr in products.items():
+            np.save(os.path.join(self.png_path, f'{constants.PNG_NAME}_{name}.npy'), arr.astype(np.float32))
+        for name in ('mean', 'clipped_mean', 'min', 'max'):
+            if name in products:
+                arr = np.rint(products[name]).astype(self.frame_dtype)
+                cv2.imwrite(os.path.join(self.png_path, f'{constants.PNG_NAME}_{name}.png'), arr)
+
+        print(f'Stacked {self.count} frames, saved {list(products)} to {self.png_path}')
+
+    def close(self):
+        if self.count:
+            self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,53 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The simulated SDK has to be registered before any module of the repository is imported
+import fake_arena
+fake_arena.install(num_devices=1, width=64, height=48)
+
+import constants
+
+"""
+Every test runs on fake_arena with small frames and writes below its own
+tmp_path, never to the files of the working directory.
+"""
+
+@pytest.fixture
+def num_devices():
+    return 1
+
+@pytest.fixture(autouse=True)
+def sandbox(tmp_path, monkeypatch, num_devices):
+    """
+    Simulated devices and constants pointed at tmp_path
+    """
+    fake_arena.install(num_devices=num_devices, width=64, height=48)
+    monkeypatch.setattr(fake_arena.system, 'devices', [])
+    monkeypatch.setattr(fake_arena.system, 'unplugged', {})
+
+    monkeypatch.setattr(constants, 'PNG_ROOT', str(tmp_path / 'captured_images'))
+    monkeypatch.setattr(constants, 'PNG_PATH', str(tmp_path / 'captured_images' / 'run'))
+    monkeypatch.setattr(constants, 'CONFIG_CACHE_PATH', str(tmp_path / 'config_cache.json'))
+    monkeypatch.setattr(constants, 'SESSION_PATH', str(tmp_path / 'persist.json'))
+    monkeypatch.setattr(constants, 'AUTOTUNE_PATH', str(tmp_path / 'autotune.json'))
+    monkeypatch.setattr(constants, 'CATALOG_PATH', str(tmp_path / 'catalog.sqlite'))
+    monkeypatch.setattr(constants, 'PREVIEW', False)
+    monkeypatch.setattr(constants, 'ENCODER', 'thread')
+    return tmp_path
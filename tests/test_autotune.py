@@ -0,0 +1,36 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import fake_arena
+from autotune import read_counters
+
+def test_read_counters_skips_missing_and_unreadable_nodes(monkeypatch):
+    device = fake_arena.system.create_device()[0]
+    nodemap = device.tl_stream_nodemap
+    del nodemap.nodes['StreamLostFrameCount']
+    def unreadable():
+        raise RuntimeError('node not available on this transport layer')
+    nodemap.nodes['StreamResendRequestCount'].getter = unreadable
+    get_node = nodemap.get_node
+    def raising(name):
+        if name == 'StreamIncompleteFrameCount':
+            raise RuntimeError('unknown node')
+        return get_node(name)
+    monkeypatch.setattr(nodemap, 'get_node', raising)
+
+    counters = read_counters(nodemap)
+
+    assert counters == {'StreamDeliveredFrameCount': 0}
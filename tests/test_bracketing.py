@@ -0,0 +1,60 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+import json, os
+
+import numpy as np
+import pytest
+
+import constants
+import bracketing
+from bracketing import HdrMerger
+
+def test_saturated_mono12_pixel_has_no_weight():
+    merger = HdrMerger()
+    arr = np.array([[4095, 2048, 0]], dtype=np.uint16)
+    merger.add(arr, exposure=1000.0, pixel_format='Mono12')
+    assert merger.max_value == 4095
+    assert merger.weights[0, 0] == 0
+    assert merger.weights[0, 1] == pytest.approx(1.0, abs=1e-3)
+    assert merger.weights[0, 2] == 0
+
+def test_unweighted_pixels_take_the_shortest_exposure():
+    merger = HdrMerger()
+    for exposure in (10000.0, 1000.0, 5000.0):
+        merger.add(np.array([[255, 128]], dtype=np.uint8), exposure=exposure, pixel_format='Mono8')
+    radiance = merger.radiance()
+    # Saturated in every frame: the value of the 1000 us frame
+    assert radiance[0, 0] == pytest.approx(255 / 1e-3)
+    assert np.isfinite(radiance).all()
+
+def test_capture_bracketing_tags_frames_with_their_bracket(monkeypatch):
+    brackets = [{'exposure': 1000.0}, {'exposure': 4000.0, 'gain': 6.0}]
+    monkeypatch.setattr(constants, 'BRACKETS', brackets)
+    monkeypatch.setattr(constants, 'BRACKET_FRAMES', 2)
+    monkeypatch.setattr(constants, 'BRACKET_SWEEPS', 2)
+    monkeypatch.setattr(constants, 'BRACKET_HDR', False)
+    monkeypatch.setattr(constants, 'CHUNK_METADATA', True)
+
+    bracketing.capture_bracketing()
+
+    with open(os.path.join(constants.PNG_PATH, 'brackets.json')) as f:
+        tags = json.load(f)
+    assert [tag['idx'] for tag in tags] == list(range(8))
+    for tag in tags:
+        bracket = brackets[tag['bracket']]
+        # Settling is checked on the chunk data, every kept frame has the bracket settings
+        assert tag['ExposureTime'] == pytest.approx(bracket['exposure'])
+        assert tag['Gain'] == pytest.approx(bracket.get('gain', constants.GAIN))
@@ -0,0 +1,43 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+import os
+
+import constants
+import capture
+
+def test_capture_image_never_shows_frames_in_the_loop(monkeypatch):
+    def show_image(arr):
+        raise AssertionError('the capture loop must not block on a GUI')
+    monkeypatch.setattr(capture, 'show_image', show_image)
+    monkeypatch.setattr(constants, 'NUM_IMAGES', 3)
+    monkeypatch.setattr(constants, 'METRICS', True)
+
+    capture.capture_image()
+
+    assert len(os.listdir(constants.PNG_PATH)) == 3
+    with open(constants.PNG_PATH + constants.METRICS_SUFFIX + '.json') as f:
+        assert 'show' not in f.read()
+
+
+def test_constant_overrides_apply_after_import(monkeypatch):
+    import pipeline
+    monkeypatch.setattr(constants, 'NUM_WRITERS', 7)
+    monkeypatch.setattr(constants, 'QUEUE_SIZE', 5)
+
+    p = pipeline.CapturePipeline(device=None, writer=None)
+
+    assert p.num_writers == 7
+    assert p.frames.maxsize == 5
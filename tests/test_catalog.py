@@ -0,0 +1,52 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import numpy as np
+import pytest
+
+import constants
+from encoder import create_writer
+from catalog import create_catalog_writer, CatalogLoader
+
+def write_frames(encoder, frames):
+    writer = create_catalog_writer(create_writer(constants.PNG_PATH, encoder=encoder), constants.PNG_PATH)
+    for idx, arr in enumerate(frames):
+        writer(arr, idx, {'timestamp_ns': idx})
+    writer.close()
+
+@pytest.mark.parametrize('encoder, image_format', [('thread', 'png'), ('thread', 'npy'), ('recording', 'png')])
+def test_catalog_round_trip(monkeypatch, encoder, image_format):
+    monkeypatch.setattr(constants, 'IMAGE_FORMAT', image_format)
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 4096, (48, 64), dtype=np.uint16) for _ in range(5)]
+    write_frames(encoder, frames)
+
+    with CatalogLoader(num_workers=2, cache_frames=2) as loader:
+        stack = loader.load()
+        assert stack.dtype == np.uint16 and stack.shape == (5, 48, 64)
+        np.testing.assert_array_equal(stack, frames)
+        # Cached frames are copies, not views of the first stack
+        stack[:] = 0
+        np.testing.assert_array_equal(loader.load(), frames)
+        np.testing.assert_array_equal(loader.load(order='idx DESC'), frames[::-1])
+
+def test_catalog_order_is_checked():
+    write_frames('thread', [np.zeros((48, 64), dtype=np.uint8)])
+    with CatalogLoader() as loader:
+        assert len(loader.query(order='timestamp_ns desc, idx')) == 1
+        for order in ['idx; DROP TABLE frames', 'idx LIMIT 1', '(SELECT 1)', 'idx,']:
+            with pytest.raises(Exception, match='Invalid catalog order'):
+                loader.query(order=order)
@@ -0,0 +1,82 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+import numpy as np
+import pytest
+
+import fake_arena
+import constants
+from chunk_data import ChunkMetadata, create_chunk_metadata
+
+@pytest.fixture
+def device(monkeypatch):
+    monkeypatch.setattr(constants, 'CHUNK_METADATA', True)
+    device = fake_arena.system.create_device()[0]
+    yield device
+    device.stop_stream()
+
+def read_frames(device, chunk_metadata, num_frames, first_idx=0):
+    expected = []
+    with device.start_stream(4):
+        for idx in range(first_idx, first_idx + num_frames):
+            buffer = device.get_buffer()
+            values = chunk_metadata.read(buffer, idx)
+            expected.append((values, dict(buffer.chunks)))
+            device.requeue_buffer(buffer)
+    return expected
+
+def test_device_without_chunks_falls_back(device, capsys):
+    del device.nodemap.nodes['ChunkModeActive']
+    assert create_chunk_metadata(device.nodemap) is None
+    assert 'not supported' in capsys.readouterr().out
+
+def test_layout_is_learned_and_parsed_from_memory(device):
+    chunk_metadata = create_chunk_metadata(device.nodemap)
+    frames = read_frames(device, chunk_metadata, 8)
+
+    # Every chunk was located in the buffer, nothing is read through the SDK
+    assert chunk_metadata.layout is not None and chunk_metadata.sdk_names == []
+    assert sorted(chunk_metadata.layout.names) == sorted(constants.CHUNKS)
+    for values, chunks in frames:
+        assert values == pytest.approx(chunks)
+
+    columns = chunk_metadata.columns()
+    assert list(columns['idx']) == list(range(8))
+    assert list(columns['FrameID']) == [chunks['FrameID'] for values, chunks in frames]
+
+def test_flush_truncate_and_resume(device, tmp_path):
+    path = str(tmp_path / 'run_chunks.npy')
+    chunk_metadata = create_chunk_metadata(device.nodemap)
+    read_frames(device, chunk_metadata, 5)
+    chunk_metadata.flush(path)
+    read_frames(device, chunk_metadata, 5, first_idx=5)
+    chunk_metadata.flush(path)
+    assert list(np.load(path)['idx']) == list(range(10))
+
+    # Reconnect at frame 7: rows from 7 on are captured again
+    chunk_metadata.truncate(7)
+    read_frames(device, chunk_metadata, 3, first_idx=7)
+    chunk_metadata.flush(path)
+    assert list(np.load(path)['idx']) == list(range(10))
+
+    # Resumed run at frame 6 continues the sidecar
+    resumed = ChunkMetadata()
+    resumed.enable(device.nodemap)
+    resumed.resume(path, 6)
+    read_frames(device, resumed, 4, first_idx=6)
+    resumed.save(path)
+    saved = np.load(path)
+    assert list(saved['idx']) == list(range(10))
+    assert saved.dtype == resumed.row_dtype
@@ -0,0 +1,70 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+import sys, collections
+
+import pytest
+
+import fake_arena
+import constants
+import configuration
+from configuration import get_profile, apply_profile
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    Counts the value reads of configuration.py per node name (not the ones
+    fake_arena makes for its node ranges)
+    """
+    counts = collections.Counter()
+    value = fake_arena.FakeNode.value
+    def counted(node):
+        if sys._getframe(1).f_code.co_filename == configuration.__file__:
+            counts[node.name] += 1
+        return value.fget(node)
+    monkeypatch.setattr(fake_arena.FakeNode, 'value', property(counted, value.fset))
+    return counts
+
+def test_apply_profile_reads_every_node_once(monkeypatch, reads):
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    apply_profile(nodemap, get_profile())
+
+    monkeypatch.setattr(constants, 'EXPOSURE_TIME', constants.EXPOSURE_TIME / 2)
+    profile = get_profile()
+    reads.clear()
+    changes = apply_profile(nodemap, profile)
+
+    assert [name for name, old, new in changes] == ['ExposureTime']
+    assert all(reads[name] == 1 for name in profile if name in nodemap.nodes)
+
+def test_apply_profile_rereads_nodes_that_depend_on_binning(monkeypatch, reads):
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    apply_profile(nodemap, get_profile())
+    full_width = nodemap['Width'].value
+
+    monkeypatch.setattr(constants, 'BINNING', 2)
+    reads.clear()
+    changes = dict((name, new) for name, old, new in apply_profile(nodemap, get_profile()))
+
+    assert changes['BinningHorizontal'] == 2
+    # Width is read again after binning and set to its new maximum
+    assert reads['Width'] == 2
+    assert nodemap['Width'].value == nodemap['Width'].max == full_width // 2
+    assert reads['Gamma'] == 1
+
+def test_apply_profile_is_idempotent():
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    assert apply_profile(nodemap, get_profile())
+    assert apply_profile(nodemap, get_profile()) == []
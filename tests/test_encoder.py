@@ -0,0 +1,60 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import constants
+from encoder import EncoderPool, get_image_name
+
+def frames(count):
+    rng = np.random.default_rng(5)
+    return [rng.integers(0, 4096, (48, 64), dtype=np.uint16) for _ in range(count)]
+
+def read(path):
+    return np.load(path) if path.endswith('.npy') else cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+@pytest.mark.parametrize('image_format, ordered', [('png', False), ('png', True), ('npy', False)])
+def test_encoder_pool_writes_every_frame(image_format, ordered):
+    written = frames(9)
+    # Fewer slots than frames: submit waits for a free slot
+    with EncoderPool(constants.PNG_PATH, num_workers=2, num_slots=3, image_format=image_format,
+                     ordered=ordered) as pool:
+        paths = [pool(arr, idx, {}) for idx, arr in enumerate(written)]
+        shm_name = pool.shm.name
+        pool.sync()
+        assert pool.completed == len(written)
+
+    assert paths == [os.path.join(constants.PNG_PATH, get_image_name(idx, image_format)) for idx in range(9)]
+    for path, expected in zip(paths, written):
+        np.testing.assert_array_equal(read(path), expected)
+    # The shared memory block is gone
+    assert pool.shm is None
+    if os.path.isdir('/dev/shm'):
+        assert not os.path.exists(os.path.join('/dev/shm', shm_name.lstrip('/')))
+
+def test_encoder_pool_rejects_frames_larger_than_a_slot():
+    with EncoderPool(constants.PNG_PATH, num_workers=1) as pool:
+        pool(np.zeros((48, 64), dtype=np.uint8), 0, {})
+        with pytest.raises(Exception, match='does not fit'):
+            pool(np.zeros((48, 64), dtype=np.uint16), 1, {})
+
+def test_encoder_pool_rejects_unknown_formats():
+    with pytest.raises(Exception, match='Unknown image format'):
+        EncoderPool(constants.PNG_PATH, num_workers=1, image_format='jpeg2000')
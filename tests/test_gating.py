@@ -0,0 +1,62 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import os, json
+
+import numpy as np
+
+import constants
+from gating import ChangeGate
+
+def test_gate_keeps_changes_and_keyframes():
+    gate = ChangeGate(metric='mad', threshold=0.01, factor=1, keyframe_interval=3)
+    static = np.full((32, 32), 100, dtype=np.uint8)
+    changed = static.copy()
+    changed[:16] = 200
+
+    decisions = [gate.check(arr, idx, {}) for idx, arr in enumerate([static] * 5 + [changed])]
+
+    # First frame, a keyframe after 3 skipped in a row, then the change
+    assert decisions == [True, False, False, True, False, True]
+    assert gate.summary()['saved'] == 3 and gate.summary()['skipped'] == 3
+
+def test_tile_metric_sees_small_objects():
+    frame = np.zeros((64, 64), dtype=np.uint8)
+    moved = frame.copy()
+    moved[:8, :8] = 255
+    info = {}
+
+    mad = ChangeGate(metric='mad', threshold=0.05, factor=1, keyframe_interval=0)
+    tile = ChangeGate(metric='tile', threshold=0.05, factor=1, tile=8, keyframe_interval=0)
+    for gate in (mad, tile):
+        gate.check(frame, 0)
+
+    assert not mad.check(moved, 1)
+    assert tile.check(moved, 1, info)
+    assert info['gate_reason'] == 'change' and info['gate_metric'] == 1.0
+
+def test_gate_log_resumes_after_first_idx():
+    path = os.path.join(constants.PNG_ROOT, 'gate.jsonl')
+    gate = ChangeGate(threshold=1.0, factor=1, keyframe_interval=0, log_path=path)
+    for idx in range(6):
+        gate.check(np.zeros((8, 8), dtype=np.uint8), idx)
+    gate.close()
+
+    resumed = ChangeGate(threshold=1.0, factor=1, keyframe_interval=0, log_path=path, first_idx=4)
+    assert (resumed.kept, resumed.skipped) == (1, 3)
+    resumed.close()
+    with open(path) as f:
+        assert [json.loads(line)['idx'] for line in f] == [0, 1, 2, 3]
@@ -0,0 +1,58 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import os
+
+import constants
+from metrics import LatencyHistogram, CaptureMetrics
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = LatencyHistogram()
+    for _ in range(98):
+        histogram.record(0.0015)
+    histogram.record(0.03)
+    histogram.record(0.3)
+
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert summary['p50_ms'] == 2.0
+    assert summary['p99_ms'] == 50.0
+    assert summary['max_ms'] == 300.0
+
+def test_frame_id_gaps_are_dropped_frames():
+    metrics = CaptureMetrics()
+    for frame_id in (0, 1, 2, 5, 6, 10):
+        metrics.frame({'frame_id': frame_id})
+    assert (metrics.frames, metrics.dropped) == (6, 5)
+
+def test_metrics_export_and_resume():
+    path = os.path.join(constants.PNG_ROOT, 'metrics')
+    metrics = CaptureMetrics()
+    for frame_id in range(4):
+        metrics.record('write', 0.004)
+        metrics.frame({'frame_id': frame_id})
+    metrics.write(path)
+
+    with open(path + '.prom') as f:
+        prom = f.read()
+    assert 'arena_capture_frames_total 4' in prom
+    assert 'arena_capture_stage_seconds_bucket{stage="write",le="0.005"} 4' in prom
+
+    resumed = CaptureMetrics()
+    resumed.resume(path)
+    resumed.record('write', 0.004)
+    summary = resumed.summary()
+    assert summary['frames'] == 4 and summary['stages']['write']['count'] == 5
@@ -0,0 +1,130 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, asyncio
+
+import pytest
+
+import fake_arena
+import constants
+import catalog
+from configuration import load_config_cache
+from multi_capture import get_serial, configure_devices, capture_multi
+from async_capture import capture_async
+
+NUM_DEVICES = 4
+
+@pytest.fixture
+def num_devices():
+    return NUM_DEVICES
+
+def test_configure_devices_caches_every_serial():
+    devices = fake_arena.system.create_device()
+    serials = {get_serial(device) for device in devices}
+    assert len(serials) == NUM_DEVICES
+
+    crops = configure_devices(devices)
+    assert crops == [None] * NUM_DEVICES
+    assert set(load_config_cache()) == serials
+
+def test_configure_devices_in_parallel_keeps_every_cache_entry(monkeypatch):
+    # Many devices finishing at the same time, an unlocked load-modify-save
+    # of the cache loses entries
+    monkeypatch.setattr(fake_arena.system, 'num_devices', 32)
+    for _ in range(3):
+        fake_arena.system.destroy_device()
+        devices = fake_arena.system.create_device()
+        configure_devices(devices)
+        assert set(load_config_cache()) == {get_serial(device) for device in devices}
+
+def test_configure_devices_skips_cached_and_verifies(capsys):
+    devices = fake_arena.system.create_device()
+    configure_devices(devices)
+    capsys.readouterr()
+
+    # Same device objects: the configuration is still applied
+    configure_devices(devices)
+    out = capsys.readouterr().out
+    assert out.count('already has the requested configuration, skipped') == NUM_DEVICES
+
+    # Reopened devices come back with default node values (power cycle)
+    fake_arena.system.destroy_device()
+    devices = fake_arena.system.create_device()
+    configure_devices(devices)
+    out = capsys.readouterr().out
+    assert out.count('lost its cached configuration') == NUM_DEVICES
+    assert set(load_config_cache()) == {get_serial(device) for device in devices}
+
+def test_capture_multi_writes_every_camera(sandbox):
+    num_images = 6
+    stats, aligner = capture_multi(num_images=num_images)
+
+    serials = sorted(stats)
+    assert len(serials) == NUM_DEVICES
+    for serial in serials:
+        assert stats[serial]['acquired'] == num_images
+        # Every matched set is written once per camera, with the same index
+        files = sorted(os.listdir(os.path.join(constants.PNG_PATH, serial)))
+        assert len(files) == len(aligner.skews)
+
+    connection = catalog.connect()
+    rows = connection.execute('SELECT serial, COUNT(*) AS frames FROM frames GROUP BY serial').fetchall()
+    connection.close()
+    assert {row['serial']: row['frames'] for row in rows} == {serial: len(aligner.skews) for serial in serials}
+
+def test_capture_async_writes_every_camera(sandbox):
+    num_images = 5
+    asyncio.run(capture_async(num_images=num_images))
+
+    serials = [str(100000000 + i) for i in range(NUM_DEVICES)]
+    for serial in serials:
+        names = sorted(os.path.splitext(name)[0] for name in os.listdir(os.path.join(constants.PNG_PATH, serial)))
+        assert names == ['%s_%04d' % (constants.PNG_NAME, idx) for idx in range(num_images)]
+
+    connection = catalog.connect()
+    rows = connection.execute('SELECT serial, COUNT(*) AS frames FROM frames GROUP BY serial').fetchall()
+    connection.close()
+    assert {row['serial']: row['frames'] for row in rows} == {serial: num_images for serial in serials}
+
+def test_capture_multi_splits_encoder_workers(sandbox, monkeypatch):
+    import encoder
+    monkeypatch.setattr(constants, 'ENCODER', 'process')
+    monkeypatch.setattr(constants, 'ENCODER_WORKERS', 8)
+    pools = []
+    init = encoder.EncoderPool.__init__
+    def record(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        pools.append(self.num_workers)
+    monkeypatch.setattr(encoder.EncoderPool, '__init__', record)
+
+    capture_multi(num_images=3)
+
+    # One pool per camera, all of them together stay within ENCODER_WORKERS
+    assert pools == [8 // NUM_DEVICES] * NUM_DEVICES
+
+def test_capture_async_cancels_other_streams_on_failure(sandbox, monkeypatch):
+    monkeypatch.setattr(constants, 'QUEUE_SIZE', 2)
+    get_buffer = fake_arena.FakeDevice.get_buffer
+    def failing(self, *args, **kwargs):
+        if self.serial == 100000000:
+            raise RuntimeError('stream lost')
+        return get_buffer(self, *args, **kwargs)
+    monkeypatch.setattr(fake_arena.FakeDevice, 'get_buffer', failing)
+
+    async def run():
+        with pytest.raises(RuntimeError, match='stream lost'):
+            await capture_async(num_images=1000)
+        return [task.get_name() for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
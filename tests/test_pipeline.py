@@ -0,0 +1,78 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import time
+
+import pytest
+
+import fake_arena
+from pipeline import CapturePipeline
+
+NUM_IMAGES = 12
+
+def run_pipeline(writer, **kwargs):
+    device = fake_arena.system.create_device()[0]
+    pipeline = CapturePipeline(device, writer, report_interval=0, **kwargs)
+    with device.start_stream(10):
+        stats = pipeline.run(NUM_IMAGES)
+    return pipeline, stats
+
+def test_pipeline_writes_every_frame_in_block_mode():
+    written = {}
+    def writer(arr, idx, info):
+        written[idx] = (arr.shape, info['frame_id'])
+
+    pipeline, stats = run_pipeline(writer, num_writers=3, queue_size=2, overflow_policy='block')
+
+    assert stats['acquired'] == stats['written'] == NUM_IMAGES and stats['dropped'] == 0
+    assert sorted(written) == list(range(NUM_IMAGES))
+    assert stats['max_queue_depth'] <= 2
+    assert all(shape == (48, 64) for shape, frame_id in written.values())
+
+@pytest.mark.parametrize('overflow_policy', ['drop_newest', 'drop_oldest'])
+def test_pipeline_drops_by_overflow_policy(overflow_policy):
+    written = []
+    def writer(arr, idx, info):
+        # Stalled until the whole burst was acquired, the queue overflows
+        while pipeline.stats()['acquired'] < NUM_IMAGES:
+            time.sleep(0.001)
+        written.append(idx)
+
+    device = fake_arena.system.create_device()[0]
+    pipeline = CapturePipeline(device, writer, num_writers=1, queue_size=2, overflow_policy=overflow_policy,
+                               report_interval=0)
+    with device.start_stream(10):
+        stats = pipeline.run(NUM_IMAGES)
+
+    # The queue (2) and the frame the writer may already hold
+    assert len(written) in (2, 3)
+    if overflow_policy == 'drop_newest':
+        assert written == list(range(len(written)))
+    else:
+        assert written[-2:] == [NUM_IMAGES - 2, NUM_IMAGES - 1]
+    assert stats['written'] + stats['dropped'] == stats['acquired'] == NUM_IMAGES
+
+def test_pipeline_raises_writer_errors():
+    def writer(arr, idx, info):
+        if idx == 3:
+            raise IOError('disk full')
+
+    with pytest.raises(IOError, match='disk full'):
+        run_pipeline(writer, num_writers=2)
+
+def test_pipeline_rejects_unknown_overflow_policy():
+    with pytest.raises(Exception, match='Unknown overflow policy'):
+        CapturePipeline(None, None, overflow_policy='drop_all')
@@ -0,0 +1,46 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import numpy as np
+import pytest
+
+from pixel_formats import CODECS, PixelDecoder, get_codec_name, is_packed
+from benchmark import decode_per_pixel
+
+@pytest.mark.parametrize('pixel_format', list(CODECS))
+def test_decoder_matches_per_pixel_reference(pixel_format):
+    decoder = PixelDecoder(pixel_format, 64, 48)
+    raw = np.random.default_rng(1).integers(0, 256, decoder.num_bytes + 7, dtype=np.uint8)
+
+    out = decoder.decode(raw)
+
+    assert out.shape == (48, 64) and out.dtype == decoder.dtype
+    np.testing.assert_array_equal(out.reshape(-1), decode_per_pixel(raw[:decoder.num_bytes], pixel_format, 64 * 48))
+    # The preallocated output is reused
+    assert decoder.decode(raw) is out
+
+def test_bayer_formats_use_the_mono_layout():
+    assert get_codec_name('BayerRG12p') == 'Mono12p'
+    assert is_packed('BayerGB10p') and not is_packed('BayerBG16')
+    with pytest.raises(Exception, match='No decoder'):
+        get_codec_name('YCbCr422_8')
+
+def test_decode_rejects_short_buffers():
+    decoder = PixelDecoder('Mono12p', 64, 48)
+    with pytest.raises(Exception, match='needs'):
+        decoder.decode(np.zeros(decoder.num_bytes - 1, dtype=np.uint8))
+    with pytest.raises(Exception, match='multiple of 4'):
+        PixelDecoder('Mono10p', 3, 1)
@@ -0,0 +1,84 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+import os, threading
+
+import numpy as np
+import pytest
+
+import fake_arena
+import constants
+import catalog
+import rapid_capture
+from ring_buffer import FrameRingBuffer
+
+def test_ring_buffer_overwrite_keeps_the_newest_frames():
+    ring = FrameRingBuffer((2, 3), np.uint8, num_frames=4, overwrite=True)
+    for i in range(6):
+        assert ring.push(np.full((2, 3), i, dtype=np.uint8), {'i': i})
+    assert (len(ring), ring.pushed, ring.overwritten, ring.dropped) == (4, 6, 2, 0)
+
+    saved = []
+    ring.flush(lambda arr, idx, info: saved.append((idx, int(arr[0, 0]), info['i'])))
+    assert saved == [(2, 2, 2), (3, 3, 3), (4, 4, 4), (5, 5, 5)]
+    assert len(ring) == 0
+
+def test_ring_buffer_without_overwrite_drops_new_frames():
+    ring = FrameRingBuffer((2, 3), np.uint8, num_bytes=3 * 6, overwrite=False)
+    assert ring.capacity == 3
+    results = [ring.push(np.full((2, 3), i, dtype=np.uint8)) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert (len(ring), ring.pushed, ring.overwritten, ring.dropped) == (3, 5, 0, 2)
+
+    saved = []
+    ring.flush(lambda arr, idx, info: saved.append(idx))
+    assert saved == [0, 1, 2]
+
+def test_ring_buffer_needs_one_frame():
+    with pytest.raises(Exception, match='at least one frame'):
+        FrameRingBuffer((2, 3), np.uint8, num_bytes=5)
+
+def test_burst_background_flush_ends_on_get_buffer_timeout(monkeypatch):
+    monkeypatch.setattr(constants, 'BURST_FLUSH', 'background')
+    monkeypatch.setattr(constants, 'BURST_FRAMES', 100)
+    monkeypatch.setattr(constants, 'BURST_DURATION', 0)
+
+    calls = []
+    get_buffer = fake_arena.FakeDevice.get_buffer
+    def failing_get_buffer(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) > 10:
+            raise Exception('get_buffer timed out')
+        return get_buffer(self, *args, **kwargs)
+    monkeypatch.setattr(fake_arena.FakeDevice, 'get_buffer', failing_get_buffer)
+
+    errors = []
+    def run():
+        try:
+            rapid_capture.capture_burst()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=20)
+    assert not thread.is_alive(), 'capture_burst hangs in the background flush'
+    assert len(errors) == 1 and 'timed out' in str(errors[0])
+    assert not [t for t in threading.enumerate() if t.name == 'flusher' and t.is_alive()]
+    # The frames captured before the timeout were flushed and the writer closed (catalog committed)
+    assert len(os.listdir(constants.PNG_PATH)) == 10
+    connection = catalog.connect()
+    assert connection.execute('SELECT COUNT(*) FROM frames').fetchone()[0] == 10
+    connection.close()
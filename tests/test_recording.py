@@ -0,0 +1,78 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import os
+
+import numpy as np
+
+from recording import RecordingWriter, RecordingReader
+
+def frames(count, shape=(48, 64), dtype=np.uint16):
+    rng = np.random.default_rng(4)
+    return [rng.integers(0, 4096, shape).astype(dtype) for _ in range(count)]
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / 'run.arec')
+    written = frames(4) + [np.zeros((48, 64, 3), dtype=np.uint8)]
+    with RecordingWriter(path, preallocate_bytes=1 << 20) as writer:
+        offsets = [writer(arr, idx, {'timestamp_ns': 10 * idx}) for idx, arr in enumerate(written)]
+
+    reader = RecordingReader(path)
+    assert len(reader) == len(written)
+    assert list(reader.index['offset']) == offsets
+    assert list(reader.index['timestamp_ns']) == [0, 10, 20, 30, 40]
+    for arr, expected in zip(reader, written):
+        np.testing.assert_array_equal(arr, expected)
+    # The preallocated tail was trimmed
+    assert os.path.getsize(path) < 1 << 20
+
+def test_crashed_recording_is_rescanned(tmp_path):
+    path = str(tmp_path / 'run.arec')
+    written = frames(3)
+    writer = RecordingWriter(path, preallocate_bytes=1 << 20)
+    for idx, arr in enumerate(written):
+        writer(arr, idx, {})
+    writer.sync()
+    # Crash while the last frame was written: no index, last frame cut off
+    end = writer.offset
+    writer.f.close()
+    with open(path, 'r+b') as f:
+        f.truncate(end - 100)
+
+    reader = RecordingReader(path)
+    assert len(reader) == 2
+    for arr, expected in zip(reader, written):
+        np.testing.assert_array_equal(arr, expected)
+
+def test_recording_resumes_from_sync_state(tmp_path):
+    path = str(tmp_path / 'run.arec')
+    written = frames(6)
+    writer = RecordingWriter(path, preallocate_bytes=1 << 20)
+    for idx in range(3):
+        writer(written[idx], idx, {})
+    state = writer.sync()
+    # Written after the checkpoint but lost with the crash
+    writer(written[5], 3, {})
+    writer.f.close()
+
+    with RecordingWriter(path, resume=state) as writer:
+        for idx in range(3, 6):
+            writer(written[idx], idx, {})
+
+    reader = RecordingReader(path)
+    assert list(reader.index['frame_id']) == list(range(6))
+    for arr, expected in zip(reader, written):
+        np.testing.assert_array_equal(arr, expected)
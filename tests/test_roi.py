@@ -0,0 +1,58 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import numpy as np
+
+import fake_arena
+import constants
+from roi import plan_roi, set_roi, crop_image, get_bits_per_pixel
+
+PRESET = {'width': 40, 'height': 21, 'offset_x': 'center', 'offset_y': 'center'}
+
+def test_roi_is_aligned_centered_and_applied(monkeypatch):
+    monkeypatch.setitem(constants.ROI_PRESETS, 'test', PRESET)
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    full_fps = nodemap.get_node('AcquisitionFrameRate').max
+
+    roi = plan_roi(nodemap, PRESET)
+    # Width inc 16 / min 16, height inc 2 on a 64x48 sensor
+    assert (roi['width'], roi['height'], roi['offset_x'], roi['offset_y']) == (32, 20, 16, 14)
+    assert roi['on_device'] and roi['frame_bytes'] == 32 * 20
+    assert roi['max_fps'] <= full_fps * 48 / 20
+
+    assert set_roi(nodemap, 'test') is None
+    nodes = nodemap.get_node(['Width', 'Height', 'OffsetX', 'OffsetY'])
+    assert [nodes[name].value for name in ('Width', 'Height', 'OffsetX', 'OffsetY')] == [32, 20, 16, 14]
+
+def test_roi_falls_back_to_a_host_crop(monkeypatch):
+    monkeypatch.setitem(constants.ROI_PRESETS, 'test', PRESET)
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    for name in ('Width', 'Height', 'OffsetX', 'OffsetY'):
+        nodemap.nodes[name].is_writable = False
+
+    crop = set_roi(nodemap, 'test')
+
+    arr = np.arange(48 * 64).reshape(48, 64)
+    cropped = crop_image(arr, crop)
+    assert cropped.shape == (21, 40) and np.shares_memory(cropped, arr)
+    assert cropped[0, 0] == arr[(48 - 21) // 2, (64 - 40) // 2]
+    assert nodemap.nodes['Width'].value == 64
+
+def test_bits_per_pixel_on_the_link():
+    assert get_bits_per_pixel('Mono8') == 8
+    assert get_bits_per_pixel('Mono12') == 16
+    assert get_bits_per_pixel('Mono12p') == get_bits_per_pixel('Mono12Packed') == 12
+    assert get_bits_per_pixel('RGB8') == 24
@@ -0,0 +1,55 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import fake_arena
+from session import SessionManager, load_persist, save_persist
+
+class SyncedWriter:
+    def __init__(self):
+        self.syncs = 0
+
+    def sync(self):
+        self.syncs += 1
+        return {'syncs': self.syncs}
+
+def test_session_checkpoints_and_resumes():
+    device = fake_arena.system.create_device()[0]
+    save_persist({'other': 1})
+
+    session = SessionManager(checkpoint_interval=60)
+    assert session.begin(device, 'run', num_images=10) == ('run', 0)
+    writer = SyncedWriter()
+    session.start(writer)
+    # Several writers finish out of order, 3 is missing
+    for idx in (1, 0, 2, 4, 5):
+        session.frame_done(idx)
+    assert session.next_idx == 3
+    session.stop()
+
+    saved = load_persist()
+    assert saved['other'] == 1
+    assert saved['session']['status'] == 'running' and saved['session']['next_idx'] == 3
+    assert saved['session']['writer'] == {'syncs': writer.syncs}
+
+    # Interrupted run: the next one continues at the first frame not done
+    resumed = SessionManager()
+    assert resumed.begin(device, 'other_run', num_images=10) == ('run', 3)
+    assert resumed.writer_state == saved['session']['writer']
+    resumed.finish()
+    assert load_persist()['session']['status'] == 'complete'
+
+    # A completed session is not resumed
+    assert SessionManager().begin(device, 'new_run', num_images=10) == ('new_run', 0)
@@ -0,0 +1,75 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import os
+
+import numpy as np
+import pytest
+
+import constants
+from stacking import FrameStacker, MAD_TO_STD
+
+def test_welford_matches_numpy():
+    frames = np.random.default_rng(2).integers(0, 4096, (17, 24, 32), dtype=np.uint16)
+    stacker = FrameStacker(constants.PNG_PATH, clip_window=0, noise_maps=True)
+    for idx, arr in enumerate(frames):
+        stacker(arr, idx, {})
+
+    products = stacker.result()
+    np.testing.assert_allclose(products['mean'], frames.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(products['variance'], frames.var(axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_allclose(products['std'], frames.std(axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_array_equal(products['min'], frames.min(axis=0))
+    np.testing.assert_array_equal(products['max'], frames.max(axis=0))
+
+def clipped_mean_reference(frames, clip_window, sigma):
+    total = np.zeros(frames.shape[1:])
+    count = np.zeros(frames.shape[1:])
+    for start in range(0, len(frames), clip_window):
+        window = frames[start:start + clip_window].astype(np.float64)
+        if len(window) < 2:
+            continue
+        deviation = np.abs(window - np.median(window, axis=0))
+        block_std = np.maximum(MAD_TO_STD * np.median(deviation, axis=0), 1.0)
+        keep = deviation <= sigma * block_std
+        total += np.where(keep, window, 0).sum(axis=0)
+        count += keep.sum(axis=0)
+    return total / count
+
+def test_sigma_clip_matches_median_mad_reference():
+    rng = np.random.default_rng(3)
+    frames = (1000 + rng.normal(0, 5, (23, 16, 16))).astype(np.uint16)
+    # Hot pixel in one frame of a window of 8, mean / std clipping would keep it
+    frames[3, 4, 5] = 4095
+
+    stacker = FrameStacker(constants.PNG_PATH, clip_window=8, sigma=3.0)
+    for idx, arr in enumerate(frames):
+        stacker(arr, idx, {})
+    clipped = stacker.result()['clipped_mean']
+
+    np.testing.assert_allclose(clipped, clipped_mean_reference(frames, 8, 3.0), rtol=1e-12)
+    assert abs(clipped[4, 5] - 1000) < 10
+
+def test_stacker_saves_products_and_rejects_other_shapes():
+    stacker = FrameStacker(constants.PNG_PATH, clip_window=4)
+    stacker(np.zeros((8, 8), dtype=np.uint8), 0, {})
+    with pytest.raises(Exception, match='does not match'):
+        stacker(np.zeros((8, 9), dtype=np.uint8), 1, {})
+    stacker.close()
+
+    names = sorted(os.listdir(constants.PNG_PATH))
+    for product in ('mean', 'min', 'max', 'clipped_mean', 'std', 'variance'):
+        assert f'{constants.PNG_NAME}_{product}.npy' in names
@@ -0,0 +1,67 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import pytest
+
+import fake_arena
+import constants
+from trigger import make_schedule, create_trigger
+from multi_capture import configure_devices
+
+def test_times_schedule_honors_num_triggers_and_offset(monkeypatch):
+    monkeypatch.setattr(constants, 'TRIGGER_TIMES', [0.5, 0.0, 0.1, 0.25, 1.0])
+    assert make_schedule('times', num_triggers=10) == [0.0, 0.1, 0.25, 0.5, 1.0]
+    assert make_schedule('times', num_triggers=3) == [0.0, 0.1, 0.25]
+    # Resumed after 2 triggers: the rest, starting at once
+    assert make_schedule('times', num_triggers=8, offset=2) == pytest.approx([0.0, 0.25, 0.75])
+    assert make_schedule('times', num_triggers=8, offset=5) == []
+
+@pytest.mark.parametrize('schedule', ['rate', 'times', 'burst'])
+def test_schedule_resumed_at_the_end_is_empty(monkeypatch, schedule):
+    monkeypatch.setattr(constants, 'NUM_IMAGES', 5)
+    monkeypatch.setattr(constants, 'TRIGGER_TIMES', [0.0, 0.1, 0.2, 0.3, 0.4])
+    offset = constants.NUM_IMAGES
+    assert make_schedule(schedule, num_triggers=constants.NUM_IMAGES - offset, offset=offset) == []
+
+@pytest.mark.parametrize('source', ['Software', 'Line0'])
+def test_trigger_resumed_at_the_end_fires_nothing(monkeypatch, source):
+    monkeypatch.setattr(constants, 'NUM_IMAGES', 5)
+    monkeypatch.setattr(constants, 'TRIGGER_MODE', True)
+    monkeypatch.setattr(constants, 'TRIGGER_SOURCE', source)
+    monkeypatch.setattr(constants, 'TRIGGER_SCHEDULE', 'rate')
+    nodemap = fake_arena.system.create_device()[0].nodemap
+    offset = constants.NUM_IMAGES
+    trigger = create_trigger(nodemap, num_triggers=constants.NUM_IMAGES - offset, offset=offset)
+    assert trigger.num_triggers == 0
+
+def test_burst_schedule_continues_the_burst(monkeypatch):
+    monkeypatch.setattr(constants, 'TRIGGER_BURST_COUNT', 3)
+    monkeypatch.setattr(constants, 'TRIGGER_BURST_INTERVAL', 0.01)
+    monkeypatch.setattr(constants, 'TRIGGER_BURST_PERIOD', 1.0)
+    assert make_schedule('burst', num_triggers=4, offset=2) == pytest.approx([0.0, 0.98, 0.99, 1.0])
+
+def test_software_trigger_rejected_without_scheduler(monkeypatch):
+    monkeypatch.setattr(constants, 'TRIGGER_MODE', True)
+    monkeypatch.setattr(constants, 'TRIGGER_SOURCE', 'Software')
+    with pytest.raises(Exception, match='no software trigger scheduler'):
+        configure_devices(fake_arena.system.create_device())
+
+def test_line_trigger_set_up_by_configure_devices(monkeypatch):
+    monkeypatch.setattr(constants, 'TRIGGER_MODE', True)
+    monkeypatch.setattr(constants, 'TRIGGER_SOURCE', 'Line0')
+    devices = fake_arena.system.create_device()
+    configure_devices(devices)
+    nodemap = devices[0].nodemap
+    assert nodemap['TriggerMode'].value == 'On'
+    assert nodemap['TriggerSource'].value == 'Line0'
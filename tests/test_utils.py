@@ -0,0 +1,60 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+
+
+import numpy as np
+import pytest
+
+import fake_arena
+from utils import buffer_to_ndarray
+from pixel_formats import PixelDecoder
+
+def create_device(pixel_format):
+    device = fake_arena.system.create_device()[0]
+    device.nodemap.nodes['PixelFormat'].value = pixel_format
+    return device
+
+@pytest.mark.parametrize('pixel_format, dtype, shape', [('Mono8', np.uint8, (48, 64)),
+                                                        ('Mono16', np.uint16, (48, 64)),
+                                                        ('RGB8', np.uint8, (48, 64, 3))])
+def test_buffer_to_ndarray_is_a_view_on_the_buffer(pixel_format, dtype, shape):
+    device = create_device(pixel_format)
+    with device.start_stream(2):
+        buffer = device.get_buffer()
+        raw = np.array(buffer.data, dtype=np.uint8)[:int(np.prod(shape)) * np.dtype(dtype).itemsize]
+
+        view = buffer_to_ndarray(buffer)
+        copy = buffer_to_ndarray(buffer, copy=True)
+
+        assert view.dtype == dtype and view.shape == shape
+        np.testing.assert_array_equal(view.reshape(-1).view(np.uint8), raw)
+        np.testing.assert_array_equal(copy, view)
+        # The view follows the driver memory, the copy does not
+        buffer._memory[0] ^= 0xFF
+        assert view.reshape(-1).view(np.uint8)[0] == buffer._memory[0]
+        assert copy.reshape(-1).view(np.uint8)[0] != buffer._memory[0]
+        device.requeue_buffer(buffer)
+
+def test_buffer_to_ndarray_unpacks_packed_formats():
+    device = create_device('Mono12p')
+    with device.start_stream(2):
+        buffer = device.get_buffer()
+        raw = np.array(buffer.data, dtype=np.uint8)
+
+        arr = buffer_to_ndarray(buffer, copy=True)
+
+        assert arr.dtype == np.uint16 and arr.shape == (48, 64)
+        np.testing.assert_array_equal(arr, PixelDecoder('Mono12p', 64, 48).decode(raw))
+        device.requeue_buffer(buffer)
@@ -0,0 +1,348 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2024, Lucid Vision Labs, Inc.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+import os, json, time, threading
+import numpy as np
+
+import constants
+
+"""
+Triggered acquisition
+
+With TRIGGER_MODE the camera exposes a frame only when it is triggered:
+by TriggerSoftware commands issued from TriggerScheduler (TRIGGER_SOURCE =
+'Software') or by an edge on a hardware line (TRIGGER_SOURCE = 'Line0', ...).
+Frames are taken exactly when they are needed instead of free running and
+throwing frames away.
+"""
+
+TRIGGER_SCHEDULES = ('rate', 'times', 'burst')
+
+def set_trigger(nodemap, selector=None, source=None, activation=None):
+    """
+    Turns trigger mode on for selector (FrameStart) with the given source.
+    TriggerMode has to be off while selector and source are changed.
+    """
+    selector = selector or constants.TRIGGER_SELECTOR
+    source = source or constants.TRIGGER_SOURCE
+    activation = activation or constants.TRIGGER_ACTIVATION
+
+    nodes = nodemap.get_node(['TriggerSelector', 'TriggerMode', 'TriggerSource', 'TriggerActivation'])
+    for name in ('TriggerSelector', 'TriggerMode', 'TriggerSource'):
+        if nodes[name] is None or not nodes[name].is_writable:
+            raise Exception(f'{name} is not available, the device can not be triggered')
+    if source not in nodes['TriggerSource'].enumentry_names:
+        raise Exception(f'Trigger source {source} is not supported, use one of {nodes["TriggerSource"].enumentry_names}')
+
+    nodes['TriggerMode'].value = 'Off'
+    nodes['TriggerSelector'].value = selector
+    nodes['TriggerSource'].value = source
+    if source != 'Software' and nodes['TriggerActivation'] is not None and nodes['TriggerActivation'].is_writable:
+        nodes['TriggerActivation'].value = activation
+    nodes['TriggerMode'].value = 'On'
+    print(f'Trigger mode on : {selector} from {source}')
+
+def reset_trigger(nodemap):
+    """
+    Back to free running
+    """
+    trigger_mode = nodemap.get_node('TriggerMode')
+    if trigger_mode is not None and trigger_mode.is_writable:
+        trigger_mode.value = 'Off'
+
+def make_schedule(schedule=None, num_triggers=None, offset=0):
+    """
+    Trigger times in seconds from the start of the scheduler
+        - 'rate'  : num_triggers at TRIGGER_RATE Hz
+        - 'times' : the TRIGGER_TIMES list, at most num_triggers of them
+        - 'burst' : groups of TRIGGER_BURST_COUNT triggers TRIGGER_BURST_INTERVAL
+                    apart, one group every TRIGGER_BURST_PERIOD, num_triggers in total
+    offset is the number of triggers already fired (reconnect, resumed
+    session): the schedule continues with trigger offset, shifted so that
+    it fires at once
+    """
+    schedule = schedule or constants.TRIGGER_SCHEDULE
+    if num_triggers is None:
+        num_triggers = constants.NUM_IMAGES
+    if schedule == 'rate':
+        times = [i / constants.TRIGGER_RATE for i in range(offset, offset + num_triggers)]
+    elif schedule == 'times':
+        times = sorted(constants.TRIGGER_TIMES)[offset:offset + num_triggers]
+    elif schedule == 'burst':
+        count = constants.TRIGGER_BURST_COUNT
+        if (count - 1) * constants.TRIGGER_BURST_INTERVAL >= constants.TRIGGER_BURST_PERIOD:
+            raise Exception('A trigger burst is longer than TRIGGER_BURST_PERIOD')
+        times = [i // count * constants.TRIGGER_BURST_PERIOD + i % count * constants.TRIGGER_BURST_INTERVAL
+                 for i in range(offset, offset + num_triggers)]
+    else:
+        raise Exception(f'Unknown trigger schedule {schedule}, use one of {TRIGGER_SCHEDULES}')
+    return [t - times[0] for t in times] if offset and times else times
+
+def wait_until(target, spin=None):
+    """
+    Sleeps until spin seconds before target, then busy-waits on
+    perf_counter, time.sleep alone overshoots by up to a scheduler tick
+    """
+    spin = constants.TRIGGER_SPIN if spin is None else spin
+    remaining = target - time.perf_counter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while time.perf_counter() < target:
+        pass
+
+def write_timing(path, summary, segments=None):
+    """
+    Trigger sidecar. segments are the summaries of the earlier streams of
+    the same capture (reconnects, resumed session), the latest one is the
+    summary itself
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if segments:
+        summary = dict(summary, segments=list(segments))
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=1)
+
+def load_timing_segments(path):
+    """
+    Summaries in the trigger sidecar of an interrupted run, to continue with
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        summary = json.load(f)
+    segments = summary.pop('segments', [])
+    return segments + [summary]
+
+class TriggerScheduler:
+    """
+    Issues software triggers at the scheduled times from its own thread
+    (1) Wait for the scheduled time (sleep, then spin)
+    (2) Optionally hold the trigger while backpressure() is True, e.g. the
+        writer queue is nearly full, so acquisition is paced to what the
+        writers sustain instead of dropping frames. Held triggers are late,
+        the schedule is not shifted
+    (3) Wait until TriggerArmed (if the device has it), a trigger sent while
+        the camera is not ready would be ignored
+    (4) Execute TriggerSoftware and record the host time
+
+    record_buffer(info, arrival) is called by the consumer for every frame;
+    the n-th frame belongs to the n-th trigger. Latency is arrival minus
+    trigger time, jitter its standard deviation. The device timestamps give
+    the exposure timing error against the schedule, without host latency.
+    """
+    def __init__(self, nodemap, schedule, backpressure=None, armed_timeout=1.0):
+        nodes = nodemap.get_node(['TriggerSoftware', 'TriggerArmed'])
+        self.trigger_software = nodes['TriggerSoftware']
+        self.trigger_armed = nodes['TriggerArmed']
+        if self.trigger_software is None:
+            raise Exception('TriggerSoftware is not available')
+
+        self.schedule = list(schedule)
+        self.backpressure = backpressure
+        self.armed_timeout = armed_timeout
+
+        self.fired = []      # perf_counter of every trigger
+        self.late = []       # seconds after the scheduled time
+        self.arrivals = []
+        self.timestamps = []
+        self.not_armed = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def num_triggers(self):
+        return len(self.schedule)
+
+    def _run(self):
+        start = time.perf_counter() + 0.01
+        for offset in self.schedule:
+            if self.stop_event.is_set():
+                return
+            # (1)
+            target = start + offset
+            wait_until(target)
+
+            # (2)
+            if self.backpressure is not None:
+                while self.backpressure() and not self.stop_event.is_set():
+                    time.sleep(0.0005)
+
+            # (3)
+            if self.trigger_armed is not None:
+                deadline = time.perf_counter() + self.armed_timeout
+                while not self.trigger_armed.value and time.perf_counter() < deadline:
+                    pass
+                if not self.trigger_armed.value:
+                    self.not_armed += 1
+
+            # (4)
+            fired = time.perf_counter()
+            self.trigger_software.execute()
+            with self.lock:
+                self.fired.append(fired)
+                self.late.append(fired - target)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='trigger', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def record_buffer(self, info, arrival=None):
+        with self.lock:
+            self.arrivals.append(arrival if arrival is not None else time.perf_counter())
+            self.timestamps.append(info.get('timestamp_ns'))
+
+    def summary(self):
+        with self.lock:
+            count = min(len(self.fired), len(self.arrivals))
+            latency = np.array(self.arrivals[:count]) - np.array(self.fired[:count])
+            late = np.array(self.late)
+
+            # Exposure timing error: device timestamp intervals against the schedule
+            timestamps = [t for t in self.timestamps[:count] if t is not None]
+            timing_error = np.array([])
+            if len(timestamps) == count and count > 1:
+                actual = np.diff(np.array(timestamps, dtype=np.float64) * 1e-9)
+                planned = np.diff(np.array(self.schedule[:count]))
+                timing_error = actual - planned
+
+            def stats(values):
+                if not len(values):
+                    return {}
+                return {
+                    'mean_ms': float(values.mean() * 1e3),
+                    'std_ms': float(values.std() * 1e3),
+                    'p50_ms': float(np.percentile(values, 50) * 1e3),
+                    'p99_ms': float(np.percentile(values, 99) * 1e3),
+                    'max_ms': float(np.abs(values).max() * 1e3),
+                }
+
+            return {
+                'triggers': len(self.fired),
+                'frames': len(self.arrivals),
+                'missing_frames': len(self.fired) - len(self.arrivals),
+                'not_armed': self.not_armed,
+                'trigger_to_buffer': stats(latency),
+                'trigger_late': stats(late),
+                'interval_error': stats(timing_error),
+            }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('Triggers: %d sent, %d frames, %d missing, %d not armed' % (
+            summary['triggers'], summary['frames'], summary['missing_frames'], summary['not_armed']))
+        for name in ('trigger_to_buffer', 'trigger_late', 'interval_error'):
+            values = summary[name]
+            if values:
+                print('\t%-18s mean %8.3f ms  jitter (std) %8.3f ms  p99 %8.3f ms  max %8.3f ms' % (
+                    name, values['mean_ms'], values['std_ms'], values['p99_ms'], values['max_ms']))
+
+    def write(self, path, segments=None):
+        write_timing(path, self.summary(), segments)
+
+    def save(self, path, segments=None):
+        self.write(path, segments)
+        print(f'Saved trigger timing to {path}')
+
+class LineTriggerMonitor:
+    """
+    Hardware line triggers are not seen by the host, only the device
+    timestamps of the frames are recorded: their interval jitter shows how
+    regular the external trigger and the exposure start are
+    """
+    def __init__(self, num_triggers=None):
+        self.num_triggers = constants.NUM_IMAGES if num_triggers is None else num_triggers
+        self.timestamps = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        print(f'Waiting for {self.num_triggers} triggers on {constants.TRIGGER_SOURCE}')
+
+    def stop(self):
+        pass
+
+    def record_buffer(self, info, arrival=None):
+        with self.lock:
+            self.timestamps.append(info.get('timestamp_ns'))
+
+    def summary(self):
+        with self.lock:
+            timestamps = np.array([t for t in self.timestamps if t is not None], dtype=np.float64) * 1e-9
+        if len(timestamps) < 2:
+            return {'frames': len(timestamps)}
+        intervals = np.diff(timestamps)
+        return {
+            'frames': len(timestamps),
+            'interval_mean_ms': float(intervals.mean() * 1e3),
+            'interval_std_ms': float(intervals.std() * 1e3),
+            'interval_max_ms': float(intervals.max() * 1e3),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        if 'interval_mean_ms' in summary:
+            print('Line trigger: %d frames, interval %.3f ms, jitter (std) %.3f ms' % (
+                summary['frames'], summary['interval_mean_ms'], summary['interval_std_ms']))
+
+    def write(self, path, segments=None):
+        write_timing(path, self.summary(), segments)
+
+    def save(self, path, segments=None):
+        self.write(path, segments)
+        print(f'Saved trigger timing to {path}')
+
+def create_trigger(nodemap, num_triggers=None, backpressure=None, offset=0):
+    """
+    If constants.TRIGGER_MODE is on, sets the trigger up and returns a
+    TriggerScheduler (software) or a LineTriggerMonitor (hardware line),
+    else turns trigger mode off and returns None.
+    offset is the number of frames already captured, see make_schedule
+    """
+    if not constants.TRIGGER_MODE:
+        reset_trigger(nodemap)
+        return None
+
+    set_trigger(nodemap)
+    if constants.TRIGGER_SOURCE == 'Software':
+        return TriggerScheduler(nodemap, make_schedule(num_triggers=num_triggers, offset=offset), backpressure=backpressure)
+    return LineTriggerMonitor(num_triggers)
+
+def set_trigger_mode(nodemap, capture_name):
+    """
+    Trigger setup of the captures without a trigger scheduler: free running
+    without TRIGGER_MODE, a hardware line trigger is set up, software
+    triggering is only done by capture.py
+    """
+    if not constants.TRIGGER_MODE:
+        reset_trigger(nodemap)
+        return
+    if constants.TRIGGER_SOURCE == 'Software':
+        raise Exception(f'{capture_name} has no software trigger scheduler, use a hardware TRIGGER_SOURCE, '
+                        f'capture.py or TRIGGER_MODE = False')
+    set_trigger(nodemap)
+
+def report_trigger(trigger, nodemap, png_path, segments=None):
+    if trigger is None:
+        return
+    trigger.stop()
+    trigger.print_summary()
+    trigger.save(png_path + constants.TRIGGER_SUFFIX, segments)
+    reset_trigger(nodemap)
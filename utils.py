@@ -12,43 +12,86 @@
 # -----------------------------------------------------------------------------
 
 
-from arena_api.system import system
 import os, datetime
-from PIL import Image as PIL_Image  # pip install Pillow
 import numpy as np
 from pathlib import Path
 import constants
-import cv2, time
-from arena_api import enums
-from arena_api.system import system
-from arena_api.buffer import BufferFactory
-import matplotlib.pyplot as plt
+import time, ctypes
+from pixel_formats import get_decoder
 
-def create_devices_with_tries():
+"""
+The Arena SDK, OpenCV, Pillow and matplotlib are imported by the functions
+that use them, importing utils only costs NumPy
+"""
+
+def get_system():
+    from arena_api.system import system
+    return system
+
+def get_png_path():
+    """
+    Output path of this run: constants.PNG_PATH, or PNG_ROOT/<date_time>
+    when it is None. Resolved on the first call and stored back, so every
+    writer of a run uses the same directory.
+    """
+    if constants.PNG_PATH is None:
+        constants.PNG_PATH = constants.PNG_ROOT + '/' + datetime.datetime.now().strftime('%Y_%m_%d_%H_%M')
+    return constants.PNG_PATH
+
+def find_device_info(serial=None, system=None):
+    """
+    Device info of the camera with serial (any camera when serial is None)
+    in the current device list, None when it is not enumerated
+    """
+    system = system or get_system()
+    for info in system.device_infos:
+        if serial is None or str(info['serial']) == str(serial):
+            return info
+    return None
+
+def wait_for_device(serial=None, timeout=None, system=None, initial=None, maximum=None):
+    """
+    Polls the device list (enumeration only, no device is opened) until the
+    camera shows up. The poll interval starts at initial seconds and doubles
+    up to maximum, so a camera that comes back is found within a few polls.
+    Returns its device info, None after timeout seconds.
+    """
+    timeout = constants.DEVICE_WAIT_TIMEOUT if timeout is None else timeout
+    initial = constants.RECONNECT_BACKOFF_INITIAL if initial is None else initial
+    maximum = constants.RECONNECT_BACKOFF_MAX if maximum is None else maximum
+    deadline = time.perf_counter() + timeout
+    delay = initial
+    while True:
+        info = find_device_info(serial, system)
+        if info is not None:
+            return info
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, maximum)
+
+def create_devices_with_tries(system=None, timeout=None):
     '''
     Waits for the user to connect a device before raising an exception if it fails
+    system can be replaced by another object with the arena_api system interface
+    The device list is polled with exponential backoff (wait_for_device), a
+    device is used as soon as it is connected instead of after a fixed sleep
     '''
+    timeout = constants.DEVICE_WAIT_TIMEOUT if timeout is None else timeout
     
-    tries = 0
-    tries_max = 6
-    sleep_time_secs = 10
-    devices = None
-    while tries < tries_max:
+    system = system or get_system()
+    devices = system.create_device()
+    if devices:
+        return devices
+
+    print(f'Waiting up to {timeout} secs for a device to be connected!')
+    if wait_for_device(timeout=timeout, system=system) is not None:
         devices = system.create_device()
-        if not devices:
-            print(
-                f'Try {tries+1} of {tries_max}: waiting for {sleep_time_secs} '
-                f'secs for a device to be connected!')
-            for sec_count in range(sleep_time_secs):
-                time.sleep(1)
-                print(f'{sec_count + 1 } seconds passed ',
-                    '.' * sec_count, end='\r')
-            tries += 1
-        else:
+        if devices:
             return devices
-    else:
-        raise Exception(f'No device found! Please connect a device and run '
-                        f'the example again.')
+    raise Exception(f'No device found! Please connect a device and run '
+                    f'the example again.')
         
 def check_initial_values(nodemap):
     print(f"Store initial values")
@@ -92,69 +135,94 @@ def streaming_setup(tl_stream_nodemap):
     tl_stream_nodemap['StreamAutoNegotiatePacketSize'].value = True
     tl_stream_nodemap['StreamPacketResendEnable'].value = True
 
-def save_image_mono8_to_png_with_PIL(image_buffer, png_path, idx):
+# bits per pixel -> (ctypes element, numpy dtype, channels)
+BUFFER_LAYOUTS = {
+    8: (ctypes.c_ubyte, np.uint8, 1),
+    16: (ctypes.c_ushort, np.uint16, 1),
+    24: (ctypes.c_ubyte, np.uint8, 3),
+    32: (ctypes.c_ubyte, np.uint8, 4),
+    48: (ctypes.c_ushort, np.uint16, 3),
+}
+
+def get_buffer_layout(image_buffer):
     """
-    To save an image Pillow needs an array that is shaped to
-    (height, width). In order to obtain such an array we use numpy
-    library
+    Returns (ctypes element, numpy dtype, shape) of the image part of a buffer
     """
-    print(f'Converting image buffer to a numpy array')
+    bits_per_pixel = image_buffer.bits_per_pixel
+    if bits_per_pixel not in BUFFER_LAYOUTS:
+        raise Exception(f'Unsupported bits per pixel for a frame view: {bits_per_pixel}')
 
-    """		
-    Buffer.pdata is a (uint8, ctypes.c_ubyte)
-    Buffer.data is a list of elements each represents one byte. Therefore
-    for Mono8 each element represents a pixel.
-    """
+    c_type, dtype, channels = BUFFER_LAYOUTS[bits_per_pixel]
+    shape = (image_buffer.height, image_buffer.width)
+    if channels > 1:
+        shape = shape + (channels,)
+
+    return c_type, dtype, shape
 
+def buffer_to_ndarray(image_buffer, copy=False):
     """
-    Method 1 (from Buffer.data)
+    Zero-copy conversion of a buffer to a NumPy array (Method 2)
 
-    dtype is uint8 because Buffer.data returns a list or bytes and pixel
-    format is also Mono8.
-    NOTE:
-    if 'ChunkModeActive' node value is True then the Buffer.data is
-    a list of (image data + the chunkdata) so data list needs to be
-    truncated to have image data only.
-    can use either :
-        - device.nodemap['ChunkModeActive'].value   (expensive)
-        - buffer.has_chunkdata                 (less expensive)
+    Buffer.pdata is a (uint8, ctypes.c_ubyte) pointer. For 16 bit formats it
+    is cast to (uint16, c_ushort) so np.ctypeslib.as_array() interprets every
+    two bytes as one pixel. The array is shaped to (height, width) or
+    (height, width, channels), which only covers the image bytes, so chunk
+    data at the end of the buffer is left out without copying.
+
+    The returned array is a view on driver memory and is only valid until
+    the buffer is requeued. Pass copy=True to get an array that owns its
+    data and can outlive device.requeue_buffer().
+    Packed formats are unpacked to uint16 by pixel_formats.PixelDecoder,
+    without copy the result is overwritten by the next packed frame.
     """
-    image_only_data = None
-    if image_buffer.has_chunkdata:
-        # 8 is the number of bits in a byte
-        bytes_pre_pixel = int(image_buffer.bits_per_pixel / 8)
+    if image_buffer.bits_per_pixel not in BUFFER_LAYOUTS:
+        # Packed formats (Mono10p, Mono12p, ...) have no pixel view, they are
+        # unpacked into the decoder's reused output or a new array with copy
+        decoder = get_decoder(image_buffer)
+        return decoder.decode_buffer(image_buffer, out=np.empty_like(decoder.out) if copy else None)
 
-        image_size_in_bytes = image_buffer.height * \
-            image_buffer.width * bytes_pre_pixel
+    c_type, dtype, shape = get_buffer_layout(image_buffer)
 
-        image_only_data = image_buffer.data[:image_size_in_bytes]
-    else:
-        image_only_data = image_buffer.data
+    pdata = ctypes.cast(image_buffer.pdata, ctypes.POINTER(c_type))
+    nparray = np.ctypeslib.as_array(pdata, shape=shape)
+    if nparray.dtype != dtype:
+        nparray = nparray.view(dtype)
 
-    nparray = np.asarray(image_only_data, dtype=np.uint8)
-    # Reshape array for pillow
-    nparray_reshaped = nparray.reshape((
-        image_buffer.height,
-        image_buffer.width
-    ))
+    if copy:
+        return nparray.copy()
+    return nparray
 
+def get_buffer_info(image_buffer):
     """
-    Method 2 (from Buffer.pdata)
-
-    A more general way (not used in this simple example)
+    Per-frame metadata that has to be read before the buffer is requeued
+    """
+    pixel_format = image_buffer.pixel_format
+    return {
+        'frame_id': image_buffer.frame_id,
+        'timestamp_ns': image_buffer.timestamp_ns,
+        'pixel_format': getattr(pixel_format, 'name', str(pixel_format)),
+    }
 
-    Creates an already reshaped array to use directly with
-    pillow.
-    np.ctypeslib.as_array() detects that Buffer.pdata is (uint8, c_ubyte)
-    type so it interprets each byte as an element.
-    For 16Bit images Buffer.pdata must be cast to (uint16, c_ushort)
-    using ctypes.cast(). After casting, np.ctypeslib.as_array() can
-    interpret every two bytes as one array element (a pixel).
+def save_image_mono8_to_png_with_PIL(image_buffer, png_path, idx):
+    """
+    To save an image Pillow needs an array that is shaped to
+    (height, width). In order to obtain such an array we use numpy
+    library
+    """
+    print(f'Converting image buffer to a numpy array')
 
-    Code:
-    nparray_reshaped = np.ctypeslib.as_array( image_buffer.pdata,
-    (image_buffer.height, image_buffer.width))
     """
+    Buffer.data is a list of elements each represents one byte, so
+    converting it costs one Python int per byte. buffer_to_ndarray()
+    builds the array straight from Buffer.pdata instead (Method 2) and
+    only views the image part of the buffer, so chunk data is dropped
+    without slicing or copying.
+    The view points into driver memory, therefore the image has to be
+    saved before the buffer is requeued.
+    """
+    from PIL import Image as PIL_Image  # pip install Pillow
+
+    nparray_reshaped = buffer_to_ndarray(image_buffer)
 
     # Save image
     print(f'Saving image')
@@ -168,6 +236,7 @@ def save_image_mono8_to_png_with_PIL(image_buffer, png_path, idx):
     print(f'Saved image path is: {Path(png_path) / png_name}')
     
 def save_image_opencv(npndarray, png_path, idx):
+    import cv2
     
     if not os.path.isdir(png_path):
         os.makedirs(png_path)
@@ -184,6 +253,7 @@ def show_image(arr):
     Showing image GUI opencv
     """
     # Converting to BGR8 format
+    import matplotlib.pyplot as plt
 
     plt.imshow(arr) 
     plt.title('Captured image')